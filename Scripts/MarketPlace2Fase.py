@@ -1,9 +1,12 @@
 import socket
-import json
 import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from cliente_http import sessao
+from registo import RegistoCircular, exibir_registo
+from protocolo import PoolLigacoes
+from sincronizacao import SincronizacaoProdutores
 
 produtores_rest = []
 produtores = [
@@ -22,33 +25,28 @@ lock = threading.Lock()
 
 RESELL_MARKUP = 0.10
 
-update_logs = []
+update_logs = RegistoCircular()  # Últimas 2000 entradas; detalhe por produto só com nivel_minimo=DEBUG
 
+# Atualização periódica dos produtores socket
+TIMEOUT_PRODUTOR = 5                # Segundos para ligar e para cada leitura de um produtor
+MAXIMO_CONSULTAS_SIMULTANEAS = 16
+sessao.dimensionar(MAXIMO_CONSULTAS_SIMULTANEAS)  # Uma ligação por consulta simultânea
 
-def conectar_produtor(host, port):
-    cliente_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        cliente_socket.connect((host, port))
-        update_logs.append(f"[{datetime.now()}] Conectado ao produtor em {host}:{port}")
-        return cliente_socket
-    except ConnectionRefusedError:
-        update_logs.append(
-            f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor em {host}:{port}. ConnectionRefusedError")
-        return None
-    except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao conectar ao produtor em {host}:{port}: {e}")
-        return None
+# Ligações persistentes aos produtores socket, partilhadas pela atualização, compras e listagens
+pool_produtores = PoolLigacoes(timeout=TIMEOUT_PRODUTOR)
 
+# Ciclo de atualização e subscrições de alterações dos produtores socket
+sincronizacao = SincronizacaoProdutores(produtores, produtos_disponiveis, lock, update_logs, pool_produtores)
 
-def pedir_lista_produtos(cliente_socket, categorias):
+
+# 'produtor' é o destino (host, porta) de um produtor socket
+def pedir_lista_produtos(produtor, categorias):
     try:
         request = {
             "type": "listarProdutos",
             "categorias": categorias
         }
-        cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-        resposta = cliente_socket.recv(4096).decode('utf-8')
-        resposta_json = json.loads(resposta)
+        resposta_json = pool_produtores.pedido_resposta(*produtor, request)
         return resposta_json
     except (ConnectionResetError, ConnectionAbortedError, ConnectionRefusedError, socket.error) as e:
         print(f"Erro ao pedir lista de produtos: {e}")
@@ -59,46 +57,10 @@ def pedir_lista_produtos(cliente_socket, categorias):
 
 
 def atualizar_produtos():
-    while True:
-        for produtor in produtores:
-            cliente_socket = conectar_produtor(produtor['host'], produtor['port'])
-            if cliente_socket:
-                try:
-                    request = {
-                        "type": "listarProdutos",
-                        "categorias": produtor['categorias']
-                    }
-                    cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-                    resposta = cliente_socket.recv(4096).decode('utf-8')
-                    produtos = json.loads(resposta)
-                    if isinstance(produtos, dict):  # Ensure produtos is a dictionary
-                        with lock:
-                            for categoria, lista_produtos in produtos.items():
-                                if isinstance(lista_produtos, list):  # Ensure lista_produtos is a list
-                                    for produto in lista_produtos:
-                                        if isinstance(produto, dict):  # Ensure produto is a dictionary
-                                            taxa_revenda = produto.get('taxa_revenda',
-                                                                       0)  # Provide default value if missing
-                                            produto['preco'] *= (1 + taxa_revenda)
-                                    produtos_disponiveis[categoria] = lista_produtos
-                                    update_logs.append(
-                                        f"[{datetime.now()}] Produtos atualizados de {produtor['host']}:{produtor['port']} - Categoria: {categoria}")
-                                    for produto in lista_produtos:
-                                        update_logs.append(
-                                            f"  - Produto: {produto['nome']}, Quantidade: {produto['quantidade']}, Preço: €{produto['preco']:.2f}")
-                    else:
-                        print(f"Erro: Resposta inesperada do servidor: {produtos}")
-                except (ConnectionRefusedError, ConnectionResetError, socket.error) as e:
-                    update_logs.append(
-                        f"[{datetime.now()}] Erro ao conectar ao produtor {produtor['host']}:{produtor['port']}: {e}")
-                except json.JSONDecodeError as e:
-                    print(f"Erro ao decodificar a resposta JSON: {e}")
-                finally:
-                    cliente_socket.close()
-            else:
-                update_logs.append(
-                    f"[{datetime.now()}] Tentativa de reconexão ao produtor {produtor['host']}:{produtor['port']} falhou.")
-        time.sleep(60)  # Wait for 60 seconds before the next update
+    with ThreadPoolExecutor(max_workers=MAXIMO_CONSULTAS_SIMULTANEAS) as executor:
+        while True:
+            sincronizacao.atualizar_ciclo(executor)
+            time.sleep(60)  # Wait for 60 seconds before the next update
 
 
 def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
@@ -159,9 +121,8 @@ def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
                     "produto": produto,
                     "quantidade": quantidade
                 }
-                cliente_selecionado.sendall(json.dumps(request).encode('utf-8'))
-                resposta = cliente_selecionado.recv(1024).decode('utf-8')
-                resposta_json = json.loads(resposta)
+                # Uma compra não é repetida automaticamente se a ligação cair a meio
+                resposta_json = pool_produtores.pedido_resposta(*cliente_selecionado, request, repetir=False)
 
                 if resposta_json.get("status") == "sucesso":
                     shopping_cart.append({
@@ -182,21 +143,19 @@ def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
         print(f"Erro: Produto '{produto}' não encontrado na categoria '{categoria}'.")
 
 
-def listar_categorias(cliente_socket):
+def listar_categorias(produtor):
     try:
         request = {
             "type": "listarCategorias"
         }
-        cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-        resposta = cliente_socket.recv(1024).decode('utf-8')
-        resposta_json = json.loads(resposta)
+        resposta_json = pool_produtores.pedido_resposta(*produtor, request)
         return resposta_json
     except Exception as e:
         print(f"Erro ao listar categorias: {e}")
         return []
 
 
-def pedir_categorias(clientes_socket):
+def pedir_categorias(produtores_socket):
     categorias_por_produtor.clear()
     threads = []
 
@@ -205,14 +164,14 @@ def pedir_categorias(clientes_socket):
             print(f"Erro: Socket do produtor {produtor_index + 1} é None.")
             return
         try:
-            categorias = listar_categorias(cliente, produtor_index)
+            categorias = listar_categorias(cliente)
             categorias_por_produtor[produtor_index] = categorias
         except ConnectionError as e:
-            update_logs.append(f"Erro ao listar categorias do produtor {produtor_index + 1}: {e}")
+            update_logs.erro("Erro ao listar categorias do produtor %s: %s", produtor_index + 1, e)
         except Exception as e:
-            update_logs.append(f"Erro inesperado ao listar categorias do produtor {produtor_index + 1}: {e}")
+            update_logs.erro("Erro inesperado ao listar categorias do produtor %s: %s", produtor_index + 1, e)
 
-    for index, cliente in enumerate(clientes_socket):
+    for index, cliente in enumerate(produtores_socket):
         thread = threading.Thread(target=listar_categorias_thread, args=(cliente, index))
         threads.append(thread)
         thread.start()
@@ -252,10 +211,7 @@ def exibir_produtos_disponiveis(categorias):
 
 
 def exibir_atualizacoes():
-    print("\n=== Atualizações Recentes ===")
-    for log in update_logs:
-        print(log)
-    print("=============================")
+    exibir_registo(update_logs)
 
 
 def exibir_carrinho():
@@ -292,28 +248,60 @@ def exibir_lucro():
 
 # FUNÇÕES REST
 
+# Função para obter várias categorias de um produtor REST num só pedido.
+# Devolve None se o produtor não tiver a rota /catalogo (versões antigas).
+def obter_catalogo_rest(host, port, categorias=None):
+    url = f"http://{host}:{port}/catalogo"
+    params = {"categorias": ",".join(categorias)} if categorias else None
+    try:
+        response = sessao.get(url, params=params)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 404:
+            update_logs.erro("Erro ao obter catálogo de %s:%s: %s", host, port, response.status_code)
+    except requests.ConnectionError:
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
+    except Exception as e:
+        update_logs.erro("Erro inesperado ao obter catálogo de %s:%s: %s", host, port, e)
+    return None
+
+
 def obter_lista_produtos_rest(host, port, categorias):
     produtos_por_categoria = {}
+
+    catalogo = obter_catalogo_rest(host, port, categorias)
+    if catalogo is not None:
+        for categoria in categorias:
+            produtos = catalogo.get(categoria, [])
+            for produto in produtos:
+                taxa_revenda = produto.get('taxa_revenda', 0)  # Provide default value if missing
+                produto['preco'] *= (1 + taxa_revenda)  # Apply markup
+            produtos_por_categoria[categoria] = produtos
+        update_logs.info("Produtos obtidos de %s:%s para as categorias %s", host, port, ', '.join(categorias))
+        return produtos_por_categoria
+
+    # Produtor sem /catalogo: um pedido por categoria
     for categoria in categorias:
         url = f"http://{host}:{port}/produtos?categoria={categoria}"
         try:
-            response = requests.get(url)
+            response = sessao.get(url)
             if response.status_code == 200:
                 produtos = response.json()
                 for produto in produtos:
                     taxa_revenda = produto.get('taxa_revenda', 0)  # Provide default value if missing
                     produto['preco'] *= (1 + taxa_revenda)  # Apply markup
                 produtos_por_categoria[categoria] = produtos
-                update_logs.append(f"[{datetime.now()}] Produtos obtidos de {host}:{port} para a categoria {categoria}")
+                update_logs.info("Produtos obtidos de %s:%s para a categoria %s", host, port, categoria)
             else:
-                update_logs.append(
-                    f"[{datetime.now()}] Erro ao obter produtos de {host}:{port} para a categoria {categoria}: {response.status_code}")
+                update_logs.erro(
+                    "Erro ao obter produtos de %s:%s para a categoria %s: %s",
+                    host, port, categoria, response.status_code)
                 produtos_por_categoria[categoria] = []
         except requests.ConnectionError:
-            update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}.")
+            update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
             produtos_por_categoria[categoria] = []
         except Exception as e:
-            update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtos de {host}:{port}: {e}")
+            update_logs.erro("Erro inesperado ao obter produtos de %s:%s: %s", host, port, e)
             produtos_por_categoria[categoria] = []
     return produtos_por_categoria
 
@@ -321,23 +309,22 @@ def obter_lista_produtos_rest(host, port, categorias):
 def comprar_produto_rest(host, port, produto_nome, quantidade):
     url = f"http://{host}:{port}/comprar/{produto_nome}/{quantidade}"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
-            update_logs.append(
-                f"[{datetime.now()}] Compra realizada com sucesso de {host}:{port} para o produto {produto_nome}")
+            update_logs.info("Compra realizada com sucesso de %s:%s para o produto %s", host, port, produto_nome)
             return response.json()
         else:
-            update_logs.append(
-                f"[{datetime.now()}] Erro ao comprar produto de {host}:{port}: {response.status_code} - {response.text}")
+            update_logs.erro(
+                "Erro ao comprar produto de %s:%s: %s - %s", host, port, response.status_code, response.text)
             print(
                 f"Erro ao comprar produto de {host}:{port}: {response.status_code} - {response.text}")  # Debug statement
             return None
     except requests.ConnectionError as e:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}. {e}")
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s. %s", host, port, e)
         print(f"Erro: Não foi possível conectar ao produtor REST em {host}:{port}. {e}")  # Debug statement
         return None
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao comprar produto de {host}:{port}: {e}")
+        update_logs.erro("Erro inesperado ao comprar produto de %s:%s: %s", host, port, e)
         print(f"Erro inesperado ao comprar produto de {host}:{port}: {e}")  # Debug statement
         return None
 
@@ -348,40 +335,39 @@ def listar_categorias_rest(host, port):
     """
     url = f"http://{host}:{port}/categorias"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
             return response.json()
         else:
-            update_logs.append(f"[{datetime.now()}] Erro ao obter categorias de {host}:{port}: {response.status_code}")
+            update_logs.erro("Erro ao obter categorias de %s:%s: %s", host, port, response.status_code)
             return []
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}.")
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
         return []
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter categorias de {host}:{port}: {e}")
+        update_logs.erro("Erro inesperado ao obter categorias de %s:%s: %s", host, port, e)
         return []
 
 
 def obter_lista_produtores_rest():
     url = "http://193.136.11.170:5001/produtor"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
             produtores = response.json()
-            update_logs.append(f"[{datetime.now()}] Produtores obtidos do Gestor de Produtores: {produtores}")
+            update_logs.info("Produtores obtidos do Gestor de Produtores: %s", produtores)
             print(f"Produtores obtidos do Gestor de Produtores: {produtores}")  # Debug statement
             return produtores
         else:
-            update_logs.append(
-                f"[{datetime.now()}] Erro ao obter produtores do Gestor de Produtores: {response.status_code}")
+            update_logs.erro("Erro ao obter produtores do Gestor de Produtores: %s", response.status_code)
             print(f"Erro ao obter produtores do Gestor de Produtores: {response.status_code}")  # Debug statement
             return []
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao Gestor de Produtores.")
+        update_logs.erro("Erro: Não foi possível conectar ao Gestor de Produtores.")
         print("Erro: Não foi possível conectar ao Gestor de Produtores.")  # Debug statement
         return []
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtores do Gestor de Produtores: {e}")
+        update_logs.erro("Erro inesperado ao obter produtores do Gestor de Produtores: %s", e)
         print(f"Erro inesperado ao obter produtores do Gestor de Produtores: {e}")  # Debug statement
         return []
 
@@ -393,9 +379,9 @@ def obter_lista_produtores_categorias_rest(categorias_subscritas):
     """
     url = "http://193.136.11.170:5001/produtor"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code != 200:
-            update_logs.append(f"[{datetime.now()}] Erro ao obter produtores: {response.status_code}")
+            update_logs.erro("Erro ao obter produtores: %s", response.status_code)
             print(f"Erro ao obter produtores do Gestor: {response.status_code}")
             return []
 
@@ -410,16 +396,16 @@ def obter_lista_produtores_categorias_rest(categorias_subscritas):
                    for categoria in categorias_subscritas)
         ]
 
-        update_logs.append(f"[{datetime.now()}] Produtores filtrados: {produtores_filtrados}")
+        update_logs.info("Produtores filtrados: %s", produtores_filtrados)
         return produtores_filtrados
 
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao Gestor de Produtores.")
+        update_logs.erro("Erro: Não foi possível conectar ao Gestor de Produtores.")
         print("Erro: Não foi possível conectar ao Gestor de Produtores.")
         return []
 
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtores: {e}")
+        update_logs.erro("Erro inesperado ao obter produtores: %s", e)
         print(f"Erro inesperado ao obter produtores: {e}")
         return []
 
@@ -459,12 +445,14 @@ def iniciar_marketplace():
         else:
             print(
                 f"Produtor Socket {produtor_index + 1} selecionado: {cliente_selecionado['host']}:{cliente_selecionado['port']}")
-            cliente_socket = conectar_produtor(cliente_selecionado['host'], cliente_selecionado['port'])
-            if not cliente_socket:
+            destino = (cliente_selecionado['host'], cliente_selecionado['port'])
+            try:
+                pool_produtores.verificar(*destino)
+            except OSError:
                 print(
                     f"Erro: Não foi possível conectar ao produtor socket {cliente_selecionado['host']}:{cliente_selecionado['port']}")
                 return None, None
-            cliente_selecionado = cliente_socket
+            cliente_selecionado = destino
 
         return cliente_selecionado, is_rest_producer
 
@@ -474,6 +462,7 @@ def iniciar_marketplace():
 
     update_thread = threading.Thread(target=atualizar_produtos, daemon=True)
     update_thread.start()
+    sincronizacao.iniciar_subscricoes()
 
     while True:
         print("\nEscolha uma ação:")
@@ -3,19 +3,29 @@ import threading
 import json
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from cliente_http import sessao
 
-from cryptography.x509 import load_pem_x509_certificate
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding  # Importe o padding aqui
 from cryptography.exceptions import InvalidSignature
 
+from manifesto import verificar_categorias
+from verificacao import CABECALHOS_ASSINATURA, ETAPA_CERTIFICADO, PoolVerificacao, VerificadorCertificados, \
+    ler_resposta_assinada
+
 
 class Marketplace:
-    def __init__(self, manager_url="http://193.136.11.170:5001"):
+    def __init__(self, manager_url="http://193.136.11.170:5001", max_workers=16,
+                 manager_key_path="manager_public_key.pem"):
         self.products = {}
         self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # Uma atualização de cada vez; os leitores não a usam
+        self.max_workers = max_workers
+        sessao.dimensionar(max_workers)  # Sem ligações descartadas quando todas as threads pedem ao mesmo host
         self.manager_url = manager_url
+        # Chave do gestor lida uma vez; certificados e mensagens já verificados ficam em cache
+        self.verifier = VerificadorCertificados(manager_key_path)
+        # Nas listagens seguras as verificações correm no pool enquanto seguem os pedidos seguintes
+        self.verification_pool = PoolVerificacao(self.verifier)
 
     def get_producers_from_config(self, config_file):
         try:
@@ -47,7 +57,7 @@ class Marketplace:
 
     def get_rest_producers(self):
         try:
-            response = requests.get(f"{self.manager_url}/produtor")
+            response = sessao.get(f"{self.manager_url}/produtor")
             response.raise_for_status()
             producers = response.json()
             return producers
@@ -59,13 +69,19 @@ class Marketplace:
         try:
             base_url = f"http://{producer['ip']}:{producer['porta']}"
 
-            categories_response = requests.get(f"{base_url}/categorias")
+            # Todas as categorias num só pedido, se o produtor tiver a rota /catalogo
+            catalog_response = sessao.get(f"{base_url}/catalogo")
+            if catalog_response.status_code != 404:
+                catalog_response.raise_for_status()
+                return [product for products in catalog_response.json().values() for product in products]
+
+            categories_response = sessao.get(f"{base_url}/categorias")
             categories_response.raise_for_status()
             categories = categories_response.json()
 
             all_products = []
             for category in categories:
-                products_response = requests.get(f"{base_url}/produtos", params={"categoria": category})
+                products_response = sessao.get(f"{base_url}/produtos", params={"categoria": category})
                 products_response.raise_for_status()
                 products = products_response.json()
                 all_products.extend(products)
@@ -77,25 +93,32 @@ class Marketplace:
             return []
 
     def update_products(self, file_producers):
-        with self.lock:
-            self.products = {}
-
-            for producer in file_producers:
-                fetched_products = self.fetch_products(producer['producer_ip'], producer['producer_port'])
+        # Tudo é obtido em paralelo para um catálogo novo; os leitores continuam a ver o anterior
+        # até à troca final, por isso nunca esperam pela rede.
+        with self.refresh_lock, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            rest_producers = executor.submit(self.get_rest_producers)
+            fetches = [
+                (f"{producer['producer_ip']}:{producer['producer_port']}",
+                 executor.submit(self.fetch_products, producer['producer_ip'], producer['producer_port']))
+                for producer in file_producers
+            ]
+            fetches += [
+                (f"{producer['ip']}:{producer['porta']}", executor.submit(self.fetch_rest_products, producer))
+                for producer in rest_producers.result()
+            ]
+
+            staging = {}
+            for address, fetch in fetches:
+                fetched_products = fetch.result()
                 if fetched_products:
                     for product in fetched_products:
                         product['preco'] = round(product['preco'], 2)
                         product['preco'] = f"{product['preco']}€"
-                    self.products[f"{producer['producer_ip']}:{producer['producer_port']}"] = fetched_products
+                    staging[address] = fetched_products
 
-            rest_producers = self.get_rest_producers()
-            for producer in rest_producers:
-                fetched_products = self.fetch_rest_products(producer)
-                if fetched_products:
-                    for product in fetched_products:
-                        product['preco'] = round(product['preco'], 2)
-                        product['preco'] = f"{product['preco']}€"
-                    self.products[f"{producer['ip']}:{producer['porta']}"] = fetched_products
+            # O catálogo publicado nunca é alterado depois da troca
+            with self.lock:
+                self.products = staging
 
     def buy_product(self, producer_address, product_name, quantity):
         producer_ip, producer_port = producer_address.split(":")
@@ -124,7 +147,7 @@ class Marketplace:
     def buy_rest_product(self, producer_ip, producer_port, product_name, quantity):
         try:
             base_url = f"http://{producer_ip}:{producer_port}"
-            response = requests.get(f"{base_url}/comprar/{product_name}/{quantity}")
+            response = sessao.get(f"{base_url}/comprar/{product_name}/{quantity}")
             if response.status_code == 200:
                 print(response.text)
             else:
@@ -133,18 +156,9 @@ class Marketplace:
         except requests.exceptions.RequestException as e:
             print(f"Erro ao comprar produto REST de {producer_ip}:{producer_port}")
 
-    def validate_certificate(self, certificate_pem, gestor_public_key_pem, producer_name):
+    def validate_certificate(self, certificate_pem, producer_name):
         try:
-            certificate = load_pem_x509_certificate(certificate_pem, default_backend())
-            gestor_pkey = serialization.load_pem_public_key(
-                gestor_public_key_pem.encode('utf-8'), backend=default_backend()
-            )
-            gestor_pkey.verify(
-                certificate.signature,
-                certificate.tbs_certificate_bytes,
-                padding.PKCS1v15(),
-                certificate.signature_hash_algorithm,
-            )
+            self.verifier.chave_produtor(certificate_pem)
             return True
         except InvalidSignature:
             print(f"Certificado inválido para o produtor {producer_name}")
@@ -153,20 +167,12 @@ class Marketplace:
             print(f"Erro ao processar o certificado: {producer_name}")
             return False
 
-    def validate_signature(self, signature, message, certificate_pem, producer_name):
-        signature = signature.encode("cp437")
-        message_bytes = json.dumps(message).encode('utf-8')
-        certificate = load_pem_x509_certificate(certificate_pem, default_backend())
-        public_key = certificate.public_key()
+    # 'message_bytes' são os bytes da mensagem tal como foram recebidos (ler_resposta_assinada)
+    def validate_signature(self, signature, message_bytes, certificate_pem, producer_name):
         try:
-            public_key.verify(
-                signature,
-                message_bytes,
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
-                hashes.SHA256()
-            )
+            self.verifier.verificar_mensagem(message_bytes, signature, certificate_pem)
             return True
-        except InvalidSignature:
+        except (InvalidSignature, ValueError):
             print(f"Assinatura inválida para o produtor {producer_name}")
             return False
 
@@ -174,30 +180,43 @@ class Marketplace:
         all_secure_products = {}
         rest_producers = self.get_rest_producers()
 
+        # Pedir o manifesto de todos os produtores antes de esperar pela verificação de cada um
+        manifests = []
         for producer in rest_producers:
+            base_url = f"http://{producer['ip']}:{producer['porta']}"
+            manifests.append((producer, base_url, self.request_secure_manifest(base_url, producer['nome'])))
+
+        for producer, base_url, manifest in manifests:
             try:
-                base_url = f"http://{producer['ip']}:{producer['porta']}"
+                producer_products = self.finish_secure_manifest(manifest, producer['nome'])
+                if producer_products is None:
+                    # Produtor sem manifesto: uma resposta assinada por categoria
+                    categories_response = sessao.get(f"{base_url}/secure/categorias", headers=CABECALHOS_ASSINATURA)
+                    categories_response.raise_for_status()
+                    categories_content = self.validate_rest_response(
+                        categories_response, f"categorias de {producer['nome']}", producer['nome'])
+                    if categories_content is None:
+                        continue
 
-                categories_response = requests.get(f"{base_url}/secure/categorias")
-                categories_response.raise_for_status()
-                if not self.validate_rest_response(categories_response, f"categorias de {producer['nome']}",
-                                                   producer['nome']):
-                    continue
+                    categories = categories_content['mensagem']
 
-                categories = categories_response.json()['mensagem']
+                    pending = []
+                    for category in categories:
 
-                producer_products = []
-                for category in categories:
+                        products_response = sessao.get(f"{base_url}/secure/produtos", params={"categoria": category},
+                                                     headers=CABECALHOS_ASSINATURA)
+                        products_response.raise_for_status()
+                        pending.append(self.start_rest_validation(
+                            products_response, f"produtos da categoria {category} de {producer['nome']}",
+                            producer['nome']))
 
-                    products_response = requests.get(f"{base_url}/secure/produtos", params={"categoria": category})
-                    products_response.raise_for_status()
-                    if not self.validate_rest_response(products_response,
-                                                       f"produtos da categoria {category} de {producer['nome']}",
-                                                       producer['nome']):
-                        continue
+                    producer_products = []
+                    for validation in pending:
+                        products_content = self.finish_rest_validation(validation, producer['nome'])
+                        if products_content is None:
+                            continue
 
-                    products = products_response.json()['mensagem']
-                    producer_products.extend(products)
+                        producer_products.extend(products_content['mensagem'])
 
                 if producer_products:
                     all_secure_products[producer['nome']] = producer_products
@@ -206,32 +225,90 @@ class Marketplace:
                 print(f"Erro ao obter produtos REST seguros de {producer['nome']}")
         return all_secure_products
 
-    def validate_rest_response(self, response, request_description, producer_name):
+    # Pede o manifesto (todas as categorias com uma só assinatura, raiz de Merkle, e uma prova de inclusão
+    # por categoria) e entrega a verificação ao pool; devolve a verificação (start_rest_validation) ou None
+    def request_secure_manifest(self, base_url, producer_name):
+        try:
+            response = sessao.get(f"{base_url}/secure/manifesto", headers=CABECALHOS_ASSINATURA)
+            if response.status_code != 200:
+                return None
+            return self.start_rest_validation(response, f"manifesto de {producer_name}", producer_name)
+        except requests.exceptions.RequestException:
+            return None
+
+    # Conclui a verificação do manifesto; devolve os produtos de todas as categorias, ou None se não for válido
+    def finish_secure_manifest(self, manifest, producer_name):
+        if manifest is None:
+            return None
+        try:
+            content = self.finish_rest_validation(manifest, producer_name)
+            if content is None:
+                return None
+
+            categories = verificar_categorias(content['mensagem'], content['categorias'])
+            if categories is None:
+                print(f"Manifesto inválido para o produtor {producer_name}")
+                return None
+            return [product for products in categories.values() for product in products]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    # Lê uma resposta assinada (envelope ou JSON); devolve o conteúdo ou None se estiver malformada
+    def read_rest_response(self, response, request_description, producer_name):
         try:
-            content = response.json()
+            content = ler_resposta_assinada(response)
             required_fields = ['assinatura', 'certificado', 'mensagem']
             if not all(field in content for field in required_fields):
                 print(f"Resposta incompleta para {request_description}")
-                return False
+                return None
+            return content
 
-            signature = content['assinatura']
-            certificate_pem = content['certificado'].encode('utf-8')
-            message = content['mensagem']
-
-            with open("manager_public_key.pem", "r") as f:
-                gestor_public_key_pem = f.read()
-
-            if not self.validate_certificate(certificate_pem, gestor_public_key_pem, producer_name):
-                return False
-
-            if not self.validate_signature(signature, message, certificate_pem, producer_name):
-                return False
-
-            return True
-
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
             print(f"Erro ao processar resposta REST para {producer_name}")
-            return False
+            return None
+
+    # Devolve o conteúdo da resposta se esta for válida, senão None
+    def validate_rest_response(self, response, request_description, producer_name):
+        content = self.read_rest_response(response, request_description, producer_name)
+        if content is None:
+            return None
+
+        certificate_pem = content['certificado']
+        if not self.validate_certificate(certificate_pem, producer_name):
+            return None
+
+        if not self.validate_signature(content['assinatura'], content['mensagem_bytes'], certificate_pem,
+                                       producer_name):
+            return None
+
+        return content
+
+    # Versão de validate_rest_response que não espera pela verificação: devolve (conteúdo, Future com
+    # resultado None se a resposta for válida, senão (etapa, erro)), ou None se a resposta estiver malformada
+    def start_rest_validation(self, response, request_description, producer_name):
+        content = self.read_rest_response(response, request_description, producer_name)
+        if content is None:
+            return None
+        return content, self.verification_pool.verificar(content['mensagem_bytes'], content['assinatura'],
+                                                         content['certificado'])
+
+    # Devolve o conteúdo de uma resposta de start_rest_validation se esta for válida, senão None
+    def finish_rest_validation(self, validation, producer_name):
+        if validation is None:
+            return None
+        content, future = validation
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Erro ao processar o certificado: {producer_name}")
+            return None
+        if result is None:
+            return content
+        if result[0] == ETAPA_CERTIFICADO:
+            print(f"Certificado inválido para o produtor {producer_name}")
+        else:
+            print(f"Assinatura inválida para o produtor {producer_name}")
+        return None
 
     def buy_secure_rest_product(self):
         secure_products = self.fetch_secure_rest_products()
@@ -278,11 +355,13 @@ class Marketplace:
             if producer['nome'] == selected_producer_name:
                 try:
                     base_url = f"http://{producer['ip']}:{producer['porta']}"
-                    response = requests.post(f"{base_url}/secure/comprar/{selected_product['produto']}/{quantity}")
+                    response = sessao.post(f"{base_url}/secure/comprar/{selected_product['produto']}/{quantity}",
+                                           headers=CABECALHOS_ASSINATURA)
 
                     if response.status_code == 200:
                         print("Compra realizada com sucesso")
-                        print(response.json().get('mensagem', 'Resposta do servidor desconhecida'))
+                        content = self.read_rest_response(response, "compra", selected_producer_name)
+                        print(content['mensagem'] if content else 'Resposta do servidor desconhecida')
                     else:
                         print(f"Erro na compra: {response.status_code} - {response.text}")
 
@@ -307,13 +386,14 @@ class Marketplace:
         print("=====================================")
 
     def display_products(self):
-        if not self.products:
+        catalog = self.products  # Catálogo publicado pela última atualização
+        if not catalog:
             print("  Nenhum produto disponível.")
             return
 
         print("=====================================")
         print("  Produtos disponíveis:")
-        for producer_address, products in self.products.items():
+        for producer_address, products in catalog.items():
             print(f"  Produtor {producer_address}:")
 
             categories = set()
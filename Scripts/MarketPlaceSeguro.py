@@ -2,15 +2,18 @@ import socket
 import json
 import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from idlelib.window import add_windows_to_menu
 import requests
+from cliente_http import sessao
+from registo import RegistoCircular, exibir_registo
+from protocolo import PoolLigacoes
+from sincronizacao import SincronizacaoProdutores
+from manifesto import verificar_categorias
+from verificacao import CABECALHOS_ASSINATURA, ETAPA_CERTIFICADO, PoolVerificacao, \
+    VerificadorCertificados, ler_resposta_assinada, verificar_resposta
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
 from cryptography.x509 import load_pem_x509_certificate
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
-from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from jinja2.filters import do_default
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -32,13 +35,28 @@ lock = threading.Lock()
 
 RESELL_MARKUP = 0.10
 
-update_logs = []
+update_logs = RegistoCircular()  # Últimas 2000 entradas; detalhe por produto só com nivel_minimo=DEBUG
+
+# Atualização periódica dos produtores socket
+TIMEOUT_PRODUTOR = 5                # Segundos para ligar e para cada leitura de um produtor
+MAXIMO_CONSULTAS_SIMULTANEAS = 16
+sessao.dimensionar(MAXIMO_CONSULTAS_SIMULTANEAS)  # Uma ligação por consulta simultânea
+
+# Ligações persistentes aos produtores socket, partilhadas pela atualização, compras e listagens
+pool_produtores = PoolLigacoes(timeout=TIMEOUT_PRODUTOR)
+
+# Ciclo de atualização e subscrições de alterações dos produtores socket
+sincronizacao = SincronizacaoProdutores(produtores, produtos_disponiveis, lock, update_logs, pool_produtores,
+                                        chaves=('ip', 'porta'))
 
 # Segurança
 
 from cryptography.x509 import load_pem_x509_certificate
 from cryptography.hazmat.primitives.asymmetric import rsa
 
+verificador = VerificadorCertificados()  # Chave do gestor (./manager_public_key.pem) e certificados já verificados
+pool_verificacao = PoolVerificacao(verificador)  # Verificações em paralelo com os pedidos (listagens seguras)
+
 
 def validar_certificado(certificado_pem, public_key_gestor, nome_produtor, porta_produtor):
     try:
@@ -109,14 +127,12 @@ def validar_resposta_rest(resposta, descricao_requisicao, nome_produtor, public_
 def listar_categorias_seguras(produtor):
     url = f"http://{produtor['ip']}:{produtor['porta']}/secure/categorias"
     try:
-        resposta = requests.get(url, verify=True)
+        resposta = sessao.get(url, headers=CABECALHOS_ASSINATURA, verify=True)
         if resposta.status_code == 200:
-            conteudo = resposta.json()
-            assinatura = conteudo['assinatura']
-            certificado_pem = conteudo['certificado']
+            conteudo = ler_resposta_assinada(resposta)
             mensagem = conteudo['mensagem']
 
-            if validar_request(mensagem, assinatura, certificado_pem):
+            if validar_conteudo(conteudo):
                 # Exibição bonita das categorias
                 print("\nCategorias disponíveis:")
                 for index, categoria in enumerate(mensagem, start=1):
@@ -129,40 +145,86 @@ def listar_categorias_seguras(produtor):
             print(f"Erro ao listar categorias: {resposta.status_code}")
     except requests.RequestException as e:
         print(f"Erro ao conectar ao produtor {produtor['ip']}: {e}")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Resposta assinada inválida do produtor {produtor['ip']}: {e}")
     return None
 
 
 def listar_produtos_seguro(produtor, categoria):
+    return concluir_produtos_seguro(pedir_produtos_seguro(produtor, categoria))
+
+
+# Função para pedir os produtos de uma categoria e entregar a verificação ao pool, sem esperar por ela.
+# Devolve (mensagem, futuro da verificação), ou None se o pedido falhar.
+def pedir_produtos_seguro(produtor, categoria):
     url = f"http://{produtor['ip']}:{produtor['porta']}/secure/produtos?categoria={categoria}"
     try:
-        resposta = requests.get(url, verify=True)
+        resposta = sessao.get(url, headers=CABECALHOS_ASSINATURA, verify=True)
         if resposta.status_code == 200:
-            conteudo = resposta.json()
-            assinatura = conteudo['assinatura']
-            certificado_pem = conteudo['certificado']
-            mensagem = conteudo['mensagem']
-
-            if validar_request(mensagem, assinatura, certificado_pem):
-                return mensagem
-            return None
+            conteudo = ler_resposta_assinada(resposta)
+            return conteudo['mensagem'], validar_conteudo_async(conteudo)
         elif resposta.status_code == 404:
             print(f"Erro: Categoria inexistente para o produtor {produtor['ip']}.")
         else:
             print(f"Erro ao listar produtos: {resposta.status_code}")
     except requests.RequestException as e:
         print(f"Erro ao conectar ao produtor {produtor['ip']}: {e}")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Resposta assinada inválida do produtor {produtor['ip']}: {e}")
     return None
 
 
-def buscar_categorias_e_produtos_seguro(produtor):
-    produtos_disponiveis = {}
+# Função para esperar pela verificação de um pedido de pedir_produtos_seguro; devolve os produtos ou None
+def concluir_produtos_seguro(pedido):
+    if pedido is None:
+        return None
+    mensagem, futuro = pedido
+    if resultado_validacao(futuro):
+        return mensagem
+    return None
 
-    categorias = listar_categorias_seguras(produtor)
-    if categorias:
-        for categoria in categorias:
-            produtos = listar_produtos_seguro(produtor, categoria)
-            if produtos:
-                produtos_disponiveis.setdefault(categoria, []).extend(produtos)
+
+# Função para obter várias categorias (todas, por omissão) validando uma só assinatura.
+# Devolve None se o produtor não tiver manifesto ou se este não for válido.
+def buscar_manifesto_seguro(produtor, categorias=None):
+    url = f"http://{produtor['ip']}:{produtor['porta']}/secure/manifesto"
+    params = {"categorias": ",".join(categorias)} if categorias else None
+    try:
+        resposta = sessao.get(url, params=params, headers=CABECALHOS_ASSINATURA, verify=True)
+        if resposta.status_code != 200:
+            return None
+        conteudo = ler_resposta_assinada(resposta)
+        mensagem = conteudo['mensagem']
+
+        if not validar_conteudo(conteudo):
+            print("Falha na validação da assinatura ou do certificado do manifesto.")
+            return None
+
+        # Cada categoria tem de pertencer à árvore cuja raiz foi assinada, e nenhuma pode faltar
+        produtos = verificar_categorias(mensagem, conteudo['categorias'], categorias or None)
+        if produtos is None:
+            print("Manifesto com categorias que não correspondem à raiz assinada.")
+            return None
+        return {categoria: lista for categoria, lista in produtos.items() if lista}
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        print(f"Erro ao obter manifesto do produtor {produtor['ip']}: {e}")
+    return None
+
+
+def buscar_categorias_e_produtos_seguro(produtor):
+    produtos_disponiveis = buscar_manifesto_seguro(produtor)
+
+    # Produtores sem manifesto: uma resposta assinada por categoria
+    if produtos_disponiveis is None:
+        produtos_disponiveis = {}
+        categorias = listar_categorias_seguras(produtor)
+        if categorias:
+            # Pedir todas as categorias primeiro: as verificações correm enquanto chegam as seguintes
+            pedidos = [(categoria, pedir_produtos_seguro(produtor, categoria)) for categoria in categorias]
+            for categoria, pedido in pedidos:
+                produtos = concluir_produtos_seguro(pedido)
+                if produtos:
+                    produtos_disponiveis.setdefault(categoria, []).extend(produtos)
 
     print("\nProdutos disponíveis:")
     for categoria, produtos in produtos_disponiveis.items():
@@ -215,48 +277,30 @@ def comprar_produto_seguro(cliente_selecionado):
     # Enviar solicitação de compra
     url_compra = f"http://{cliente_selecionado['ip']}:{cliente_selecionado['porta']}/secure/comprar/{produto_selecionado['produto']}/{quantidade}"
     try:
-        resposta = requests.post(url_compra, verify=True)
+        resposta = sessao.post(url_compra, headers=CABECALHOS_ASSINATURA, verify=True)
         if resposta.status_code == 200:
-            conteudo = resposta.json()
-            assinatura = conteudo['assinatura']
-            certificado_pem = conteudo['certificado']
-            mensagem = conteudo['mensagem']
-
-            if validar_request(mensagem, assinatura, certificado_pem):
-                return mensagem
+            conteudo = ler_resposta_assinada(resposta)
+            if validar_conteudo(conteudo):
+                return conteudo['mensagem']
             return None
         else:
             print(f"Erro na compra: {resposta.status_code} - {resposta.text}")
     except requests.RequestException as e:
         print(f"Erro ao conectar ao produtor para realizar a compra: {e}")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Resposta assinada inválida da compra: {e}")
 
 
 # -----------------------------------------------------------------------------------------------------------------------------------------------------
 
-def conectar_produtor(host, port):
-    cliente_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        cliente_socket.connect((host, port))
-        update_logs.append(f"[{datetime.now()}] Conectado ao produtor em {host}:{port}")
-        return cliente_socket
-    except ConnectionRefusedError:
-        update_logs.append(
-            f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor em {host}:{port}. ConnectionRefusedError")
-        return None
-    except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao conectar ao produtor em {host}:{port}: {e}")
-        return None
-
-
-def pedir_lista_produtos(cliente_socket, categorias):
+# 'produtor' é o destino (host, porta) de um produtor socket
+def pedir_lista_produtos(produtor, categorias):
     try:
         request = {
             "type": "listarProdutos",
             "categorias": categorias
         }
-        cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-        resposta = cliente_socket.recv(4096).decode('utf-8')
-        resposta_json = json.loads(resposta)
+        resposta_json = pool_produtores.pedido_resposta(*produtor, request)
         return resposta_json
     except (ConnectionResetError, ConnectionAbortedError, ConnectionRefusedError, socket.error) as e:
         print(f"Erro ao pedir lista de produtos: {e}")
@@ -267,46 +311,10 @@ def pedir_lista_produtos(cliente_socket, categorias):
 
 
 def atualizar_produtos():
-    while True:
-        for produtor in produtores:
-            cliente_socket = conectar_produtor(produtor['ip'], produtor['porta'])
-            if cliente_socket:
-                try:
-                    request = {
-                        "type": "listarProdutos",
-                        "categorias": produtor['categorias']
-                    }
-                    cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-                    resposta = cliente_socket.recv(4096).decode('utf-8')
-                    produtos = json.loads(resposta)
-                    if isinstance(produtos, dict):  # Verifica se é um dicionário
-                        with lock:
-                            for categoria, lista_produtos in produtos.items():
-                                if isinstance(lista_produtos, list):  # Verifica se é uma lista
-                                    for produto in lista_produtos:
-                                        if isinstance(produto, dict):  # Verifica se o produto é um dicionário
-                                            taxa_revenda = produto.get('taxa_revenda',
-                                                                       0)  # Valor padrão caso não exista = 0
-                                            produto['preco'] *= (1 + taxa_revenda)
-                                    produtos_disponiveis[categoria] = lista_produtos
-                                    update_logs.append(
-                                        f"[{datetime.now()}] Produtos atualizados de {produtor['ip']}:{produtor['porta']} - Categoria: {categoria}")
-                                    for produto in lista_produtos:
-                                        update_logs.append(
-                                            f"  - Produto: {produto['nome']}, Quantidade: {produto['quantidade']}, Preço: €{produto['preco']:.2f}")
-                    else:
-                        print(f"Erro: Resposta inesperada do servidor: {produtos}")
-                except (ConnectionRefusedError, ConnectionResetError, socket.error) as e:
-                    update_logs.append(
-                        f"[{datetime.now()}] Erro ao conectar ao produtor {produtor['ip']}:{produtor['porta']}: {e}")
-                except json.JSONDecodeError as e:
-                    print(f"Erro ao decodificar a resposta JSON: {e}")
-                finally:
-                    cliente_socket.close()
-            else:
-                update_logs.append(
-                    f"[{datetime.now()}] Tentativa de reconexão ao produtor {produtor['ip']}:{produtor['porta']} falhou.")
-        time.sleep(60)  # Espera 60 segundos
+    with ThreadPoolExecutor(max_workers=MAXIMO_CONSULTAS_SIMULTANEAS) as executor:
+        while True:
+            sincronizacao.atualizar_ciclo(executor)
+            time.sleep(60)  # Espera 60 segundos
 
 
 def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
@@ -367,9 +375,8 @@ def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
                     "produto": produto,
                     "quantidade": quantidade
                 }
-                cliente_selecionado.sendall(json.dumps(request).encode('utf-8'))
-                resposta = cliente_selecionado.recv(1024).decode('utf-8')
-                resposta_json = json.loads(resposta)
+                # Uma compra não é repetida automaticamente se a ligação cair a meio
+                resposta_json = pool_produtores.pedido_resposta(*cliente_selecionado, request, repetir=False)
 
                 if resposta_json.get("status") == "sucesso":
                     shopping_cart.append({
@@ -390,21 +397,19 @@ def adicionar_ao_carrinho(categoria, produto, quantidade, cliente_selecionado):
         print(f"Erro: Produto '{produto}' não encontrado na categoria '{categoria}'.")
 
 
-def listar_categorias(cliente_socket):
+def listar_categorias(produtor):
     try:
         request = {
             "type": "listarCategorias"
         }
-        cliente_socket.sendall(json.dumps(request).encode('utf-8'))
-        resposta = cliente_socket.recv(1024).decode('utf-8')
-        resposta_json = json.loads(resposta)
+        resposta_json = pool_produtores.pedido_resposta(*produtor, request)
         return resposta_json
     except Exception as e:
         print(f"Erro ao listar categorias: {e}")
         return []
 
 
-def pedir_categorias(clientes_socket):
+def pedir_categorias(produtores_socket):
     global categorias_por_produtor
     categorias_por_produtor.clear()
     threads = []
@@ -414,18 +419,18 @@ def pedir_categorias(clientes_socket):
             print(f"Erro: Socket do produtor {produtor_index + 1} é None.")
             return
         try:
-            categorias = listar_categorias(cliente, produtor_index)
+            categorias = listar_categorias(cliente)
             if categorias:
                 categorias_por_produtor[produtor_index] = categorias
             else:
                 print(f"Produtor {produtor_index + 1} não retornou categorias.")
         except ConnectionError as e:
-            update_logs.append(f"Erro ao listar categorias do produtor {produtor_index + 1}: {e}")
+            update_logs.erro("Erro ao listar categorias do produtor %s: %s", produtor_index + 1, e)
         except Exception as e:
-            update_logs.append(f"Erro inesperado ao listar categorias do produtor {produtor_index + 1}: {e}")
+            update_logs.erro("Erro inesperado ao listar categorias do produtor %s: %s", produtor_index + 1, e)
 
     # Criar e iniciar threads para cada cliente
-    for index, cliente in enumerate(clientes_socket):
+    for index, cliente in enumerate(produtores_socket):
         thread = threading.Thread(target=listar_categorias_thread, args=(cliente, index))
         threads.append(thread)
         thread.start()
@@ -468,10 +473,7 @@ def exibir_produtos_disponiveis(produtor):
 
 
 def exibir_atualizacoes():
-    print("\n=== Atualizações Recentes ===")
-    for log in update_logs:
-        print(log)
-    print("=============================")
+    exibir_registo(update_logs)
 
 
 def exibir_carrinho():
@@ -508,29 +510,61 @@ def exibir_lucro():
 
 # FUNÇÕES REST
 
+# Função para obter várias categorias de um produtor REST num só pedido.
+# Devolve None se o produtor não tiver a rota /catalogo (versões antigas).
+def obter_catalogo_rest(host, port, categorias=None):
+    url = f"http://{host}:{port}/catalogo"
+    params = {"categorias": ",".join(categorias)} if categorias else None
+    try:
+        response = sessao.get(url, params=params)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 404:
+            update_logs.erro("Erro ao obter catálogo de %s:%s: %s", host, port, response.status_code)
+    except requests.ConnectionError:
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
+    except Exception as e:
+        update_logs.erro("Erro inesperado ao obter catálogo de %s:%s: %s", host, port, e)
+    return None
+
+
 def obter_lista_produtos_rest(host, port, categorias):
     produtos_por_categoria = {}
+
+    catalogo = obter_catalogo_rest(host, port, categorias)
+    if catalogo is not None:
+        for categoria in categorias:
+            produtos = catalogo.get(categoria, [])
+            for produto in produtos:
+                taxa_revenda = produto.get('taxa_revenda', 0)  # Valor padrão = 0
+                produto['preco'] *= (1 + taxa_revenda)  # Aplica a taxa
+            produtos_por_categoria[categoria] = produtos
+        update_logs.info("Produtos obtidos de %s:%s para as categorias %s", host, port, ', '.join(categorias))
+        return produtos_por_categoria
+
+    # Produtor sem /catalogo: um pedido a /secure/categorias por categoria
     for categoria in categorias:
         url = f"http://{host}:{port}/secure/categorias"
 
         try:
-            response = requests.get(url)
+            response = sessao.get(url)
             if response.status_code == 200:
                 produtos = response.json()
                 for produto in produtos:
                     taxa_revenda = produto.get('taxa_revenda', 0)  # Valor padrão = 0
                     produto['preco'] *= (1 + taxa_revenda)  # Aplica a taxa
                 produtos_por_categoria[categoria] = produtos
-                update_logs.append(f"[{datetime.now()}] Produtos obtidos de {host}:{port} para a categoria {categoria}")
+                update_logs.info("Produtos obtidos de %s:%s para a categoria %s", host, port, categoria)
             else:
-                update_logs.append(
-                    f"[{datetime.now()}] Erro ao obter produtos de {host}:{port} para a categoria {categoria}: {response.status_code}")
+                update_logs.erro(
+                    "Erro ao obter produtos de %s:%s para a categoria %s: %s",
+                    host, port, categoria, response.status_code)
                 produtos_por_categoria[categoria] = []
         except requests.ConnectionError:
-            update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}.")
+            update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
             produtos_por_categoria[categoria] = []
         except Exception as e:
-            update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtos de {host}:{port}: {e}")
+            update_logs.erro("Erro inesperado ao obter produtos de %s:%s: %s", host, port, e)
             produtos_por_categoria[categoria] = []
     return produtos_por_categoria
 
@@ -539,23 +573,22 @@ def comprar_produto_rest(host, port, produto_nome):
     url = f"http://{host}:{port}/secure/categorias"
 
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
-            update_logs.append(
-                f"[{datetime.now()}] Compra realizada com sucesso de {host}:{port} para o produto {produto_nome}")
+            update_logs.info("Compra realizada com sucesso de %s:%s para o produto %s", host, port, produto_nome)
             return response.json()
         else:
-            update_logs.append(
-                f"[{datetime.now()}] Erro ao comprar produto de {host}:{port}: {response.status_code} - {response.text}")
+            update_logs.erro(
+                "Erro ao comprar produto de %s:%s: %s - %s", host, port, response.status_code, response.text)
             print(
                 f"Erro ao comprar produto de {host}:{port}: {response.status_code} - {response.text}")  # Debug
             return None
     except requests.ConnectionError as e:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}. {e}")
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s. %s", host, port, e)
         print(f"Erro: Não foi possível conectar ao produtor REST em {host}:{port}. {e}")  # Debug
         return None
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao comprar produto de {host}:{port}: {e}")
+        update_logs.erro("Erro inesperado ao comprar produto de %s:%s: %s", host, port, e)
         print(f"Erro inesperado ao comprar produto de {host}:{port}: {e}")  # Debug
         return None
 
@@ -567,40 +600,39 @@ def listar_categorias_rest(host, port):
     url = f"http://{host}:{port}/secure/categorias"
 
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
             return response.json()
         else:
-            update_logs.append(f"[{datetime.now()}] Erro ao obter categorias de {host}:{port}: {response.status_code}")
+            update_logs.erro("Erro ao obter categorias de %s:%s: %s", host, port, response.status_code)
             return []
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao produtor REST em {host}:{port}.")
+        update_logs.erro("Erro: Não foi possível conectar ao produtor REST em %s:%s.", host, port)
         return []
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter categorias de {host}:{port}: {e}")
+        update_logs.erro("Erro inesperado ao obter categorias de %s:%s: %s", host, port, e)
         return []
 
 
 def obter_lista_produtores_rest():
     url = "http://193.136.11.170:5001/produtor"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code == 200:
             produtores = response.json()
-            update_logs.append(f"[{datetime.now()}] Produtores obtidos do Gestor de Produtores: {produtores}")
+            update_logs.info("Produtores obtidos do Gestor de Produtores: %s", produtores)
             print(f"Produtores obtidos do Gestor de Produtores: {produtores}")  # Debug
             return produtores
         else:
-            update_logs.append(
-                f"[{datetime.now()}] Erro ao obter produtores do Gestor de Produtores: {response.status_code}")
+            update_logs.erro("Erro ao obter produtores do Gestor de Produtores: %s", response.status_code)
             print(f"Erro ao obter produtores do Gestor de Produtores: {response.status_code}")  # Debug
             return []
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao Gestor de Produtores.")
+        update_logs.erro("Erro: Não foi possível conectar ao Gestor de Produtores.")
         print("Erro: Não foi possível conectar ao Gestor de Produtores.")  # Debug
         return []
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtores do Gestor de Produtores: {e}")
+        update_logs.erro("Erro inesperado ao obter produtores do Gestor de Produtores: %s", e)
         print(f"Erro inesperado ao obter produtores do Gestor de Produtores: {e}")  # Debug
         return []
 
@@ -608,26 +640,23 @@ def obter_lista_produtores_rest():
 def obter_lista_produtores_rest_seguro():
     url = "http://193.136.11.170:5001/produtor"
     try:
-        response = requests.get(url, verify=True)  # Set verify to True to verify SSL certificates
+        response = sessao.get(url, verify=True)  # Set verify to True to verify SSL certificates
         if response.status_code == 200:
             produtores = response.json()
             secure_produtores = [produtor for produtor in produtores if produtor.get('secure') == 1]
-            update_logs.append(
-                f"[{datetime.now()}] Produtores seguros obtidos do Gestor de Produtores: {secure_produtores}")
+            update_logs.info("Produtores seguros obtidos do Gestor de Produtores: %s", secure_produtores)
             print(f"Produtores seguros obtidos do Gestor de Produtores: {secure_produtores}")  # Debug
             return secure_produtores
         else:
-            update_logs.append(
-                f"[{datetime.now()}] Erro ao obter produtores do Gestor de Produtores Seguro: {response.status_code}")
+            update_logs.erro("Erro ao obter produtores do Gestor de Produtores Seguro: %s", response.status_code)
             print(f"Erro ao obter produtores do Gestor de Produtores Seguro: {response.status_code}")  # Debug
             return []
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao Gestor de Produtores Seguro.")
+        update_logs.erro("Erro: Não foi possível conectar ao Gestor de Produtores Seguro.")
         print("Erro: Não foi possível conectar ao Gestor de Produtores Seguro.")  # Debug
         return []
     except Exception as e:
-        update_logs.append(
-            f"[{datetime.now()}] Erro inesperado ao obter produtores do Gestor de Produtores Seguro: {e}")
+        update_logs.erro("Erro inesperado ao obter produtores do Gestor de Produtores Seguro: %s", e)
         print(f"Erro inesperado ao obter produtores do Gestor de Produtores Seguro: {e}")  # Debug
         return []
 
@@ -639,9 +668,9 @@ def obter_lista_produtores_categorias_rest(categorias_subscritas):
     """
     url = "http://193.136.11.170:5001/produtor"
     try:
-        response = requests.get(url)
+        response = sessao.get(url)
         if response.status_code != 200:
-            update_logs.append(f"[{datetime.now()}] Erro ao obter produtores: {response.status_code}")
+            update_logs.erro("Erro ao obter produtores: %s", response.status_code)
             print(f"Erro ao obter produtores do Gestor: {response.status_code}")
             return []
 
@@ -665,65 +694,50 @@ def obter_lista_produtores_categorias_rest(categorias_subscritas):
                     "categorias": categorias
                 })
 
-        update_logs.append(f"[{datetime.now()}] Produtores filtrados: {produtores_filtrados}")
+        update_logs.info("Produtores filtrados: %s", produtores_filtrados)
         return produtores_filtrados
 
     except requests.ConnectionError:
-        update_logs.append(f"[{datetime.now()}] Erro: Não foi possível conectar ao Gestor de Produtores.")
+        update_logs.erro("Erro: Não foi possível conectar ao Gestor de Produtores.")
         print("Erro: Não foi possível conectar ao Gestor de Produtores.")
         return []
 
     except Exception as e:
-        update_logs.append(f"[{datetime.now()}] Erro inesperado ao obter produtores: {e}")
+        update_logs.erro("Erro inesperado ao obter produtores: %s", e)
         print(f"Erro inesperado ao obter produtores: {e}")
         return []
 
 
-def validar_request(mensagem, assinatura, certificado_pem):
-    certificado = load_pem_x509_certificate(certificado_pem.encode("utf-8"))
-    public_key = certificado.public_key()
+# Função para validar uma resposta lida com ler_resposta_assinada: verifica os bytes recebidos da mensagem
+def validar_conteudo(conteudo):
+    return mostrar_validacao(verificar_resposta(verificador, conteudo['mensagem_bytes'], conteudo['assinatura'],
+                                                conteudo['certificado']))
 
-    if (isinstance(mensagem, str)):
-        mensagem_decoded = mensagem.encode("utf-8")
-    else:
-        mensagem_decoded = json.dumps(mensagem).encode('utf-8')
 
-    assinatura_decoded = assinatura.encode("cp437")
-    # Abrir Manager Pem
-    try:
-        with open("./manager_public_key.pem", "rb") as key_file:
-            manager_public_key = load_pem_public_key(key_file.read())
-    except Exception as e:
-        print(e)
+# Função para entregar a validação de uma resposta lida com ler_resposta_assinada ao pool; devolve um Future
+def validar_conteudo_async(conteudo):
+    return pool_verificacao.verificar(conteudo['mensagem_bytes'], conteudo['assinatura'], conteudo['certificado'])
 
-    # Validar Certificado
-    try:
-        manager_public_key.verify(
-            certificado.signature,
-            certificado.tbs_certificate_bytes,
-            padding.PKCS1v15(),
-            hashes.SHA256()
-        )
-    except Exception as e:
-        print(f"Erro ao validar Certificado | {e}")
-        return False
 
-    # Validar Assinatura
+# Função para esperar pelo resultado de validar_conteudo_async; devolve True se a resposta for válida
+def resultado_validacao(futuro):
     try:
-        public_key.verify(
-            assinatura_decoded,
-            mensagem_decoded,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-        return True
+        return mostrar_validacao(futuro.result())
     except Exception as e:
         print(f"Erro ao validar Assinatura | {e}")
         return False
 
+
+def mostrar_validacao(resultado):
+    if resultado is None:
+        return True
+    etapa, erro = resultado
+    if etapa == ETAPA_CERTIFICADO:
+        print(f"Erro ao validar Certificado | {erro}")
+    else:
+        print(f"Erro ao validar Assinatura | {erro}")
+    return False
+
 def iniciar_marketplace():
     global produtores_rest
     categorias_subscritas = ["fruta"]
@@ -763,12 +777,14 @@ def iniciar_marketplace():
                 print(f"Produtor {tipo} selecionado: {cliente_selecionado['ip']}:{cliente_selecionado['porta']}")
             else:
                 print(f"Produtor Socket selecionado: {cliente_selecionado['ip']}:{cliente_selecionado['porta']}")
-                cliente_socket = conectar_produtor(cliente_selecionado['ip'], cliente_selecionado['porta'])
-                if not cliente_socket:
+                destino = (cliente_selecionado['ip'], cliente_selecionado['porta'])
+                try:
+                    pool_produtores.verificar(*destino)
+                except OSError:
                     print(
                         f"Erro: Não foi possível conectar ao produtor socket {cliente_selecionado['ip']}:{cliente_selecionado['porta']}")
                     return None, None, None
-                cliente_selecionado = cliente_socket
+                cliente_selecionado = destino
 
             return cliente_selecionado, is_rest_producer, is_secure_producer
 
@@ -785,6 +801,7 @@ def iniciar_marketplace():
     if not is_secure_producer:
         update_thread = threading.Thread(target=atualizar_produtos, daemon=True)
         update_thread.start()
+        sincronizacao.iniciar_subscricoes()
 
     while True:
         print("\nEscolha uma ação:")
@@ -792,7 +809,8 @@ def iniciar_marketplace():
         print("2. Listar categorias seguros")
         print("3. Listar produtos seguros")
         print("4. Comprar produto seguro")
-        print("5. Sair")
+        print("5. Ver atualizações")
+        print("6. Sair")
         option = input("Opção: ")
 
         if option == "1":
@@ -814,6 +832,9 @@ def iniciar_marketplace():
             print(compra)
 
         elif option == "5":
+            exibir_atualizacoes()
+
+        elif option == "6":
             print("A sair do Marketplace.")
             break
         else:
@@ -1,32 +1,35 @@
 import argparse
+import logging
 import os
 from flask import Flask, jsonify, request
 import json
 import requests
+from cliente_http import sessao
+from registo_produtores import adicionar_argumentos_registo, configurar_registo
+from servidor_wsgi import adicionar_argumentos_servidor, servir
+from estado_partilhado import CatalogoReplica, ligar_estado
+from persistencia import ErroDiario, StockREST, adicionar_argumentos_stock, catalogo_modelo
 import threading
 import time
+from catalogo import ler_itens_encomenda, SUCESSO, PRODUTO_INEXISTENTE, QUANTIDADE_INSUFICIENTE
+from subscricoes import CursorAlteracoes, LimiteSubscricoes, eventos
 
 app = Flask(__name__)
+registo = logging.getLogger("ProdREST2Fase")  # Configurado em __main__ (configurar_registo)
 
 
-# Função para carregar produtos de um arquivo JSON
-def load_produtos(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-
-# Caminho do script e do arquivo JSON
+# Caminho do script
 script_dir = os.path.dirname(os.path.abspath(__file__))
-produtos_file_path = os.path.join(script_dir, 'produtos.json')
 
-# Carregar lista inicial de produtos
-produtos = load_produtos(produtos_file_path)
+# Catálogo do modelo produtos.json (em __main__ passa a ser o do stock persistente)
+catalogo = catalogo_modelo(script_dir)  # Índice por nome, locks por produto e registo de alterações
+limite_subscricoes = LimiteSubscricoes()  # Cada subscrição /eventos ocupa uma thread do servidor
 
 
 # Rota para listar categorias
 @app.route('/categorias', methods=['GET'])
 def listar_categorias():
-    categorias = list(produtos.keys())
+    categorias = catalogo.categorias()
     return jsonify(categorias), 200
 
 
@@ -34,24 +37,99 @@ def listar_categorias():
 @app.route('/produtos', methods=['GET'])
 def listar_produtos():
     categoria = request.args.get('categoria')
-    if categoria in produtos:
-        return jsonify(produtos[categoria]), 200
+    instantaneo = catalogo.instantaneo(categoria)
+    if instantaneo is not None:
+        return jsonify(list(instantaneo)), 200
     else:
         return jsonify({"erro": "Categoria Inexistente"}), 404
 
 
+# Rota para obter várias categorias (todas, se 'categorias' for omitido) num só pedido
+@app.route('/catalogo', methods=['GET'])
+def listar_catalogo():
+    pedidas = request.args.get('categorias')
+    if pedidas:
+        categorias = dict.fromkeys(categoria.strip() for categoria in pedidas.split(','))
+    else:
+        categorias = catalogo.categorias()
+    instantaneos = {categoria: catalogo.instantaneo(categoria) for categoria in categorias}
+    return jsonify({categoria: list(lista) for categoria, lista in instantaneos.items() if lista is not None}), 200
+
+
+# Rota para obter só os produtos alterados desde uma versão do catálogo
+# (?desde=<versão>&instancia=<id>[&categorias=a,b]); sem versão conhecida, pede a ressincronização
+@app.route('/alteracoes', methods=['GET'])
+def listar_alteracoes():
+    pedidas = request.args.get('categorias')
+    categorias = [categoria.strip() for categoria in pedidas.split(',')] if pedidas else None
+    resposta = catalogo.resposta_alteracoes(request.args.get('instancia'), request.args.get('desde', type=int),
+                                            categorias)
+    return jsonify(resposta), 200
+
+
+# Rota de subscrição (Server-Sent Events): um evento "alteracoes" por cada lote de compras,
+# no formato de /alteracoes, a partir da posição indicada (?desde=&instancia=[&categorias=a,b]).
+# Acima do limite de subscrições responde 503: o marketplace continua com o ciclo periódico.
+@app.route('/eventos', methods=['GET'])
+def subscrever_alteracoes():
+    if not limite_subscricoes.entrar():
+        return jsonify({"erro": "Demasiadas subscrições"}), 503, {'Retry-After': '30'}
+    pedidas = request.args.get('categorias')
+    categorias = [categoria.strip() for categoria in pedidas.split(',')] if pedidas else None
+    cursor = CursorAlteracoes(catalogo, request.args.get('instancia'), request.args.get('desde', type=int),
+                              categorias)
+
+    def gerar():
+        for evento in eventos(cursor):
+            yield f"event: alteracoes\ndata: {json.dumps(evento)}\n\n"
+
+    resposta = app.response_class(gerar(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    resposta.call_on_close(limite_subscricoes.sair)
+    return resposta
+
+
 # Rota para comprar uma quantidade de um produto específico
 @app.route('/comprar/<produto>/<int:quantidade>', methods=['GET'])
 def comprar_produto(produto, quantidade):
-    for categoria, items in produtos.items():
-        for item in items:
-            if item['nome'].lower() == produto.lower():
-                if item['quantidade'] >= quantidade:
-                    item['quantidade'] -= quantidade
-                    return jsonify({"mensagem": "Produtos comprados"}), 200
-                else:
-                    return jsonify({"erro": "Quantidade indisponível"}), 404
-    return jsonify({"erro": "Produto inexistente"}), 404
+    try:
+        resultado, _, _ = catalogo.comprar_por_nome(produto, quantidade)
+    except ErroDiario as e:
+        registo.error("Compra não registada: %s", e)
+        return jsonify({"erro": "Compra não registada"}), 503
+    if resultado == PRODUTO_INEXISTENTE:
+        return jsonify({"erro": "Produto inexistente"}), 404
+
+    if resultado == SUCESSO:
+        return jsonify({"mensagem": "Produtos comprados"}), 200
+    else:
+        return jsonify({"erro": "Quantidade indisponível"}), 404
+
+
+# Rota para uma encomenda de vários produtos, feita por inteiro ou não feita
+# (corpo: {"itens": [{"produto": nome, "quantidade": n[, "categoria": c]}, ...]})
+@app.route('/encomendar', methods=['POST'])
+def encomendar():
+    itens = ler_itens_encomenda(request.get_json(silent=True))
+    if itens is None:
+        return jsonify({"erro": "Encomenda inválida"}), 400
+
+    try:
+        resultado, posicao, produtos_afetados = catalogo.reservar(itens)
+    except ErroDiario as e:
+        registo.error("Encomenda não registada: %s", e)
+        return jsonify({"erro": "Encomenda não registada"}), 503
+    if resultado == SUCESSO:
+        return jsonify({
+            "mensagem": "Produtos comprados",
+            "produtos": [{"categoria": categoria, "nome": produto["nome"], "quantidade": produto["quantidade"]}
+                         for categoria, produto in produtos_afetados]
+        }), 200
+    if resultado == QUANTIDADE_INSUFICIENTE:
+        return jsonify({"erro": "Quantidade indisponível", "item": posicao,
+                        "disponivel": produtos_afetados[0][1]["quantidade"]}), 404
+    if resultado == PRODUTO_INEXISTENTE:
+        return jsonify({"erro": "Produto inexistente", "item": posicao}), 404
+    return jsonify({"erro": "Categoria inexistente", "item": posicao}), 404
 
 
 # Função para registrar o produtor no Gestor de Fornecedores
@@ -63,15 +141,15 @@ def registrar_no_gestor(ip, porta, nome):
         "nome": nome
     }
     try:
-        response = requests.post(url, json=data)
+        response = sessao.post(url, json=data)
         if response.status_code == 201:
-            print("Novo produtor registrado com sucesso.")
+            registo.info("Novo produtor registrado com sucesso.")
         elif response.status_code == 200:
-            print("Informações do produtor atualizadas com sucesso.")
+            registo.info("Informações do produtor atualizadas com sucesso.")
         else:
-            print(f"Erro ao registrar produtor: {response.status_code} - {response.text}")
+            registo.error("Erro ao registrar produtor: %s - %s", response.status_code, response.text)
     except requests.ConnectionError:
-        print("Erro: Não foi possível conectar ao Gestor de Produtores.")
+        registo.error("Erro: Não foi possível conectar ao Gestor de Produtores.")
 
 
 # Função para registar periodicamente o produtor REST a cada 5 minutos
@@ -90,7 +168,16 @@ if __name__ == "__main__":
     # Argumentos de linha de comando para definir a porta
     parser = argparse.ArgumentParser(description='Start the producer server.')
     parser.add_argument('--port', type=int, default=5006, help='Port number to run the producer server on.')
+    parser.add_argument('--debug', action='store_true', help='Run Flask in debug mode (reloader and debugger).')
+    adicionar_argumentos_stock(parser, "ProdREST2Fase")
+    adicionar_argumentos_servidor(parser)
+    adicionar_argumentos_registo(parser)
     args = parser.parse_args()
+    configurar_registo("ProdREST2Fase", args)
+
+    # Stock persistente do produtor (diário de compras), ver persistencia.StockREST
+    stock = StockREST(args, script_dir, "ProdREST2Fase", catalogo)
+    catalogo = stock.catalogo
 
     host = "localhost"
     port = args.port
@@ -99,9 +186,35 @@ if __name__ == "__main__":
     # Converter 'localhost' para '127.0.0.1' para validação do IP
     ip = "127.0.0.1" if host == "localhost" else host
 
-    # Registrar o produtor e iniciar o registro periódico
-    registrar_no_gestor(ip, port, nome)
-    iniciar_registro_periodico(ip, port, nome)
-
-    # Iniciar o servidor Flask
-    app.run(host=host, port=port, debug=True)
+    if not args.producao:
+        # Registrar o produtor e iniciar o registro periódico
+        registrar_no_gestor(ip, port, nome)
+        iniciar_registro_periodico(ip, port, nome)
+
+        # Iniciar o servidor Flask
+        stock.iniciar()
+        try:
+            app.run(host=host, port=port, debug=args.debug)
+        finally:
+            stock.fechar()
+    else:
+        # Vários workers: o catálogo autoritativo fica num processo à parte e cada worker usa uma réplica
+        stock.partilhar()
+        # Metade das threads de cada worker, no máximo, presas em subscrições
+        limite_subscricoes.maximo = max(1, args.threads // 2)
+
+        def iniciar_worker():
+            global catalogo
+            if stock.endereco_estado is not None:
+                configurar_registo("ProdREST2Fase", args)  # A thread de escrita do registo não passa o fork
+                catalogo = CatalogoReplica(ligar_estado(stock.endereco_estado, stock.chave_estado))
+
+        def iniciar_registo_gestor():
+            stock.iniciar()
+            registrar_no_gestor(ip, port, nome)
+            iniciar_registro_periodico(ip, port, nome)
+
+        try:
+            servir(app, host, port, args.workers, args.threads, iniciar_worker, iniciar_registo_gestor)
+        finally:
+            stock.fechar()
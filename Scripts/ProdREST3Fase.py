@@ -1,38 +1,57 @@
 import argparse
+import logging
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, has_request_context, jsonify, request, stream_with_context
 import json
-import requests
+from cliente_http import sessao
+from registo_produtores import adicionar_argumentos_registo, configurar_registo
+from servidor_wsgi import adicionar_argumentos_servidor, servir
+from estado_partilhado import INTERVALO_SINCRONIZACAO, CatalogoReplica, ligar_estado
+from persistencia import ErroDiario, StockREST, adicionar_argumentos_stock, catalogo_modelo
 import threading
 import time
+from collections import OrderedDict
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.x509 import load_pem_x509_certificate
+from catalogo import ler_itens_encomenda, SUCESSO, PRODUTO_INEXISTENTE, QUANTIDADE_INSUFICIENTE
+from manifesto import construir_manifesto
+from subscricoes import CursorAlteracoes, LimiteSubscricoes, eventos
+from verificacao import CABECALHO_ASSINATURA, CABECALHO_CODIFICACAO, CABECALHO_ENVELOPE, CABECALHO_TAMANHO_MENSAGEM, \
+    CODIFICACAO_BASE64, CODIFICACAO_CP437, TIPO_ENVELOPE, codificar_assinatura
 
 app = Flask(__name__)
+registo = logging.getLogger("ProdREST3Fase")  # Configurado em __main__ (configurar_registo)
 
 chave_privada = None
 chave_publica = None
 certificate = None
+certificado_texto = None  # Certificado já descodificado, para não o descodificar em cada resposta
 
-# Função para carregar produtos de um arquivo JSON
-def load_produtos(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
+# Respostas assinadas já serializadas, indexadas pelo formato (codificação da assinatura ou envelope)
+# e pelos bytes canónicos da mensagem (LRU).
+# Esvaziada sempre que a chave/certificado mudam; as entradas de uma categoria saem quando esta muda.
+MAXIMO_RESPOSTAS_ASSINADAS = 1024
+respostas_assinadas = OrderedDict()
+lock_credenciais = threading.Lock()
 
-# Caminho do script e do arquivo JSON
+# Caminho do script
 script_dir = os.path.dirname(os.path.abspath(__file__))
-produtos_file_path = os.path.join(script_dir, 'produtos.json')
 
-# Carregar lista inicial de produtos
-produtos = load_produtos(produtos_file_path)
+# Catálogo do modelo produtos.json (em __main__ passa a ser o do stock persistente)
+catalogo = catalogo_modelo(script_dir)  # Índice por nome, locks por produto e versões por categoria
+limite_subscricoes = LimiteSubscricoes()  # Cada subscrição /secure/eventos ocupa uma thread do servidor
 
-def criar_chaves_rsa():
-    # Gera as chaves RSA
+# Mensagem de cada categoria e respetivos bytes canónicos, por versão do catálogo
+mensagens_categorias = {}
 
-    global chave_privada, chave_publica
+# Manifestos (árvore de Merkle) já construídos, por conjunto de categorias e respetivas versões
+MAXIMO_MANIFESTOS = 256
+manifestos = {}
 
+def criar_chaves_rsa():
+    # Gera as chaves RSA
     chave_privada = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048
@@ -41,6 +60,44 @@ def criar_chaves_rsa():
 
     return chave_privada, chave_publica
 
+# Função para ativar um novo par de chaves e o respetivo certificado (invalida as respostas assinadas)
+def ativar_credenciais(nova_chave_privada, nova_chave_publica, novo_certificado):
+    global chave_privada, chave_publica, certificate, certificado_texto
+    with lock_credenciais:
+        chave_privada = nova_chave_privada
+        chave_publica = nova_chave_publica
+        certificate = novo_certificado
+        certificado_texto = novo_certificado.decode('utf-8')
+        respostas_assinadas.clear()
+
+# Função para exportar as credenciais ativas (chave privada em PEM e certificado), ou None se ainda não houver
+def exportar_credenciais():
+    with lock_credenciais:
+        chave, certificado = chave_privada, certificate
+    if chave is None:
+        return None
+    pem = chave.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    return pem, certificado
+
+# Função (thread de cada worker em modo de produção) para ativar as credenciais que o processo
+# principal publica no estado partilhado sempre que se regista no gestor
+def acompanhar_credenciais(estado):
+    versao = 0
+    while True:
+        try:
+            novas = estado.credenciais(versao)
+            if novas is not None:
+                versao, pem, certificado = novas
+                chave = serialization.load_pem_private_key(pem, password=None)
+                ativar_credenciais(chave, chave.public_key(), certificado)
+        except (OSError, EOFError) as e:
+            registo.error("Erro ao obter as credenciais partilhadas: %s", e)
+        time.sleep(INTERVALO_SINCRONIZACAO)
+
 def serializar_chave_publica(chave_publica):
     """Serializa a chave pública em formato PEM"""
     return chave_publica.public_bytes(
@@ -48,124 +105,289 @@ def serializar_chave_publica(chave_publica):
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     ).decode('utf-8')
 
-# Função para assinar a assinatura
-def assinar_mensagem(message):
+# Função para obter os bytes canónicos que são assinados
+def serializar_mensagem(message):
     if isinstance(message, (list, dict)):
-        message_bytes = json.dumps(message, sort_keys=True).encode('utf-8')
+        return json.dumps(message, sort_keys=True).encode('utf-8')
     elif isinstance(message, str):
-        message_bytes = message.encode('utf-8')
+        return message.encode('utf-8')
     else:
         raise TypeError("A mensagem deve ser uma string ou um objeto JSON serializável.")
 
-    signature = chave_privada.sign(
+# Função para assinar a assinatura
+def assinar_mensagem(message, chave=None, codificacao=CODIFICACAO_CP437):
+    message_bytes = message if isinstance(message, bytes) else serializar_mensagem(message)
+
+    signature = (chave or chave_privada).sign(
         message_bytes,
         padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
         hashes.SHA256()
     )
 
-    # Decodificar usando 'cp437'
+    # Base64 se o cliente o pedir; 'cp437' para os marketplaces antigos
     try:
-        return signature.decode('cp437')
+        return codificar_assinatura(signature, codificacao)
     except UnicodeDecodeError as e:
         raise ValueError(f"Erro ao decodificar assinatura: {e}")
 
+# Função para obter a codificação da assinatura pedida pelo cliente (cabeçalho X-Codificacao-Assinatura)
+def codificacao_pedida():
+    if has_request_context() and request.headers.get(CABECALHO_CODIFICACAO, "").lower() == CODIFICACAO_BASE64:
+        return CODIFICACAO_BASE64
+    return CODIFICACAO_CP437
+
+# Função para obter o corpo JSON de uma resposta assinada; só assina quando a mensagem (ou a chave) mudou.
+# 'anexos' são campos extra não assinados, que têm de ficar determinados pela mensagem (ex.: manifesto).
+# Com guardar=False (mensagens que não se repetem) assina sempre e não ocupa lugar na cache.
+def corpo_assinado(mensagem, message_bytes=None, anexos=None, codificacao=None, guardar=True):
+    if message_bytes is None:
+        message_bytes = serializar_mensagem(mensagem)
+    if codificacao is None:
+        codificacao = codificacao_pedida()
+
+    with lock_credenciais:
+        corpo = respostas_assinadas.get((codificacao, message_bytes)) if guardar else None
+        if corpo is not None:
+            respostas_assinadas.move_to_end((codificacao, message_bytes))
+        chave, texto_certificado = chave_privada, certificado_texto
+
+    if corpo is None:
+        resposta = {
+            "assinatura": assinar_mensagem(message_bytes, chave, codificacao),
+            "certificado": texto_certificado,
+            "mensagem": mensagem
+        }
+        if codificacao != CODIFICACAO_CP437:
+            resposta["codificacao_assinatura"] = codificacao
+        if anexos:
+            resposta.update(anexos)
+        corpo = jsonify(resposta).get_data()
+        with lock_credenciais:
+            # Não guardar respostas assinadas com uma chave entretanto substituída
+            if guardar and chave is chave_privada and MAXIMO_RESPOSTAS_ASSINADAS > 0:
+                respostas_assinadas[(codificacao, message_bytes)] = corpo
+                while len(respostas_assinadas) > MAXIMO_RESPOSTAS_ASSINADAS:
+                    respostas_assinadas.popitem(last=False)
+    return corpo
+
+# Função para saber se o cliente pediu o envelope assinado (cabeçalho X-Envelope-Assinado)
+def envelope_pedido():
+    return has_request_context() and request.headers.get(CABECALHO_ENVELOPE) == "1"
+
+# Função para obter o envelope de uma resposta assinada: (corpo, cabeçalhos). O corpo são os bytes
+# canónicos da mensagem, serializados uma só vez e assinados tal como seguem, mais o certificado e os
+# anexos em JSON.
+def envelope_assinado(mensagem, message_bytes=None, anexos=None):
+    if isinstance(mensagem, str):
+        message_bytes = json.dumps(mensagem).encode('utf-8')  # No envelope a mensagem é sempre JSON
+    elif message_bytes is None:
+        message_bytes = serializar_mensagem(mensagem)
+    chave_cache = (CABECALHO_ENVELOPE, message_bytes)
+
+    with lock_credenciais:
+        envelope = respostas_assinadas.get(chave_cache)
+        if envelope is not None:
+            respostas_assinadas.move_to_end(chave_cache)
+        chave, texto_certificado = chave_privada, certificado_texto
+
+    if envelope is None:
+        corpo = message_bytes + json.dumps(dict(anexos or {}, certificado=texto_certificado),
+                                           separators=(',', ':')).encode('utf-8')
+        cabecalhos = {
+            CABECALHO_ASSINATURA: assinar_mensagem(message_bytes, chave, CODIFICACAO_BASE64),
+            CABECALHO_TAMANHO_MENSAGEM: str(len(message_bytes)),
+        }
+        envelope = (corpo, cabecalhos)
+        with lock_credenciais:
+            if chave is chave_privada and MAXIMO_RESPOSTAS_ASSINADAS > 0:
+                respostas_assinadas[chave_cache] = envelope
+                while len(respostas_assinadas) > MAXIMO_RESPOSTAS_ASSINADAS:
+                    respostas_assinadas.popitem(last=False)
+    return envelope
+
+# Função para construir uma resposta assinada, em envelope ou em JSON conforme o pedido
+def resposta_segura(mensagem, status, message_bytes=None, anexos=None):
+    vary = {'Vary': f"{CABECALHO_ENVELOPE}, {CABECALHO_CODIFICACAO}"}
+    if envelope_pedido():
+        corpo, cabecalhos = envelope_assinado(mensagem, message_bytes, anexos)
+        return app.response_class(corpo, status=status, mimetype=TIPO_ENVELOPE, headers={**cabecalhos, **vary})
+    corpo = corpo_assinado(mensagem, message_bytes, anexos)
+    return app.response_class(corpo, status=status, mimetype='application/json', headers=vary)
+
+# Função para obter a mensagem de uma categoria, reconstruída só quando a categoria muda
+def mensagem_categoria(categoria):
+    versao = catalogo.versao(categoria)
+    guardado = mensagens_categorias.get(categoria)
+    if guardado is not None and guardado[0] == versao:
+        return guardado[1], guardado[2]
+
+    produtos_categoria = [
+        {
+            "categoria": categoria,
+            "produto": item["nome"],
+            "quantidade": item["quantidade"],
+            "preco": item["preco"]
+        }
+        for item in catalogo.instantaneo(categoria)
+    ]
+    message_bytes = serializar_mensagem(produtos_categoria)
+    mensagens_categorias[categoria] = (versao, produtos_categoria, message_bytes)
+
+    # A resposta da versão anterior já não volta a ser pedida
+    if guardado is not None:
+        with lock_credenciais:
+            for formato in (CODIFICACAO_CP437, CODIFICACAO_BASE64, CABECALHO_ENVELOPE):
+                respostas_assinadas.pop((formato, guardado[2]), None)
+    return produtos_categoria, message_bytes
+
+# Função para obter o manifesto de um conjunto de categorias, reconstruído só quando alguma muda
+def manifesto_categorias(categorias):
+    versoes = tuple(catalogo.versao(categoria) for categoria in categorias)
+    guardado = manifestos.get(categorias)
+    if guardado is not None and guardado[0] == versoes:
+        return guardado[1], guardado[2]
+
+    mensagem, categorias_assinadas = construir_manifesto(
+        {categoria: mensagem_categoria(categoria)[0] for categoria in categorias}
+    )
+    if len(manifestos) >= MAXIMO_MANIFESTOS:
+        manifestos.clear()
+    manifestos[categorias] = (versoes, mensagem, categorias_assinadas)
+    return mensagem, categorias_assinadas
+
 
 @app.route('/secure/categorias', methods=['GET'])
 def listar_categorias_seguro():
-    categorias = list(produtos.keys())
-
-    resposta = {
-        "assinatura": assinar_mensagem(categorias),
-        "certificado": certificate.decode('utf-8'),
-        "mensagem": categorias
-    }
-
-    return jsonify(resposta), 200
+    categorias = catalogo.categorias()
+    return resposta_segura(categorias, 200)
 
 @app.route('/secure/produtos', methods=['GET'])
 def listar_produtos_seguro():
     categoria = request.args.get("categoria")
 
-    if categoria and categoria in produtos:
+    if categoria and catalogo.versao(categoria) is not None:
         # Extrair os produtos da categoria solicitada
-        produtos_categoria = [
+        produtos_categoria, message_bytes = mensagem_categoria(categoria)
+        return resposta_segura(produtos_categoria, 200, message_bytes)
+
+    # Caso a categoria não exista ou não seja especificada
+    return resposta_segura("Categoria inexistente ou não especificada", 404)
+
+# Rota para obter várias categorias (todas, se 'categorias' for omitido) com uma só assinatura:
+# é assinada a raiz da árvore de Merkle e cada categoria traz a sua prova de inclusão
+@app.route('/secure/manifesto', methods=['GET'])
+def manifesto_seguro():
+    pedidas = request.args.get("categorias")
+    if pedidas:
+        nomes = dict.fromkeys(nome.strip() for nome in pedidas.split(','))
+        categorias = tuple(nome for nome in nomes if catalogo.versao(nome) is not None)
+    else:
+        categorias = tuple(catalogo.categorias())
+
+    if not categorias:
+        return resposta_segura("Categoria inexistente ou não especificada", 404)
+
+    mensagem, categorias_assinadas = manifesto_categorias(categorias)
+    return resposta_segura(mensagem, 200, anexos={"categorias": categorias_assinadas})
+
+# Função para converter os produtos de uma resposta de alterações para o formato de /secure/produtos
+def formatar_alteracoes_seguras(mensagem):
+    mensagem["alteracoes"] = {
+        categoria: [
             {
                 "categoria": categoria,
                 "produto": item["nome"],
                 "quantidade": item["quantidade"],
                 "preco": item["preco"]
             }
-            for item in produtos[categoria]
+            for item in itens
         ]
-
-        # Montar a resposta
-        resposta = {
-            "assinatura": assinar_mensagem(produtos_categoria),
-            "certificado": certificate.decode('utf-8'),
-            "mensagem": produtos_categoria
-        }
-
-        return jsonify(resposta), 200
-
-    # Caso a categoria não exista ou não seja especificada
-    mensagem_erro = "Categoria inexistente ou não especificada"
-    resposta = {
-        "assinatura": assinar_mensagem(mensagem_erro),
-        "certificado": certificate.decode('utf-8'),
-        "mensagem": mensagem_erro
+        for categoria, itens in mensagem["alteracoes"].items()
     }
-
-    return jsonify(resposta), 404
+    return mensagem
+
+# Rota para obter, assinados, só os produtos alterados desde uma versão do catálogo
+# (?desde=<versão>&instancia=<id>[&categorias=a,b]), no mesmo formato de /secure/produtos
+@app.route('/secure/alteracoes', methods=['GET'])
+def listar_alteracoes_seguro():
+    pedidas = request.args.get("categorias")
+    categorias = [categoria.strip() for categoria in pedidas.split(',')] if pedidas else None
+    mensagem = catalogo.resposta_alteracoes(request.args.get("instancia"), request.args.get("desde", type=int),
+                                            categorias)
+    return resposta_segura(formatar_alteracoes_seguras(mensagem), 200)
+
+# Rota de subscrição (Server-Sent Events): cada evento traz a mesma resposta assinada de /secure/alteracoes.
+# Acima do limite de subscrições responde 503: o marketplace continua com o ciclo periódico.
+@app.route('/secure/eventos', methods=['GET'])
+def subscrever_alteracoes_seguro():
+    if not limite_subscricoes.entrar():
+        return resposta_segura("Demasiadas subscrições", 503)
+    pedidas = request.args.get("categorias")
+    categorias = [categoria.strip() for categoria in pedidas.split(',')] if pedidas else None
+    cursor = CursorAlteracoes(catalogo, request.args.get("instancia"), request.args.get("desde", type=int),
+                              categorias)
+
+    def gerar():
+        for evento in eventos(cursor):
+            # Cada evento é único: assinado diretamente, sem passar pela cache de respostas assinadas
+            corpo = corpo_assinado(formatar_alteracoes_seguras(evento), guardar=False)
+            # Um JSON em várias linhas segue em várias linhas "data:", que o cliente volta a juntar
+            yield b"event: alteracoes\n" + b"".join(b"data: " + linha + b"\n" for linha in corpo.splitlines()) + b"\n"
+
+    resposta = app.response_class(stream_with_context(gerar()), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache'})
+    resposta.call_on_close(limite_subscricoes.sair)
+    return resposta
 
 # Rota para comprar uma quantidade de um produto específico
 @app.route('/secure/comprar/<produto>/<int:quantidade>', methods=['POST'])
 def comprar_produto_seguro(produto, quantidade):
     if quantidade <= 0:
-        resposta = {
-            "assinatura": assinar_mensagem("Quantidade inválida."),
-            "certificado": certificate.decode('utf-8'),
-            "mensagem": "Quantidade inválida."
-        }
-        return jsonify(resposta), 400
-
-    for categoria, itens in produtos.items():
-        # Buscar o produto dentro da lista de itens
-        for item in itens:
-            if item["nome"].lower() == produto.lower():  # Comparação case-insensitive
-                # Verificar se há quantidade suficiente
-                if item["quantidade"] >= quantidade:
-                    item["quantidade"] -= quantidade
-
-                    resposta = {
-                        "assinatura": assinar_mensagem("Sucesso"),
-                        "certificado": certificate.decode('utf-8'),
-                        "mensagem": "Sucesso"
-                    }
-                    return jsonify(resposta), 200
-
-                # Quantidade insuficiente
-                resposta = {
-                    "assinatura": assinar_mensagem("Quantidade indisponível"),
-                    "certificado": certificate.decode('utf-8'),
-                    "mensagem": "Quantidade indisponível"
-                }
-                return jsonify(resposta), 400
-
-    # Produto não encontrado em nenhuma categoria
-    resposta = {
-        "assinatura": assinar_mensagem("Produto inexistente"),
-        "certificado": certificate.decode('utf-8'),
-        "mensagem": "Produto inexistente"
-    }
-    return jsonify(resposta), 404
+        return resposta_segura("Quantidade inválida.", 400)
+
+    try:
+        resultado, categoria, item = catalogo.comprar_por_nome(produto, quantidade)
+    except ErroDiario as e:
+        registo.error("Compra não registada: %s", e)
+        return resposta_segura("Compra não registada", 503)
+    if resultado == SUCESSO:
+        return resposta_segura("Sucesso", 200)
+
+    if resultado == PRODUTO_INEXISTENTE:
+        # Produto não encontrado em nenhuma categoria
+        return resposta_segura("Produto inexistente", 404)
+
+    # Quantidade insuficiente
+    return resposta_segura("Quantidade indisponível", 400)
+
+# Encomenda de vários produtos, feita por inteiro ou não feita
+# (corpo: {"itens": [{"produto": nome, "quantidade": n[, "categoria": c]}, ...]})
+@app.route('/secure/encomendar', methods=['POST'])
+def encomendar_seguro():
+    itens = ler_itens_encomenda(request.get_json(silent=True))
+    if itens is None:
+        return resposta_segura("Encomenda inválida.", 400)
+
+    try:
+        resultado, posicao, _ = catalogo.reservar(itens)
+    except ErroDiario as e:
+        registo.error("Encomenda não registada: %s", e)
+        return resposta_segura("Encomenda não registada", 503)
+    if resultado == SUCESSO:
+        return resposta_segura("Sucesso", 200)
+
+    if resultado == QUANTIDADE_INSUFICIENTE:
+        return resposta_segura(f"Quantidade indisponível: {itens[posicao][1]}", 400)
+
+    # Produto (ou categoria) não encontrado
+    return resposta_segura(f"Produto inexistente: {itens[posicao][1]}", 404)
 
 def registrar_no_gestor_seguro(ip, porta, nome):
     """
     Registra o produtor no Gestor de Produtores com geração de chaves, assinatura da mensagem
     e obtenção do certificado digital.
     """
-    global certificate
-    # Gera as chaves RSA
+    # Gera as chaves RSA (só passam a ser usadas quando o gestor emitir o certificado)
     chave_privada, chave_publica = criar_chaves_rsa()
 
     chave_publica_pem = serializar_chave_publica(chave_publica)
@@ -181,26 +403,28 @@ def registrar_no_gestor_seguro(ip, porta, nome):
 
     try:
         # Envia o registro ao Gestor
-        response = requests.post(url, json=data)
+        response = sessao.post(url, json=data)
 
         # Verifica a resposta do Gestor
         if response.status_code in [200, 201]:
-            # Salva o certificado recebido
-            certificate = response.text.encode('utf-8')
-            print("Certificado obtido com sucesso")
+            # Salva o certificado recebido e passa a assinar com a nova chave
+            ativar_credenciais(chave_privada, chave_publica, response.text.encode('utf-8'))
+            registo.info("Certificado obtido com sucesso")
             return True
         else:
-            print(f"Erro ao registrar produtor: {response.status_code} - {response.text}")
+            registo.error("Erro ao registrar produtor: %s - %s", response.status_code, response.text)
             return False
     except Exception as e:
-        print("Erro de conexão com o gestor:", e)
+        registo.error("Erro de conexão com o gestor: %s", e)
         return False
 
 # Função para registar periodicamente o produtor REST a cada 5 minutos
-def iniciar_registro_periodico_seguro(ip, porta, nome, intervalo=100):
+# ('ao_registar' é chamada depois de cada registo com sucesso)
+def iniciar_registro_periodico_seguro(ip, porta, nome, intervalo=100, ao_registar=None):
     def registrar_periodicamente():
         while True:
-            registrar_no_gestor_seguro(ip, porta, nome)
+            if registrar_no_gestor_seguro(ip, porta, nome) and ao_registar is not None:
+                ao_registar()
             time.sleep(intervalo)  # (100 segundos)
 
     # Iniciar o thread para registro periódico
@@ -212,7 +436,16 @@ if __name__ == "__main__":
     # Argumentos de linha de comando para definir a porta
     parser = argparse.ArgumentParser(description='Start the producer server.')
     parser.add_argument('--port', type=int, default=5007, help='Port number to run the producer server on.')
+    parser.add_argument('--debug', action='store_true', help='Run Flask in debug mode (reloader and debugger).')
+    adicionar_argumentos_stock(parser, "ProdREST3Fase")
+    adicionar_argumentos_servidor(parser)
+    adicionar_argumentos_registo(parser)
     args = parser.parse_args()
+    configurar_registo("ProdREST3Fase", args)
+
+    # Stock persistente do produtor (diário de compras), ver persistencia.StockREST
+    stock = StockREST(args, script_dir, "ProdREST3Fase", catalogo)
+    catalogo = stock.catalogo
 
     host = "localhost"
     port = args.port
@@ -221,9 +454,41 @@ if __name__ == "__main__":
     # Converter 'localhost' para '127.0.0.1' para validação do IP
     ip = "127.0.0.1" if host == "localhost" else host
 
-    # Registrar o produtor e iniciar o registro periódico
-    registrar_no_gestor_seguro(ip, port, nome)
-    iniciar_registro_periodico_seguro(ip, port, nome)
-
-    # Iniciar o servidor Flask
-    app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    if not args.producao:
+        # Registrar o produtor e iniciar o registro periódico
+        registrar_no_gestor_seguro(ip, port, nome)
+        iniciar_registro_periodico_seguro(ip, port, nome)
+
+        # Iniciar o servidor Flask
+        stock.iniciar()
+        try:
+            app.run(host=host, port=port, debug=args.debug)
+        finally:
+            stock.fechar()
+    else:
+        # Vários workers: o catálogo e as credenciais ficam num processo à parte. Só o processo
+        # principal se regista no gestor; cada worker ativa as credenciais que ele publica.
+        stock.partilhar()
+        # Metade das threads de cada worker, no máximo, presas em subscrições
+        limite_subscricoes.maximo = max(1, args.threads // 2)
+
+        def iniciar_worker():
+            global catalogo
+            if stock.endereco_estado is not None:
+                configurar_registo("ProdREST3Fase", args)  # A thread de escrita do registo não passa o fork
+                estado = ligar_estado(stock.endereco_estado, stock.chave_estado)
+                catalogo = CatalogoReplica(estado)
+                threading.Thread(target=acompanhar_credenciais, args=(estado,), daemon=True).start()
+
+        def iniciar_registo_gestor():
+            estado, publicar = None, None
+            if stock.endereco_estado is not None:
+                estado = ligar_estado(stock.endereco_estado, stock.chave_estado)
+                publicar = lambda: estado.publicar_credenciais(*exportar_credenciais())
+            stock.iniciar(estado)
+            iniciar_registro_periodico_seguro(ip, port, nome, ao_registar=publicar)
+
+        try:
+            servir(app, host, port, args.workers, args.threads, iniciar_worker, iniciar_registo_gestor)
+        finally:
+            stock.fechar()
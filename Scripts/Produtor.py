@@ -1,175 +1,194 @@
+import asyncio
 import socket
 import json
 import threading
 import argparse
 import os
+from catalogo import CacheListagens, SUCESSO, QUANTIDADE_INSUFICIENTE, PRODUTO_INEXISTENTE
+from persistencia import ErroDiario, abrir_catalogo, ficheiro_produtor
+from registo_produtores import adicionar_argumentos_registo, configurar_registo
+from subscricoes import servir_subscricao, servir_subscricao_async
+from protocolo import LeitorMensagens, ErroProtocolo, PoolLigacoes, enviar_mensagem, codificar_mensagem, \
+    enquadrar, receber_bytes_async
 import time
 
 conexao = None  # Define conexao as a global variable
 
 parser = argparse.ArgumentParser(description='Start the producer server.')
 parser.add_argument('--port', type=int, default=5006, help='Port number to run the producer server on.')
+parser.add_argument('--host', default="10.8.0.4", help='Host address to bind the producer server to.')
+parser.add_argument('--modo', choices=['threads', 'asyncio'], default='threads',
+                    help='Server mode: one thread per connection or a single asyncio event loop.')
+parser.add_argument('--produtos', default=None,
+                    help='Path to the products JSON file (default: produtos_Produtor_<port>.json, created from produtos.json).')
+adicionar_argumentos_registo(parser)
 args = parser.parse_args()
 
-host = "10.8.0.4"
-port = args.port
-
-# Function to load products from a JSON file
-def load_produtos(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
+# Registo estruturado: as threads que servem pedidos só colocam o registo numa fila
+registo = configurar_registo("Produtor", args)
 
-# Function to save products to a JSON file
-def save_produtos(file_path, produtos):
-    with open(file_path, 'w') as file:
-        json.dump(produtos, file, indent=4)
+host = args.host
+port = args.port
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Construct the path to the JSON file
-produtos_file_path = os.path.join(script_dir, 'produtos.json')
-
-# Load the initial list of products from the JSON file
-produtos = load_produtos(produtos_file_path)
+# Persistent stock of this producer (produtos_Produtor_<port>.json plus its journal), see persistencia.abrir_catalogo
+diario, catalogo = abrir_catalogo(args.produtos or ficheiro_produtor(script_dir, "Produtor", port))
 
 produtores = [
     {"host": "localhost", "port": 5005},
     {"host": "localhost", "port": 5004}
 ]
+pool_produtores = PoolLigacoes(tempo_inativo=30.0, maximo_por_destino=1)
 
-lock = threading.Lock()
-
-# Função para enviar respostas ao cliente
+# Função para enviar respostas ao cliente (bytes = mensagem já enquadrada)
 def enviar_resposta(conexao, dados):
-    conexao.sendall(json.dumps(dados).encode('utf-8'))
+    if isinstance(dados, bytes):
+        conexao.sendall(dados)
+    else:
+        enviar_mensagem(conexao, dados)
+
+# Função para obter um produto no formato das listagens
+def formatar_produto(produto):
+    return {
+        "nome": produto["nome"],
+        "quantidade": produto["quantidade"],
+        "preco": produto["preco"],
+        "taxa_revenda": produto["taxa_revenda"]
+    }
+
+# Função para codificar os produtos de uma categoria com preço de revenda
+def codificar_categoria(instantaneo):
+    return json.dumps([formatar_produto(produto) for produto in instantaneo]).encode('utf-8')
+
+# Respostas de listarProdutos já serializadas e enquadradas; uma compra só invalida a sua categoria
+listagens = CacheListagens(catalogo, codificar_categoria, finalizar=enquadrar)
 
 # Função para listar produtos com preço de revenda
-def listar_produtos(conexao, categorias):
-    with lock:
-        response = {
-            categoria: [
-                {
-                    "nome": produto["nome"],
-                    "quantidade": produto["quantidade"],
-                    "preco": produto["preco"],
-                    "taxa_revenda": produto["taxa_revenda"]
-                }
-                for produto in produtos[categoria]
-                if categoria in produtos
-            ]
-            for categoria in categorias if categoria in produtos
-        }
-    enviar_resposta(conexao, response)
+def listar_produtos(categorias):
+    return listagens.obter(categorias)
 
 # Função para comprar produto
-def comprar(conexao, categoria, produto_nome, quantidade):
+def comprar(categoria, produto_nome, quantidade):
     categoria = categoria.strip().lower()
     produto_nome = produto_nome.strip().lower()
 
-    with lock:
-        if categoria in produtos:
-            for produto in produtos[categoria]:
-                if produto['nome'].strip().lower() == produto_nome:
-                    if produto['quantidade'] >= quantidade:
-                        produto['quantidade'] -= quantidade
-                        save_produtos(produtos_file_path, produtos)  # Save the updated products
-                        response = {
-                            "status": "sucesso",
-                            "mensagem": f"Compra de {quantidade} {produto_nome}(s) realizada com sucesso.",
-                            "preco": produto["preco"],  # Preço do produto
-                            "taxa_revenda": produto["taxa_revenda"]  # Taxa de revenda
-                        }
-                    else:
-                        response = {
-                            "status": "erro",
-                            "mensagem": f"Quantidade insuficiente de {produto_nome}. Disponível: {produto['quantidade']}."
-                        }
-                    break
-            else:
-                response = {
-                    "status": "erro",
-                    "mensagem": f"Produto {produto_nome} não encontrado."
-                }
-        else:
-            response = {
-                "status": "erro",
-                "mensagem": f"Categoria {categoria} não encontrada."
-            }
+    try:
+        resultado, _, produto = catalogo.comprar(categoria, produto_nome, quantidade)
+    except ErroDiario as e:  # O catálogo já desfez a compra
+        registo.error("Compra não registada: %s", e)
+        return {"status": "erro", "mensagem": "Compra não registada: erro ao gravar o stock."}
+
+    if resultado == SUCESSO:
+        response = {
+            "status": "sucesso",
+            "mensagem": f"Compra de {quantidade} {produto_nome}(s) realizada com sucesso.",
+            "preco": produto["preco"],  # Preço do produto
+            "taxa_revenda": produto["taxa_revenda"]  # Taxa de revenda
+        }
+    elif resultado == QUANTIDADE_INSUFICIENTE:
+        response = {
+            "status": "erro",
+            "mensagem": f"Quantidade insuficiente de {produto_nome}. Disponível: {produto['quantidade']}."
+        }
+    elif resultado == PRODUTO_INEXISTENTE:
+        response = {
+            "status": "erro",
+            "mensagem": f"Produto {produto_nome} não encontrado."
+        }
+    else:
+        response = {
+            "status": "erro",
+            "mensagem": f"Categoria {categoria} não encontrada."
+        }
 
-    enviar_resposta(conexao, response)
+    return response
 
 # Função para listar categorias
-def listar_categorias(conexao):
-    with lock:
-        response = list(produtos.keys())
-    enviar_resposta(conexao, response)
+def listar_categorias():
+    return catalogo.categorias()
+
+# Função que obtém a resposta a um pedido (None quando o marketplace se desconecta)
+def processar_pedido(pedido, endereco):
+    tipo_pedido = pedido.get('type')
+    registo.debug("Pedido recebido", extra={"tipo": tipo_pedido, "endereco": endereco})
+
+    if tipo_pedido == "listarProdutos":
+        categorias = pedido.get('categorias', [])
+        return listar_produtos(categorias)
+
+    elif tipo_pedido == "comprar":
+        categoria = pedido.get('categoria')
+        produto = pedido.get('produto')
+        quantidade = pedido.get('quantidade')
+        if categoria and produto and isinstance(quantidade, int):
+            return comprar(categoria, produto, quantidade)
+        return {"status": "erro", "mensagem": "Pedido de compra inválido."}
+
+    elif tipo_pedido == "listarCategorias":
+        return listar_categorias()
+
+    elif tipo_pedido == "alteracoesDesde":
+        # Só os produtos alterados depois da versão que o marketplace já tem
+        return catalogo.resposta_alteracoes(pedido.get('instancia'), pedido.get('versao'),
+                                            pedido.get('categorias'), formatar_produto)
+
+    elif tipo_pedido == "desconectar":
+        registo.debug("Marketplace desconectado", extra={"endereco": endereco})
+        return None
+
+    return {"status": "erro", "mensagem": "Pedido inválido."}
 
 # Função que lida com cada cliente
 def handle_client(conexao, endereco):
-    print(f"Conexão estabelecida com {endereco}")
+    registo.debug("Conexão estabelecida", extra={"endereco": endereco})
+    leitor = LeitorMensagens(conexao)
     try:
         while True:
-            data = conexao.recv(1024)
-            if not data:
-                break
-
             try:
-                pedido = json.loads(data)
+                pedido = leitor.receber()
             except json.JSONDecodeError:
                 enviar_resposta(conexao, {"status": "erro", "mensagem": "Dados inválidos."})
                 continue
+            if pedido is None:
+                break
 
-            tipo_pedido = pedido.get('type')
-            print(f"Recebido pedido: {pedido}")
-
-            if tipo_pedido == "listarProdutos":
-                categorias = pedido.get('categorias', [])
-                listar_produtos(conexao, categorias)
-
-            elif tipo_pedido == "comprar":
-                categoria = pedido.get('categoria')
-                produto = pedido.get('produto')
-                quantidade = pedido.get('quantidade')
-                if categoria and produto and isinstance(quantidade, int):
-                    comprar(conexao, categoria, produto, quantidade)
-                else:
-                    enviar_resposta(conexao, {"status": "erro", "mensagem": "Pedido de compra inválido."})
-
-            elif tipo_pedido == "listarCategorias":
-                listar_categorias(conexao)
-
-            elif tipo_pedido == "desconectar":
-                print(f"Marketplace {endereco} desconectado.")
+            if pedido.get('type') == "subscrever":
+                # A ligação passa a transportar só eventos de alterações até o marketplace a fechar
+                servir_subscricao(conexao, catalogo, pedido, formatar_produto)
                 break
 
-            else:
-                enviar_resposta(conexao, {"status": "erro", "mensagem": "Pedido inválido."})
+            resposta = processar_pedido(pedido, endereco)
+            if resposta is None:
+                break
+            enviar_resposta(conexao, resposta)
 
     except socket.error as e:
-        print(f"Erro de socket: {e}")
+        registo.warning("Erro de socket: %s", e, extra={"endereco": endereco})
+    except ErroProtocolo as e:
+        registo.warning("Erro de protocolo: %s", e, extra={"endereco": endereco})
     finally:
         conexao.close()
 
-# Função para tentar conectar ao produtor
-def conectar_produtor(host, port):
-    try:
-        cliente_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        cliente_socket.connect((host, port))
-        return cliente_socket
-    except socket.error as e:
-        print(f"Erro ao conectar ao produtor em {host}:{port} - {e}")
-        return None
-
-# Função para tentar reconectar periodicamente a produtores indisponíveis
+# Função para verificar periodicamente os outros produtores. Cada produtor tem uma ligação
+# persistente no pool, reutilizada enquanto estiver saudável (sem abrir um socket novo a cada volta).
 def monitorar_produtores(produtores):
+    disponiveis = {}
     while True:
         for produtor in produtores:
-            cliente_socket = conectar_produtor(produtor['host'], produtor['port'])
-            if cliente_socket:
-                print(f"Reconectado ao produtor em {produtor['host']}:{produtor['port']}")
+            destino = (produtor['host'], produtor['port'])
+            # Só avisar quando o estado do produtor muda
+            try:
+                pool_produtores.verificar(*destino)
+            except OSError as e:
+                if disponiveis.get(destino) is not False:
+                    registo.warning("Produtor em %s:%s indisponível: %s", produtor['host'], produtor['port'], e)
+                disponiveis[destino] = False
             else:
-                print(f"Produtor em {produtor['host']}:{produtor['port']} ainda indisponível.")
+                if disponiveis.get(destino) is not True:
+                    registo.info("Reconectado ao produtor em %s:%s", produtor['host'], produtor['port'])
+                disponiveis[destino] = True
         time.sleep(5)  # Tentar reconectar a cada 5 segundos
 
 # Função para iniciar o servidor
@@ -178,13 +197,62 @@ def iniciar_servidor(servidor_host, servidor_port):
     servidor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     servidor_socket.bind((servidor_host, servidor_port))
     servidor_socket.listen()
-    print(f"Servidor iniciado em {servidor_host}:{servidor_port}")
+    registo.info("Servidor iniciado em %s:%s", servidor_host, servidor_port)
 
     while True:
         conexao, endereco = servidor_socket.accept()
         threading.Thread(target=handle_client, args=(conexao, endereco)).start()
 
+# Função que lida com cada cliente no modo asyncio (todas as ligações partilham o mesmo event loop)
+async def handle_client_async(leitor, escritor):
+    endereco = escritor.get_extra_info('peername')
+    registo.debug("Conexão estabelecida", extra={"endereco": endereco})
+    try:
+        while True:
+            corpo = await receber_bytes_async(leitor)
+            if corpo is None:
+                break
+
+            try:
+                pedido = json.loads(corpo)
+            except json.JSONDecodeError:
+                resposta = {"status": "erro", "mensagem": "Dados inválidos."}
+            else:
+                if pedido.get('type') == "subscrever":
+                    await servir_subscricao_async(leitor, escritor, catalogo, pedido, formatar_produto)
+                    break
+                if pedido.get('type') == "comprar":
+                    # A compra bloqueia a listra do produto e espera pelo diário: corre fora do event loop
+                    resposta = await asyncio.get_running_loop().run_in_executor(None, processar_pedido, pedido,
+                                                                                endereco)
+                else:
+                    resposta = processar_pedido(pedido, endereco)
+                if resposta is None:
+                    break
+
+            escritor.write(resposta if isinstance(resposta, bytes) else codificar_mensagem(resposta))
+            await escritor.drain()
+
+    except (ConnectionError, ErroProtocolo) as e:
+        registo.warning("Erro na ligação: %s", e, extra={"endereco": endereco})
+    finally:
+        escritor.close()
+
+# Função para iniciar o servidor num único event loop
+async def iniciar_servidor_async(servidor_host, servidor_port):
+    servidor = await asyncio.start_server(handle_client_async, servidor_host, servidor_port, backlog=1024)
+    registo.info("Servidor (asyncio) iniciado em %s:%s", servidor_host, servidor_port)
+    async with servidor:
+        await servidor.serve_forever()
+
 if __name__ == "__main__":
     threading.Thread(target=monitorar_produtores, args=(produtores,),
                      daemon=True).start()  # Monitorar produtores em segundo plano
-    iniciar_servidor(host, port)
\ No newline at end of file
+    diario.iniciar()
+    try:
+        if args.modo == 'asyncio':
+            asyncio.run(iniciar_servidor_async(host, port))
+        else:
+            iniciar_servidor(host, port)
+    finally:
+        diario.fechar()
\ No newline at end of file
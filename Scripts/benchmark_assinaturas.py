@@ -0,0 +1,123 @@
+import argparse
+import datetime
+import json
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+import ProdREST3Fase
+from manifesto import verificar_categorias
+from verificacao import ler_resposta_assinada
+
+# Benchmark do produtor REST seguro sem precisar do Gestor de Produtores: gera localmente uma
+# chave de "gestor", emite o certificado do produtor e mede pedidos/s às rotas /secure/*
+# com e sem a cache de respostas assinadas. Antes de medir, confirma que o manifesto completo e um
+# pedido de parte das categorias são aceites e que um manifesto a que falte uma categoria é rejeitado.
+
+
+def gerar_chave():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def emitir_certificado(chave_gestor, chave_publica_produtor, nome="ProdREST benchmark"):
+    """Certificado do produtor assinado (PKCS1v15/SHA256) pela chave do gestor, em PEM."""
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    certificado = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nome)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Gestor de Produtores")]))
+        .public_key(chave_publica_produtor)
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora)
+        .not_valid_after(agora + datetime.timedelta(days=1))
+        .sign(chave_gestor, hashes.SHA256())
+    )
+    return certificado.public_bytes(serialization.Encoding.PEM)
+
+
+def preparar_produtor_seguro(chave_gestor=None):
+    """Ativa no ProdREST3Fase uma chave e um certificado emitido localmente; devolve a chave do gestor."""
+    chave_gestor = chave_gestor or gerar_chave()
+    chave_privada, chave_publica = ProdREST3Fase.criar_chaves_rsa()
+    ProdREST3Fase.ativar_credenciais(chave_privada, chave_publica,
+                                     emitir_certificado(chave_gestor, chave_publica))
+    return chave_gestor
+
+
+def medir(cliente, pedidos, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for metodo, url in pedidos:
+            resposta = cliente.open(url, method=metodo)
+            assert resposta.status_code in (200, 400, 404), resposta.status_code
+    duracao = time.perf_counter() - inicio
+    return repeticoes * len(pedidos) / duracao
+
+
+class RespostaGuardada:
+    """Corpo de uma resposta do produtor, com a mesma interface de requests.Response usada pelos marketplaces."""
+
+    def __init__(self, corpo, cabecalhos=None):
+        self.content = corpo
+        self.headers = cabecalhos or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def guardar(resposta):
+    return RespostaGuardada(resposta.get_data(), resposta.headers)
+
+
+def verificar_manifesto(cliente, categorias):
+    conteudo = ler_resposta_assinada(guardar(cliente.get("/secure/manifesto")))
+    assert verificar_categorias(conteudo["mensagem"], conteudo["categorias"]) is not None
+
+    cortado = dict(conteudo["categorias"])
+    del cortado[categorias[-1]]
+    assert verificar_categorias(conteudo["mensagem"], cortado) is None, "manifesto cortado aceite"
+
+    pedidas = categorias[:2] + ["inexistente"]
+    conteudo = ler_resposta_assinada(guardar(
+        cliente.get("/secure/manifesto", query_string={"categorias": ",".join(pedidas)})))
+    assert set(verificar_categorias(conteudo["mensagem"], conteudo["categorias"], pedidas)) == set(categorias[:2])
+    assert verificar_categorias(conteudo["mensagem"], {}, pedidas) is None, "manifesto vazio aceite"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Requests/sec of the secure REST producer with and without the signed-response cache.')
+    parser.add_argument('--repeticoes', type=int, default=100)
+    args = parser.parse_args()
+
+    preparar_produtor_seguro()
+    cliente = ProdREST3Fase.app.test_client()
+    categorias = ProdREST3Fase.catalogo.categorias()
+    verificar_manifesto(cliente, categorias)
+
+    cenarios = {
+        "categorias": [("GET", "/secure/categorias")],
+        "produtos": [("GET", f"/secure/produtos?categoria={categoria}") for categoria in categorias],
+        "manifesto": [("GET", "/secure/manifesto")],
+        "erros constantes": [("GET", "/secure/produtos?categoria=inexistente"),
+                             ("POST", "/secure/comprar/inexistente/1"),
+                             ("POST", "/secure/comprar/banana/0")],
+    }
+
+    maximo = ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS
+    print(f"{'cenário':<18} {'sem cache (pedidos/s)':>22} {'com cache (pedidos/s)':>22} {'ganho':>7}")
+    for nome, pedidos in cenarios.items():
+        ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS = 0
+        ProdREST3Fase.respostas_assinadas.clear()
+        sem_cache = medir(cliente, pedidos, max(1, args.repeticoes // 10))
+
+        ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS = maximo
+        medir(cliente, pedidos, 1)  # Aquecer a cache
+        com_cache = medir(cliente, pedidos, args.repeticoes)
+        print(f"{nome:<18} {sem_cache:>22.0f} {com_cache:>22.0f} {com_cache / sem_cache:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import random
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import MarketPlace2Fase
+from protocolo import receber_mensagem, enviar_mensagem
+
+# Benchmark do ciclo de atualização dos produtores socket do MarketPlace2Fase (sincronizacao.py).
+# Arranca produtores locais que respondem a listarProdutos com uma latência aleatória,
+# mais um produtor parado (aceita a ligação e nunca responde) e um endereço sem ninguém
+# a escutar, e compara o ciclo sequencial (um produtor de cada vez) com o paralelo.
+
+
+class ProdutorSimulado(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        super().__init__(("127.0.0.1", 0), PedidoSimulado)
+
+
+class PedidoSimulado(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            pedido = receber_mensagem(self.request)
+            if pedido is None:
+                return
+            if self.server.latencia is None:
+                time.sleep(3600)  # Produtor parado
+            time.sleep(self.server.latencia)
+            enviar_mensagem(self.request, {
+                categoria: [{"nome": f"{categoria}{i}", "quantidade": 10, "preco": 1.0, "taxa_revenda": 0.1}
+                            for i in range(20)]
+                for categoria in pedido["categorias"]
+            })
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def medir(executor, prazo):
+    inicio = time.perf_counter()
+    MarketPlace2Fase.sincronizacao.atualizar_ciclo(executor, prazo)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh cycle of socket producers: sequential vs concurrent fan-out.')
+    parser.add_argument('--produtores', type=int, default=24)
+    parser.add_argument('--latencia-max', type=float, default=0.2, help='Maximum simulated latency per producer (s).')
+    parser.add_argument('--timeout', type=float, default=1.0, help='Per-producer socket timeout (s).')
+    args = parser.parse_args()
+
+    aleatorio = random.Random(1)
+    latencias = [aleatorio.uniform(0.01, args.latencia_max) for _ in range(args.produtores)]
+    servidores = [ProdutorSimulado(latencia) for latencia in latencias] + [ProdutorSimulado(None)]
+    for servidor in servidores:
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    categorias = ["fruta", "livros", "roupa"]
+    MarketPlace2Fase.produtores[:] = (  # A mesma lista que a sincronização usa
+        [{"host": "127.0.0.1", "port": servidor.server_address[1], "categorias": categorias} for servidor in servidores]
+        + [{"host": "127.0.0.1", "port": porta_livre(), "categorias": categorias}]  # Ninguém a escutar
+    )
+    MarketPlace2Fase.pool_produtores.timeout = args.timeout
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sequencial = medir(executor, None)
+    with ThreadPoolExecutor(max_workers=MarketPlace2Fase.MAXIMO_CONSULTAS_SIMULTANEAS) as executor:
+        paralelo = medir(executor, args.timeout + 1)
+
+    print(f"{args.produtores} produtores (latência 0.01-{args.latencia_max:.2f}s), 1 parado, 1 inexistente; "
+          f"timeout por produtor {args.timeout:.1f}s")
+    print(f"soma das latências: {sum(latencias) + args.timeout:.2f}s   máximo: {max(max(latencias), args.timeout):.2f}s")
+    print(f"{'ciclo':<12} {'duração':>9}")
+    print(f"{'sequencial':<12} {sequencial:>8.2f}s")
+    print(f"{'paralelo':<12} {paralelo:>8.2f}s")
+    print(f"categorias atualizadas: {len(MarketPlace2Fase.produtos_disponiveis)}")
+
+
+if __name__ == "__main__":
+    main()
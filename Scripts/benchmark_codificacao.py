@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import ProdREST3Fase
+from benchmark_assinaturas import preparar_produtor_seguro
+from benchmark_verificacao import RespostaGuardada
+from verificacao import CABECALHO_CODIFICACAO, CABECALHO_ENVELOPE, CODIFICACAO_BASE64, CODIFICACAO_CP437, \
+    codificar_assinatura, ler_resposta_assinada
+
+# Tamanho e custo das respostas assinadas do ProdREST3Fase com a assinatura em cp437 (marketplaces
+# antigos), em base64 (pedida com o cabeçalho X-Codificacao-Assinatura) e em envelope (pedido com
+# X-Envelope-Assinado: bytes canónicos da mensagem no corpo, assinatura e certificado em cabeçalhos),
+# sem o Gestor de Produtores:
+#   bytes     - corpo da resposta de cada rota (no envelope, mais os cabeçalhos da assinatura e do certificado)
+#   produtor  - µs para serializar a mensagem, codificar a assinatura e construir o corpo (sem a operação RSA)
+#   cliente   - µs para ler a resposta e obter os bytes a verificar e os da assinatura (ler_resposta_assinada)
+#   pedido    - µs por pedido ao produtor (Flask test client) sem a cache de respostas assinadas
+
+FORMATOS = (CODIFICACAO_CP437, CODIFICACAO_BASE64, "envelope")
+CAMPOS_ASSINADOS = ("mensagem", "mensagem_bytes", "assinatura", "certificado", "codificacao_assinatura")
+
+
+def medir(funcao, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return (time.perf_counter() - inicio) / repeticoes * 1e6
+
+
+def cabecalhos(formato):
+    if formato == "envelope":
+        return {CABECALHO_ENVELOPE: "1", CABECALHO_CODIFICACAO: CODIFICACAO_BASE64}
+    return {CABECALHO_CODIFICACAO: formato} if formato == CODIFICACAO_BASE64 else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Signed response size and encode/decode cost: cp437, base64 and envelope.')
+    parser.add_argument('--repeticoes', type=int, default=2000)
+    args = parser.parse_args()
+
+    preparar_produtor_seguro()
+    cliente = ProdREST3Fase.app.test_client()
+    rotas = ["/secure/categorias", "/secure/produtos?categoria=fruta", "/secure/manifesto"]
+    maximo = ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS
+    assinar = ProdREST3Fase.assinar_mensagem
+
+    print(f"{'rota':<34} {'formato':<12} {'bytes':>7} {'produtor µs':>12} {'cliente µs':>11} {'pedido µs':>10}")
+    for rota in rotas:
+        for formato in FORMATOS:
+            ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS = maximo
+            recebida = cliente.get(rota, headers=cabecalhos(formato))
+            resposta = RespostaGuardada(recebida.get_data(), recebida.headers)
+            conteudo = ler_resposta_assinada(resposta)
+            tamanho = len(resposta.content)
+            if formato == "envelope":
+                tamanho += sum(len(valor) for nome, valor in recebida.headers.items() if nome.startswith("X-"))
+            else:
+                assert conteudo.get("codificacao_assinatura", CODIFICACAO_CP437) == formato
+            mensagem = conteudo["mensagem"]
+            anexos = {campo: valor for campo, valor in conteudo.items() if campo not in CAMPOS_ASSINADOS}
+            assinatura = conteudo["assinatura"]
+
+            def produzir():
+                if formato == "envelope":
+                    ProdREST3Fase.envelope_assinado(mensagem, anexos=anexos)
+                else:
+                    with ProdREST3Fase.app.app_context():
+                        ProdREST3Fase.corpo_assinado(mensagem, anexos=anexos, codificacao=formato)
+
+            ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS = 0
+            ProdREST3Fase.respostas_assinadas.clear()
+            pedido = medir(lambda: cliente.get(rota, headers=cabecalhos(formato)), max(1, args.repeticoes // 20))
+
+            # A operação RSA é igual em todos os formatos: fica de fora do custo do produtor
+            ProdREST3Fase.assinar_mensagem = lambda _, chave=None, codificacao=CODIFICACAO_CP437: \
+                codificar_assinatura(assinatura, codificacao)
+            try:
+                produtor = medir(produzir, args.repeticoes)
+            finally:
+                ProdREST3Fase.assinar_mensagem = assinar
+            print(f"{rota:<34} {formato:<12} {tamanho:>7} {produtor:>12.1f} "
+                  f"{medir(lambda: ler_resposta_assinada(resposta), args.repeticoes):>11.1f} {pedido:>10.0f}")
+    ProdREST3Fase.MAXIMO_RESPOSTAS_ASSINADAS = maximo
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+
+from catalogo import Catalogo, IndiceProdutos, SUCESSO, QUANTIDADE_INSUFICIENTE
+
+# Benchmark de contenção: muitas threads a comprar contra muitas threads a listar.
+# Compara o Catalogo (locks por listra + instantâneos sem lock) com o esquema antigo
+# dos produtores socket, em que uma única threading.Lock protegia listagens e compras.
+# Termina com código 1 se o p99 das compras com listras não ficar abaixo do da lock global.
+
+
+class CatalogoLockGlobal:
+    """Reprodução do esquema antigo: tudo passa pela mesma lock e cada listagem copia a categoria."""
+
+    def __init__(self, produtos):
+        self.produtos = produtos
+        self.indice = IndiceProdutos(produtos)
+        self.lock = threading.Lock()
+
+    def instantaneo(self, categoria):
+        with self.lock:
+            return tuple(dict(produto) for produto in self.produtos[categoria])
+
+    def comprar(self, categoria, nome, quantidade):
+        produto = self.indice.procurar(categoria, nome)
+        with self.lock:
+            if produto['quantidade'] < quantidade:
+                return QUANTIDADE_INSUFICIENTE, categoria, dict(produto)
+            produto['quantidade'] -= quantidade
+            return SUCESSO, categoria, dict(produto)
+
+
+def gerar_produtos(categorias, por_categoria):
+    return {
+        f"categoria{c}": [
+            {"nome": f"produto{c}_{p}", "quantidade": 10 ** 9, "preco": 1.0, "taxa_revenda": 0.2}
+            for p in range(por_categoria)
+        ]
+        for c in range(categorias)
+    }
+
+
+def comprador(catalogo, chaves, parar, latencias):
+    aleatorio = random.Random()
+    while not parar.is_set():
+        categoria, nome = aleatorio.choice(chaves)
+        inicio = time.perf_counter()
+        catalogo.comprar(categoria, nome, 1)
+        latencias.append(time.perf_counter() - inicio)
+
+
+def listador(catalogo, categorias, parar, latencias):
+    aleatorio = random.Random()
+    while not parar.is_set():
+        categoria = aleatorio.choice(categorias)
+        inicio = time.perf_counter()
+        # Mesma forma da resposta de listarProdutos em Produtor.py
+        [{"nome": p["nome"], "quantidade": p["quantidade"], "preco": p["preco"], "taxa_revenda": p["taxa_revenda"]}
+         for p in catalogo.instantaneo(categoria)]
+        latencias.append(time.perf_counter() - inicio)
+
+
+def percentil(valores, p):
+    if not valores:
+        return float('nan')
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000
+
+
+def medir(nome, catalogo, categorias, chaves, compradores, listadores, duracao):
+    parar = threading.Event()
+    latencias_compra, latencias_listagem = [], []
+    threads = ([threading.Thread(target=comprador, args=(catalogo, chaves, parar, latencias_compra))
+                for _ in range(compradores)] +
+               [threading.Thread(target=listador, args=(catalogo, categorias, parar, latencias_listagem))
+                for _ in range(listadores)])
+    for t in threads:
+        t.start()
+    time.sleep(duracao)
+    parar.set()
+    for t in threads:
+        t.join()
+
+    return {
+        "nome": nome,
+        "compras_s": len(latencias_compra) / duracao,
+        "listagens_s": len(latencias_listagem) / duracao,
+        "compra_p50": statistics.median(latencias_compra) * 1000 if latencias_compra else float('nan'),
+        "compra_p99": percentil(latencias_compra, 0.99),
+        "listagem_p50": statistics.median(latencias_listagem) * 1000 if latencias_listagem else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Contention benchmark: concurrent buyers vs concurrent listers.')
+    parser.add_argument('--categorias', type=int, default=20)
+    parser.add_argument('--por-categoria', type=int, default=5000)
+    parser.add_argument('--compradores', type=int, default=32)
+    parser.add_argument('--listadores', type=int, default=8)
+    parser.add_argument('--duracao', type=float, default=5.0, help='Seconds per scenario.')
+    args = parser.parse_args()
+
+    resultados = []
+    for nome, classe in (("lock global", CatalogoLockGlobal), ("listras", Catalogo)):
+        produtos = gerar_produtos(args.categorias, args.por_categoria)
+        categorias = list(produtos)
+        chaves = [(categoria, p["nome"]) for categoria in categorias for p in produtos[categoria]]
+        resultados.append(medir(nome, classe(produtos), categorias, chaves,
+                                args.compradores, args.listadores, args.duracao))
+
+    print(f"\n{args.categorias} categorias x {args.por_categoria} produtos, "
+          f"{args.compradores} compradores, {args.listadores} listadores, {args.duracao:.0f}s")
+    print(f"{'esquema':<12} {'compras/s':>10} {'compra p50':>11} {'compra p99':>11} {'listagens/s':>12} {'listagem p50':>13}")
+    for r in resultados:
+        print(f"{r['nome']:<12} {r['compras_s']:>10.0f} {r['compra_p50']:>8.3f} ms {r['compra_p99']:>8.3f} ms "
+              f"{r['listagens_s']:>12.1f} {r['listagem_p50']:>10.2f} ms")
+
+    lock_global, listras = resultados
+    if listras['compra_p99'] >= lock_global['compra_p99']:
+        print(f"\nAVISO: compra p99 com listras ({listras['compra_p99']:.3f} ms) não é inferior à da "
+              f"lock global ({lock_global['compra_p99']:.3f} ms)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import argparse
+import logging
+import multiprocessing
+import statistics
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+import MarketPlace2Fase
+from cliente_http import SessaoHTTP
+
+# Benchmark do ciclo de atualização REST do MarketPlace2Fase com e sem o pool de ligações.
+# Arranca produtores ProdREST2Fase locais (um processo cada, sem registo no Gestor) e mede
+# quanto custa um ciclo: categorias de cada produtor e depois os produtos categoria a categoria,
+# tal como o menu do marketplace faz.
+
+
+def servir(porta):
+    import ProdREST2Fase
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server("127.0.0.1", porta, ProdREST2Fase.app, threaded=True).serve_forever()
+
+
+def esperar_servidor(porta, limite=10.0):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        try:
+            requests.get(f"http://127.0.0.1:{porta}/categorias", timeout=0.5)
+            return
+        except requests.RequestException:
+            time.sleep(0.05)
+    raise RuntimeError(f"Produtor na porta {porta} não arrancou")
+
+
+def ciclo(portas):
+    pedidos = 0
+    for porta in portas:
+        categorias = MarketPlace2Fase.listar_categorias_rest("127.0.0.1", porta)
+        pedidos += 1
+        for categoria in categorias:
+            MarketPlace2Fase.obter_lista_produtos_rest("127.0.0.1", porta, [categoria])
+            pedidos += 1
+    return pedidos
+
+
+def medir(portas, ciclos):
+    ciclo(portas)  # Aquecer (e abrir as ligações do pool)
+    duracoes = []
+    pedidos = 0
+    for _ in range(ciclos):
+        inicio = time.perf_counter()
+        pedidos = ciclo(portas)
+        duracoes.append(time.perf_counter() - inicio)
+    return statistics.median(duracoes) * 1000, pedidos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of a REST refresh cycle with and without HTTP connection pooling.')
+    parser.add_argument('--produtores', type=int, default=4)
+    parser.add_argument('--porta', type=int, default=5600, help='First port for the local producers.')
+    parser.add_argument('--ciclos', type=int, default=30)
+    args = parser.parse_args()
+
+    portas = [args.porta + i for i in range(args.produtores)]
+    processos = [multiprocessing.Process(target=servir, args=(porta,), daemon=True) for porta in portas]
+    for processo in processos:
+        processo.start()
+    try:
+        for porta in portas:
+            esperar_servidor(porta)
+
+        MarketPlace2Fase.sessao = requests  # requests.get: uma ligação TCP nova por pedido
+        sem_pool, pedidos = medir(portas, args.ciclos)
+
+        MarketPlace2Fase.sessao = SessaoHTTP()
+        com_pool, _ = medir(portas, args.ciclos)
+    finally:
+        for processo in processos:
+            processo.terminate()
+
+    print(f"{args.produtores} produtores, {pedidos} pedidos por ciclo (mediana de {args.ciclos} ciclos)")
+    print(f"{'cliente':<16} {'ms/ciclo':>10} {'ms/pedido':>10}")
+    print(f"{'requests.get':<16} {sem_pool:>10.1f} {sem_pool / pedidos:>10.2f}")
+    print(f"{'SessaoHTTP':<16} {com_pool:>10.1f} {com_pool / pedidos:>10.2f}")
+    print(f"Poupança por ciclo: {sem_pool - com_pool:.1f} ms ({sem_pool / com_pool:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
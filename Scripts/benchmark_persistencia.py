@@ -0,0 +1,134 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from catalogo import Catalogo
+from persistencia import DiarioProdutos, PersistenciaCatalogo, save_produtos
+
+# Teste da persistência do stock (persistencia.DiarioProdutos).
+# 1) Débito de compras concorrentes sem persistência, com cada compra à espera do seu registo no
+#    diário (ao_alterar, como os produtores socket) e com o diário a seguir as versões do catálogo
+#    (PersistenciaCatalogo, como os produtores REST); mostra quantos registos couberam em cada fsync.
+# 2) Recuperação depois de uma falha: um processo compra, espera que o diário esteja no disco e
+#    termina sem fechar nada (os._exit); mede-se o tempo de DiarioProdutos.recuperar() sobre o
+#    diário deixado e verifica-se que o estado recuperado é igual ao do catálogo no momento da falha.
+
+
+def criar_produtos(categorias, por_categoria, stock):
+    return {
+        f"categoria{c}": [{"nome": f"produto{c}_{p}", "quantidade": stock, "preco": 1.0, "taxa_revenda": 0.1}
+                          for p in range(por_categoria)]
+        for c in range(categorias)
+    }
+
+
+def comprador(catalogo, nomes, compras, inicio, barreira):
+    barreira.wait()
+    for i in range(compras):
+        categoria, nome = nomes[(inicio + i) % len(nomes)]
+        catalogo.comprar(categoria, nome, 1)
+
+
+def medir_debito(args, modo, pasta):
+    produtos = criar_produtos(args.categorias, args.produtos, args.compradores * args.compras)
+    caminho = os.path.join(pasta, f"{modo}.json")
+    save_produtos(caminho, produtos)
+    diario = DiarioProdutos(caminho)
+    produtos = diario.recuperar()
+
+    persistencia = None
+    if modo == "por compra":
+        catalogo = Catalogo(produtos, ao_alterar=diario.gravar_produtos)
+        diario.iniciar()
+    else:
+        catalogo = Catalogo(produtos)
+        if modo == "por versao":
+            persistencia = PersistenciaCatalogo(diario, catalogo)
+            persistencia.iniciar()
+    nomes = [(categoria, produto["nome"]) for categoria, lista in produtos.items() for produto in lista]
+
+    barreira = threading.Barrier(args.compradores + 1)
+    threads = [threading.Thread(target=comprador, args=(catalogo, nomes, args.compras, i * 7, barreira))
+               for i in range(args.compradores)]
+    for thread in threads:
+        thread.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    if persistencia is not None:
+        persistencia.fechar()
+    elif modo == "por compra":
+        diario.fechar()
+    return {
+        "compras_s": args.compradores * args.compras / duracao,
+        "registos": diario.registos_gravados,
+        "lotes": diario.lotes_gravados,
+    }
+
+
+def falhar_depois_de_comprar(caminho, compras, fila):
+    diario = DiarioProdutos(caminho, intervalo_compactacao=3600.0, tamanho_maximo_diario=1 << 40)
+    produtos = diario.recuperar()
+    catalogo = Catalogo(produtos, ao_alterar=diario.gravar_produtos)  # Cada compra espera pelo disco
+    diario.iniciar()
+    nomes = [(categoria, produto["nome"]) for categoria, lista in produtos.items() for produto in lista]
+    for i in range(compras):
+        catalogo.comprar(*nomes[i % len(nomes)], 1)
+    fila.put({categoria: list(catalogo.instantaneo(categoria)) for categoria in catalogo.categorias()})
+    fila.close()
+    fila.join_thread()
+    os._exit(0)  # Sem fechar o diário: o produtos.json fica com o estado do arranque
+
+
+def medir_recuperacao(args, compras, pasta):
+    caminho = os.path.join(pasta, f"falha{compras}.json")
+    save_produtos(caminho, criar_produtos(args.categorias, args.produtos, compras))
+    fila = multiprocessing.Queue()
+    processo = multiprocessing.Process(target=falhar_depois_de_comprar, args=(caminho, compras, fila))
+    processo.start()
+    esperado = fila.get()
+    processo.join()
+    tamanho_diario = os.path.getsize(caminho + '.wal')
+
+    inicio = time.perf_counter()
+    recuperado = DiarioProdutos(caminho).recuperar()
+    duracao = time.perf_counter() - inicio
+    return {
+        "diario_kb": tamanho_diario / 1024,
+        "recuperacao_ms": duracao * 1000,
+        "igual": recuperado == esperado,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and crash recovery of the persistent product stock.')
+    parser.add_argument('--compradores', type=int, default=16, help='Concurrent buyer threads.')
+    parser.add_argument('--compras', type=int, default=5000, help='Purchases per buyer.')
+    parser.add_argument('--categorias', type=int, default=8)
+    parser.add_argument('--produtos', type=int, default=25, help='Products per category.')
+    parser.add_argument('--falhas', type=int, nargs='+', default=[10000, 100000, 300000],
+                        help='Purchases in the journal before each simulated crash.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        print(f"{args.compradores} compradores x {args.compras} compras, {args.categorias * args.produtos} produtos")
+        print(f"{'diario':<12} {'compras/s':>10} {'registos':>9} {'fsyncs':>7} {'registos/fsync':>15}")
+        for modo in ("sem diario", "por compra", "por versao"):
+            r = medir_debito(args, modo, pasta)
+            por_lote = r['registos'] / r['lotes'] if r['lotes'] else 0
+            print(f"{modo:<12} {r['compras_s']:>10.0f} {r['registos']:>9} {r['lotes']:>7} {por_lote:>15.1f}")
+
+        print(f"\n{'compras':>8} {'diario KB':>10} {'recuperacao ms':>15} {'estado igual':>13}")
+        for compras in args.falhas:
+            r = medir_recuperacao(args, compras, pasta)
+            print(f"{compras:>8} {r['diario_kb']:>10.0f} {r['recuperacao_ms']:>15.1f} {str(r['igual']):>13}")
+
+
+if __name__ == "__main__":
+    main()
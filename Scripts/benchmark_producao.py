@@ -0,0 +1,129 @@
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Teste de carga dos modos de arranque do ProdREST2Fase: servidor de desenvolvimento (app.run)
+# e modo de produção (servidor_wsgi) com vários workers. Cada cliente é um processo com uma
+# ligação keep-alive que faz pedidos seguidos durante 'duracao' segundos; no fim são mostrados
+# os pedidos/s e as latências de /produtos e de /comprar.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+ROTAS = {
+    "produtos": "/produtos?categoria=fruta",
+    "comprar": "/comprar/banana/0",  # Compra de 0 unidades: passa pelo caminho de compra sem esgotar o stock
+}
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def esperar_servidor(porta, timeout=20):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            ligacao = http.client.HTTPConnection("localhost", porta, timeout=1)
+            ligacao.request("GET", "/categorias")
+            ligacao.getresponse().read()
+            ligacao.close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def cliente(porta, rota, inicio, duracao):
+    """Faz pedidos seguidos a 'rota' entre 'inicio' e 'inicio + duracao'; devolve (latências, erros)."""
+    while time.time() < inicio:
+        time.sleep(0.001)
+    latencias, erros = [], 0
+    ligacao = http.client.HTTPConnection("localhost", porta, timeout=10)
+    fim = inicio + duracao
+    while time.time() < fim:
+        t0 = time.perf_counter()
+        try:
+            ligacao.request("GET", rota)
+            resposta = ligacao.getresponse()
+            resposta.read()
+            if resposta.status != 200:
+                erros += 1
+        except (OSError, http.client.HTTPException):
+            erros += 1
+            ligacao.close()
+            ligacao = http.client.HTTPConnection("localhost", porta, timeout=10)
+            continue
+        latencias.append(time.perf_counter() - t0)
+    ligacao.close()
+    return latencias, erros
+
+
+def medir(porta, rota, clientes, duracao):
+    inicio = time.time() + 0.5
+    with multiprocessing.Pool(clientes) as pool:
+        resultados = pool.starmap(cliente, [(porta, rota, inicio, duracao)] * clientes)
+    latencias = sorted(latencia for parcial, _ in resultados for latencia in parcial)
+    erros = sum(erros for _, erros in resultados)
+    return {
+        "pedidos_s": len(latencias) / duracao,
+        "p50_ms": statistics.median(latencias) * 1000 if latencias else float('nan'),
+        "p99_ms": latencias[int(len(latencias) * 0.99) - 1] * 1000 if latencias else float('nan'),
+        "erros": erros,
+    }
+
+
+def medir_configuracao(nome, opcoes, clientes, duracao, pasta):
+    porta = porta_livre()
+    processo = subprocess.Popen(
+        [sys.executable, os.path.join(pasta, "ProdREST2Fase.py"), "--port", str(porta), "--log-level", "ERRO"] + opcoes,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not esperar_servidor(porta):
+            raise RuntimeError(f"O produtor ({nome}) não arrancou.")
+        return {rota: medir(porta, caminho, clientes, duracao) for rota, caminho in ROTAS.items()}
+    finally:
+        processo.terminate()
+        processo.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the REST producer: development server vs production mode.')
+    parser.add_argument('--clientes', type=int, default=16, help='Concurrent client processes (one keep-alive connection each).')
+    parser.add_argument('--duracao', type=float, default=5.0, help='Seconds per route and configuration.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                        help='Worker counts to test in production mode.')
+    parser.add_argument('--threads', type=int, default=16, help='Threads per worker in production mode.')
+    args = parser.parse_args()
+
+    configuracoes = [("app.run", [])] + [
+        (f"producao {workers}x{args.threads}", ["--producao", "--workers", str(workers), "--threads", str(args.threads)])
+        for workers in sorted(set(args.workers))
+    ]
+
+    # O produtor lê o produtos.json da sua pasta: correr sobre uma cópia para não mexer no original
+    with tempfile.TemporaryDirectory() as pasta:
+        for ficheiro in os.listdir(script_dir):
+            if ficheiro.endswith(".py") or ficheiro == "produtos.json":
+                shutil.copy(os.path.join(script_dir, ficheiro), pasta)
+        resultados = [(nome, medir_configuracao(nome, opcoes, args.clientes, args.duracao, pasta))
+                      for nome, opcoes in configuracoes]
+
+    print(f"\nProdREST2Fase: {args.clientes} clientes, {args.duracao:.0f}s por rota, {os.cpu_count()} CPUs")
+    print(f"{'servidor':<18} {'rota':<9} {'pedidos/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for nome, por_rota in resultados:
+        for rota, r in por_rota.items():
+            print(f"{nome:<18} {rota:<9} {r['pedidos_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['erros']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+from catalogo import Catalogo, SUCESSO
+
+# Teste de stress das reservas atómicas do Catalogo.
+# Centenas de compradores (threads) fazem compras simples e encomendas de vários produtos sobre
+# um stock pequeno; no fim, para cada produto, o stock inicial tem de ser igual ao stock final
+# mais tudo o que foi vendido com sucesso (sem vendas a mais, sem quantidades negativas e sem
+# encomendas aplicadas só em parte). Com --via flask as encomendas passam pela rota /encomendar
+# do ProdREST2Fase. Compara ainda o débito com uma só lock para todo o catálogo (listras=1).
+
+
+def criar_produtos(categorias, por_categoria, stock):
+    return {
+        f"categoria{c}": [{"nome": f"produto{c}_{p}", "quantidade": stock, "preco": 1.0, "taxa_revenda": 0.1}
+                          for p in range(por_categoria)]
+        for c in range(categorias)
+    }
+
+
+def comprador(catalogo, nomes, operacoes, max_itens, semente, vendidos, barreira, cliente=None):
+    aleatorio = random.Random(semente)
+    vendidos_local = Counter()
+    barreira.wait()
+    for _ in range(operacoes):
+        quantidade_itens = aleatorio.randint(1, max_itens)
+        itens = [(categoria, nome, aleatorio.randint(1, 3)) for categoria, nome in aleatorio.sample(nomes, quantidade_itens)]
+        if cliente is not None:
+            corpo = {"itens": [{"categoria": categoria, "produto": nome, "quantidade": quantidade}
+                               for categoria, nome, quantidade in itens]}
+            sucesso = cliente.post('/encomendar', json=corpo).status_code == 200
+        elif len(itens) == 1:
+            sucesso = catalogo.comprar(*itens[0])[0] == SUCESSO
+        else:
+            sucesso = catalogo.reservar(itens)[0] == SUCESSO
+        if sucesso:
+            for categoria, nome, quantidade in itens:
+                vendidos_local[(categoria, nome)] += quantidade
+    vendidos.append(vendidos_local)
+
+
+def executar(args, listras, cliente_flask=None):
+    produtos = criar_produtos(args.categorias, args.produtos, args.stock)
+    catalogo = Catalogo(produtos, listras=listras)
+    nomes = [(categoria, produto["nome"]) for categoria, lista in produtos.items() for produto in lista]
+
+    app = None
+    if cliente_flask:
+        import ProdREST2Fase
+        ProdREST2Fase.catalogo = catalogo
+        app = ProdREST2Fase.app
+
+    vendidos = []
+    barreira = threading.Barrier(args.compradores + 1)
+    threads = [
+        threading.Thread(target=comprador, args=(catalogo, nomes, args.operacoes, args.max_itens, i, vendidos, barreira,
+                                                  app.test_client() if app else None))
+        for i in range(args.compradores)
+    ]
+    for thread in threads:
+        thread.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    total_vendido = sum(vendidos, Counter())
+    erros = 0
+    for categoria, lista in produtos.items():
+        for produto in lista:
+            restante = produto["quantidade"]
+            if restante < 0 or restante + total_vendido[(categoria, produto["nome"])] != args.stock:
+                erros += 1
+    esgotados = sum(1 for lista in produtos.values() for produto in lista if produto["quantidade"] == 0)
+    return {
+        "operacoes_s": args.compradores * args.operacoes / duracao,
+        "vendido": sum(total_vendido.values()),
+        "esgotados": esgotados,
+        "erros": erros,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test of atomic multi-item stock reservations.')
+    parser.add_argument('--compradores', type=int, default=300, help='Concurrent buyer threads.')
+    parser.add_argument('--operacoes', type=int, default=200, help='Orders per buyer.')
+    parser.add_argument('--categorias', type=int, default=8)
+    parser.add_argument('--produtos', type=int, default=25, help='Products per category.')
+    parser.add_argument('--stock', type=int, default=500, help='Initial quantity of every product.')
+    parser.add_argument('--max-itens', type=int, default=5, help='Maximum distinct products per order.')
+    parser.add_argument('--via', choices=['catalogo', 'flask'], default='catalogo',
+                        help='Call Catalogo directly or go through the /encomendar route (Flask test client).')
+    args = parser.parse_args()
+
+    print(f"{args.compradores} compradores x {args.operacoes} encomendas (1-{args.max_itens} produtos), "
+          f"{args.categorias * args.produtos} produtos com stock {args.stock}, via {args.via}")
+    print(f"{'listras':>8} {'encomendas/s':>13} {'unidades vendidas':>18} {'esgotados':>10} {'erros':>6}")
+    for listras in (64, 1):
+        r = executar(args, listras, args.via == 'flask')
+        print(f"{listras:>8} {r['operacoes_s']:>13.0f} {r['vendido']:>18} {r['esgotados']:>10} {r['erros']:>6}")
+
+
+if __name__ == "__main__":
+    main()
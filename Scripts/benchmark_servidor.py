@@ -0,0 +1,156 @@
+import argparse
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from protocolo import pedido_resposta
+
+# Benchmark que compara os modos 'threads' e 'asyncio' do produtor socket.
+# Para cada modo arranca o produtor num processo à parte (com uma cópia do produtos.json),
+# abre muitas ligações inativas (keep-alive) e mede a memória/threads do servidor e o
+# débito de pedidos de um conjunto de clientes ativos enquanto essas ligações continuam abertas.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def aumentar_limite_ficheiros(necessarios):
+    suave, rigido = resource.getrlimit(resource.RLIMIT_NOFILE)
+    alvo = min(rigido, max(suave, necessarios))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (alvo, rigido))
+    return alvo
+
+
+def ler_estado_processo(pid):
+    """Devolve (memória residente em KiB, número de threads) a partir de /proc."""
+    memoria, threads = None, None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    memoria = int(linha.split()[1])
+                elif linha.startswith("Threads:"):
+                    threads = int(linha.split()[1])
+    except OSError:
+        pass
+    return memoria, threads
+
+
+def esperar_servidor(porta, timeout=10):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", porta), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def cliente_ativo(porta, pedidos, latencias, erros):
+    pedidos_cliente = [
+        {"type": "listarCategorias"},
+        {"type": "listarProdutos", "categorias": ["fruta", "livros"]},
+        # Compra de 0 unidades: exercita o caminho de compra sem esgotar o stock
+        {"type": "comprar", "categoria": "fruta", "produto": "banana", "quantidade": 0},
+    ]
+    try:
+        with socket.create_connection(("127.0.0.1", porta)) as s:
+            for i in range(pedidos):
+                inicio = time.perf_counter()
+                pedido_resposta(s, pedidos_cliente[i % len(pedidos_cliente)])
+                latencias.append(time.perf_counter() - inicio)
+    except Exception:
+        erros.append(1)
+
+
+def medir_modo(produtor, modo, inativas, clientes, pedidos, ficheiro_produtos):
+    porta = porta_livre()
+    processo = subprocess.Popen(
+        [sys.executable, os.path.join(script_dir, produtor), "--host", "127.0.0.1", "--port", str(porta),
+         "--modo", modo, "--produtos", ficheiro_produtos],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ligacoes = []
+    try:
+        if not esperar_servidor(porta):
+            raise RuntimeError(f"O produtor em modo {modo} não arrancou.")
+        memoria_inicial, _ = ler_estado_processo(processo.pid)
+
+        inicio = time.perf_counter()
+        for _ in range(inativas):
+            ligacoes.append(socket.create_connection(("127.0.0.1", porta)))
+        time.sleep(1)  # Dar tempo ao servidor para aceitar todas as ligações
+        tempo_ligacoes = time.perf_counter() - inicio
+        memoria_ligado, threads = ler_estado_processo(processo.pid)
+
+        latencias, erros = [], []
+        trabalhadores = [threading.Thread(target=cliente_ativo, args=(porta, pedidos, latencias, erros))
+                         for _ in range(clientes)]
+        inicio = time.perf_counter()
+        for t in trabalhadores:
+            t.start()
+        for t in trabalhadores:
+            t.join()
+        duracao = time.perf_counter() - inicio
+
+        latencias.sort()
+        return {
+            "modo": modo,
+            "memoria_inicial": memoria_inicial,
+            "memoria_ligado": memoria_ligado,
+            "threads": threads,
+            "tempo_ligacoes": tempo_ligacoes,
+            "pedidos_s": len(latencias) / duracao if duracao else 0,
+            "p50_ms": statistics.median(latencias) * 1000 if latencias else float('nan'),
+            "p99_ms": latencias[int(len(latencias) * 0.99) - 1] * 1000 if latencias else float('nan'),
+            "erros": len(erros),
+        }
+    finally:
+        for s in ligacoes:
+            s.close()
+        processo.terminate()
+        processo.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare threaded and asyncio producer server modes.')
+    parser.add_argument('--produtor', default='P2.py', help='Producer script to benchmark (P2.py or Produtor.py).')
+    parser.add_argument('--inativas', type=int, default=2000, help='Number of idle keep-alive connections.')
+    parser.add_argument('--clientes', type=int, default=20, help='Number of active clients.')
+    parser.add_argument('--pedidos', type=int, default=500, help='Requests per active client.')
+    args = parser.parse_args()
+
+    limite = aumentar_limite_ficheiros(2 * (args.inativas + args.clientes) + 100)
+    if limite < args.inativas + args.clientes + 50:
+        print(f"Aviso: limite de ficheiros abertos ({limite}) insuficiente; a reduzir as ligações inativas.")
+        args.inativas = max(0, limite - args.clientes - 50)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        ficheiro_produtos = os.path.join(pasta, 'produtos.json')
+        shutil.copy(os.path.join(script_dir, 'produtos.json'), ficheiro_produtos)
+
+        resultados = [medir_modo(args.produtor, modo, args.inativas, args.clientes, args.pedidos, ficheiro_produtos)
+                      for modo in ('threads', 'asyncio')]
+
+    print(f"\n{args.produtor}: {args.inativas} ligações inativas, {args.clientes} clientes x {args.pedidos} pedidos")
+    print(f"{'modo':<8} {'RSS inicial':>12} {'RSS ligado':>12} {'threads':>8} {'pedidos/s':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for r in resultados:
+        print(f"{r['modo']:<8} {r['memoria_inicial'] or 0:>9} KiB {r['memoria_ligado'] or 0:>9} KiB "
+              f"{r['threads'] or 0:>8} {r['pedidos_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['erros']:>6}")
+
+
+if __name__ == "__main__":
+    main()
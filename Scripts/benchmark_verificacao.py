@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.x509 import load_pem_x509_certificate
+
+import ProdREST3Fase
+from benchmark_assinaturas import RespostaGuardada, preparar_produtor_seguro
+from MarketPlaceDiferente import Marketplace
+from verificacao import MAXIMO_PROCESSOS_VERIFICACAO
+
+# Validações/s das respostas assinadas do produtor REST seguro do lado do marketplace
+# (Marketplace.validate_rest_response), sem precisar do Gestor de Produtores:
+#   antes            - lê manager_public_key.pem, carrega o certificado duas vezes e verifica-o sempre
+#   certificados     - chave do gestor e certificados em cache, cada assinatura é verificada
+#   completa         - também as mensagens já verificadas em cache (verificacao.VerificadorCertificados)
+# Com "respostas repetidas" (catálogo sem alterações entre duas passagens) as mensagens repetem-se;
+# com "respostas novas" cada mensagem é diferente e só a cache de certificados ajuda.
+# No fim, uma listagem de respostas novas em que cada pedido demora 'latencia' ms: verificação na
+# thread dos pedidos (como antes) ou entregue ao pool de verificação (verificacao.PoolVerificacao),
+# com uma thread ou com vários processos.
+
+
+def validar_como_antes(resposta, caminho_chave):
+    # Cópia do caminho antigo de validate_rest_response, para comparação
+    content = resposta.json()
+    certificate_pem = content['certificado'].encode('utf-8')
+    with open(caminho_chave, "r") as f:
+        gestor_public_key_pem = f.read()
+    certificate = load_pem_x509_certificate(certificate_pem)
+    gestor_pkey = serialization.load_pem_public_key(gestor_public_key_pem.encode('utf-8'))
+    gestor_pkey.verify(certificate.signature, certificate.tbs_certificate_bytes, padding.PKCS1v15(),
+                       certificate.signature_hash_algorithm)
+    public_key = load_pem_x509_certificate(certificate_pem).public_key()
+    public_key.verify(content['assinatura'].encode("cp437"), json.dumps(content['mensagem']).encode('utf-8'),
+                      padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+                      hashes.SHA256())
+    return True
+
+
+def respostas_repetidas():
+    """Uma passagem pelo catálogo do produtor: categorias e produtos de cada categoria."""
+    cliente = ProdREST3Fase.app.test_client()
+    urls = ["/secure/categorias"] + [f"/secure/produtos?categoria={categoria}"
+                                     for categoria in ProdREST3Fase.catalogo.categorias()]
+    return [RespostaGuardada(cliente.get(url).get_data()) for url in urls]
+
+
+def respostas_novas(quantidade):
+    with ProdREST3Fase.app.app_context():
+        return [RespostaGuardada(ProdREST3Fase.corpo_assinado(
+            [{"nome": f"produto{i}", "quantidade": i, "preco": 1.0, "taxa_revenda": 0.1}]))
+            for i in range(quantidade)]
+
+
+def medir(validar, respostas, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for resposta in respostas:
+            assert validar(resposta)
+    return repeticoes * len(respostas) / (time.perf_counter() - inicio)
+
+
+def listar(marketplace, respostas, latencia, pool):
+    """Pede (simulado com sleep) e valida cada resposta; devolve respostas/s."""
+    inicio = time.perf_counter()
+    pendentes = []
+    for resposta in respostas:
+        time.sleep(latencia)
+        if pool:
+            pendentes.append(marketplace.start_rest_validation(resposta, "listagem", "benchmark"))
+        else:
+            assert marketplace.validate_rest_response(resposta, "listagem", "benchmark")
+    for validacao in pendentes:
+        assert marketplace.finish_rest_validation(validacao, "benchmark")
+    return len(respostas) / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validations/sec of signed producer responses in the marketplace.')
+    parser.add_argument('--repeticoes', type=int, default=50, help='Passes over the producer catalog.')
+    parser.add_argument('--novas', type=int, default=500, help='Distinct signed messages in the second scenario.')
+    parser.add_argument('--latencia', type=float, default=0.5, help='Simulated milliseconds per request in the crawl.')
+    parser.add_argument('--processos', type=int, nargs='+', default=[1, min(MAXIMO_PROCESSOS_VERIFICACAO, os.cpu_count() or 1)],
+                        help='Verification pool sizes to test in the crawl (1 = one thread).')
+    args = parser.parse_args()
+
+    chave_gestor = preparar_produtor_seguro()
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_chave = os.path.join(pasta, "manager_public_key.pem")
+        with open(caminho_chave, "wb") as f:
+            f.write(chave_gestor.public_key().public_bytes(serialization.Encoding.PEM,
+                                                           serialization.PublicFormat.SubjectPublicKeyInfo))
+
+        cenarios = {
+            "respostas repetidas": (respostas_repetidas(), args.repeticoes),
+            "respostas novas": (respostas_novas(args.novas), 1),
+        }
+        print(f"{'cenário':<20} {'antes':>10} {'certificados':>13} {'completa':>10}  (validações/s)")
+        for nome, (respostas, repeticoes) in cenarios.items():
+            antes = medir(lambda resposta: validar_como_antes(resposta, caminho_chave), respostas, repeticoes)
+
+            so_certificados = Marketplace(manager_key_path=caminho_chave)
+            so_certificados.verifier.capacidade_mensagens = 0
+            certificados = medir(lambda resposta: so_certificados.validate_rest_response(resposta, nome, "benchmark"),
+                                 respostas, repeticoes)
+
+            marketplace = Marketplace(manager_key_path=caminho_chave)
+            completa = medir(lambda resposta: marketplace.validate_rest_response(resposta, nome, "benchmark"),
+                             respostas, repeticoes)
+            print(f"{nome:<20} {antes:>10.0f} {certificados:>13.0f} {completa:>10.0f}")
+
+        print(f"\nListagem de {args.novas} respostas novas, {args.latencia} ms por pedido, {os.cpu_count()} CPUs")
+        print(f"{'verificação':<20} {'respostas/s':>12}")
+        respostas = respostas_novas(args.novas)
+        configuracoes = [("na thread", None)] + [
+            (f"pool {processos} {'thread' if processos == 1 else 'processos'}", processos)
+            for processos in sorted(set(args.processos))]
+        for nome, processos in configuracoes:
+            marketplace = Marketplace(manager_key_path=caminho_chave)
+            marketplace.verifier.capacidade_mensagens = 0  # Todas as mensagens são novas
+            if processos is not None:
+                marketplace.verification_pool.processos = processos
+            listar(marketplace, respostas[:10], 0, processos is not None)  # Arrancar o pool, verificar o certificado
+            por_segundo = listar(marketplace, respostas, args.latencia / 1000, processos is not None)
+            marketplace.verification_pool.fechar()
+            print(f"{nome:<20} {por_segundo:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
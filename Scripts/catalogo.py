@@ -0,0 +1,466 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+# Estruturas partilhadas pelos produtores para aceder ao catálogo de produtos
+
+# Resultados possíveis de uma compra
+SUCESSO = "sucesso"
+CATEGORIA_INEXISTENTE = "categoria_inexistente"
+PRODUTO_INEXISTENTE = "produto_inexistente"
+QUANTIDADE_INSUFICIENTE = "quantidade_insuficiente"
+
+
+# Função para normalizar nomes de categorias e produtos nas pesquisas
+def normalizar(texto):
+    return texto.strip().lower()
+
+
+MAXIMO_ITENS_ENCOMENDA = 100
+INTERVALO_VERIFICACAO = 0.05  # Espera máxima de esperar_alteracao entre verificações das alterações pendentes
+
+
+# Função para ler o corpo JSON de uma encomenda ({"itens": [{"produto", "quantidade"[, "categoria"]}]});
+# devolve a lista de (categoria ou None, nome, quantidade) para Catalogo.reservar, ou None se for inválido
+def ler_itens_encomenda(dados):
+    itens = dados.get('itens') if isinstance(dados, dict) else None
+    if not isinstance(itens, list) or not 0 < len(itens) <= MAXIMO_ITENS_ENCOMENDA:
+        return None
+    lidos = []
+    for item in itens:
+        if not isinstance(item, dict):
+            return None
+        nome, quantidade, categoria = item.get('produto'), item.get('quantidade'), item.get('categoria')
+        if (not isinstance(nome, str) or isinstance(quantidade, bool) or not isinstance(quantidade, int)
+                or quantidade <= 0 or not (categoria is None or isinstance(categoria, str))):
+            return None
+        lidos.append((categoria, nome, quantidade))
+    return lidos
+
+
+class IndiceProdutos:
+    """
+    Índice em memória do catálogo ({categoria: [produto, ...]}), com chaves normalizadas:
+    (categoria, nome) -> produto e nome -> (categoria, produto) para as rotas sem categoria.
+    Os produtos indexados são os próprios dicionários do catálogo, por isso alterações
+    de quantidade ficam visíveis sem reconstruir o índice.
+    """
+
+    def __init__(self, produtos):
+        self.construir(produtos)
+
+    def construir(self, produtos):
+        self._categorias = {}
+        self._por_categoria = {}
+        self._por_nome = {}
+        for categoria, lista in produtos.items():
+            self._categorias.setdefault(normalizar(categoria), categoria)
+            for produto in lista:
+                self.adicionar(categoria, produto)
+
+    def adicionar(self, categoria, produto):
+        # Em nomes repetidos prevalece o primeiro, tal como na pesquisa sequencial
+        nome = normalizar(produto['nome'])
+        self._categorias.setdefault(normalizar(categoria), categoria)
+        self._por_categoria.setdefault((normalizar(categoria), nome), produto)
+        self._por_nome.setdefault(nome, (categoria, produto))
+
+    def categoria(self, categoria):
+        """Devolve a chave original da categoria no catálogo, ou None se não existir."""
+        return self._categorias.get(normalizar(categoria))
+
+    def procurar(self, categoria, nome):
+        """Devolve o produto com este nome na categoria, ou None."""
+        return self._por_categoria.get((normalizar(categoria), normalizar(nome)))
+
+    def procurar_nome(self, nome):
+        """Devolve (categoria, produto) para o primeiro produto com este nome, ou None."""
+        return self._por_nome.get(normalizar(nome))
+
+
+class _BloqueioListras:
+    """Bloqueia várias listras pela ordem dada e liberta-as pela ordem inversa (para o with)."""
+
+    def __init__(self, listras):
+        self.listras = listras
+
+    def __enter__(self):
+        for listra in self.listras:
+            listra.acquire()
+        return self
+
+    def __exit__(self, *excecao):
+        for listra in reversed(self.listras):
+            listra.release()
+        return False
+
+
+class Catalogo:
+    """
+    Catálogo partilhado pelas threads de um produtor.
+
+    As compras só bloqueiam a listra (uma de várias locks, escolhida pelo produto) do produto
+    comprado, por isso compras de produtos diferentes raramente se esperam umas às outras.
+    As listagens nunca bloqueiam: cada categoria tem um número de versão que muda a cada
+    compra e um instantâneo imutável (tuplo de cópias dos produtos) reconstruído só quando
+    a versão mudou.
+
+    Cada alteração recebe também uma versão global crescente e fica num registo limitado
+    (as últimas 'maximo_alteracoes'), para os marketplaces pedirem só o que mudou desde a
+    última versão que conhecem. 'instancia' muda a cada arranque do produtor: versões de
+    outra instância não são comparáveis e obrigam a uma sincronização completa.
+
+    Uma compra não espera por nenhuma lock além da sua listra: a cópia do produto alterado
+    entra numa fila (deque, sem lock) e recebe a versão global de quem conseguir o lock do
+    registo sem esperar, ou do próximo leitor do registo. Os avisos a quem espera, os
+    observadores e ao_alterar correm depois de a listra ser libertada.
+
+    ao_alterar([(categoria, produto), ...]) é chamada com os produtos já alterados, antes de a
+    compra ser publicada (versões, registo de alterações), e pode esperar pelo disco. Se lançar
+    uma exceção, a compra é desfeita e a exceção chega a quem comprou.
+    """
+
+    def __init__(self, produtos, listras=64, ao_alterar=None, maximo_alteracoes=10000):
+        self.produtos = produtos
+        self.indice = IndiceProdutos(produtos)
+        self.ao_alterar = ao_alterar  # Chamada como ao_alterar([(categoria, produto)]) depois de libertar a listra
+        self.instancia = uuid.uuid4().hex
+        self._listras = [threading.Lock() for _ in range(listras)]
+        # Cada alteração recebe um valor novo do contador; basta comparar por igualdade
+        self._contador = itertools.count(1)
+        self._versoes = {categoria: next(self._contador) for categoria in produtos}
+        self._instantaneos = {}
+        # Alterações ainda sem versão global: (categoria, cópia do produto), pela ordem em que foram feitas
+        self._pendentes = deque()
+        # Registo de alterações: (versão, categoria, cópia do produto), por ordem de versão.
+        # O lock só é disputado pelos leitores; as compras usam-no apenas se estiver livre.
+        self._lock_alteracoes = threading.Lock()
+        self._nova_alteracao = threading.Condition(self._lock_alteracoes)
+        self._a_esperar = 0  # Threads em esperar_alteracao
+        self._observadores = []  # Funções sem argumentos chamadas depois de cada alteração
+        self._alteracoes = deque(maxlen=maximo_alteracoes)
+        self._versao_atual = max(self._versoes.values(), default=0)
+        self._base_alteracoes = self._versao_atual  # O registo tem tudo o que mudou depois desta versão
+
+    def categorias(self):
+        return list(self.produtos.keys())
+
+    def _indice_listra(self, categoria, nome):
+        return hash((normalizar(categoria), normalizar(nome))) % len(self._listras)
+
+    def listra(self, categoria, nome):
+        """Devolve a lock que protege a quantidade deste produto."""
+        return self._listras[self._indice_listra(categoria, nome)]
+
+    def versao(self, categoria):
+        return self._versoes.get(categoria)
+
+    def instantaneo(self, categoria):
+        """Devolve um tuplo com cópias dos produtos da categoria (None se não existir), sem locks."""
+        versao = self._versoes.get(categoria)
+        if versao is None:
+            return None
+        guardado = self._instantaneos.get(categoria)
+        if guardado is not None and guardado[0] == versao:
+            return guardado[1]
+        # A versão foi lida antes de copiar: se houver outra compra entretanto, a versão
+        # muda e o próximo leitor reconstrói o instantâneo.
+        copia = tuple(dict(produto) for produto in self.produtos[categoria])
+        self._instantaneos[categoria] = (versao, copia)
+        return copia
+
+    def comprar(self, categoria, nome, quantidade):
+        """
+        Retira 'quantidade' unidades do produto se houver stock suficiente.
+        Devolve (resultado, categoria, produto): a chave original da categoria e uma cópia
+        do produto depois da compra (ou None se a categoria/produto não existirem).
+        """
+        chave_categoria = self.indice.categoria(categoria)
+        if chave_categoria is None:
+            return CATEGORIA_INEXISTENTE, None, None
+        produto = self.indice.procurar(categoria, nome)
+        if produto is None:
+            return PRODUTO_INEXISTENTE, chave_categoria, None
+        return self._retirar(chave_categoria, produto, quantidade)
+
+    def comprar_por_nome(self, nome, quantidade):
+        """Como comprar(), para as rotas que identificam o produto só pelo nome."""
+        encontrado = self.indice.procurar_nome(nome)
+        if encontrado is None:
+            return PRODUTO_INEXISTENTE, None, None
+        chave_categoria, produto = encontrado
+        return self._retirar(chave_categoria, produto, quantidade)
+
+    def reservar(self, itens):
+        """
+        Encomenda de vários produtos, aplicada por inteiro ou não aplicada.
+        'itens' é uma lista de (categoria, nome, quantidade); com categoria None o produto é
+        procurado só pelo nome. Linhas repetidas do mesmo produto somam-se.
+        Devolve (resultado, posição do item que falhou ou None, [(categoria, cópia do produto)])
+        com o estado dos produtos depois da encomenda (ou, se falhou, do produto que falhou).
+        """
+        pedidos = {}  # id(produto) -> [categoria, produto, quantidade total, primeira posição]
+        for posicao, (categoria, nome, quantidade) in enumerate(itens):
+            if categoria is None:
+                encontrado = self.indice.procurar_nome(nome)
+            else:
+                chave_categoria = self.indice.categoria(categoria)
+                if chave_categoria is None:
+                    return CATEGORIA_INEXISTENTE, posicao, []
+                produto = self.indice.procurar(categoria, nome)
+                encontrado = (chave_categoria, produto) if produto is not None else None
+            if encontrado is None:
+                return PRODUTO_INEXISTENTE, posicao, []
+            pedido = pedidos.setdefault(id(encontrado[1]), [encontrado[0], encontrado[1], 0, posicao])
+            pedido[2] += quantidade
+
+        # As listras são sempre bloqueadas por ordem crescente: duas encomendas com produtos em
+        # comum nunca ficam à espera uma da outra, e encomendas sem produtos em comum (fora
+        # colisões de listra) não se esperam de todo.
+        bloqueio = _BloqueioListras([self._listras[indice] for indice in sorted(
+            {self._indice_listra(categoria, produto['nome']) for categoria, produto, _, _ in pedidos.values()})])
+        retirados = [(categoria, produto, quantidade) for categoria, produto, quantidade, _ in pedidos.values()]
+        with bloqueio:
+            # Primeiro verificam-se todos os itens, depois retiram-se todos
+            for categoria, produto, quantidade, posicao in pedidos.values():
+                if produto['quantidade'] < quantidade:
+                    return QUANTIDADE_INSUFICIENTE, posicao, [(categoria, dict(produto))]
+            for categoria, produto, quantidade in retirados:
+                produto['quantidade'] -= quantidade
+            if self.ao_alterar is None:
+                alterados = [(categoria, self._registar(categoria, produto)) for categoria, produto, _ in retirados]
+        if self.ao_alterar is not None:
+            # A encomenda inteira vai para o diário de uma vez; se falhar, todos os itens são repostos
+            self._confirmar(retirados, bloqueio)
+            with bloqueio:
+                alterados = [(categoria, self._registar(categoria, produto)) for categoria, produto, _ in retirados]
+        self._publicar()
+        return SUCESSO, None, alterados
+
+    def _retirar(self, categoria, produto, quantidade):
+        listra = self.listra(categoria, produto['nome'])
+        with listra:
+            if produto['quantidade'] < quantidade:
+                return QUANTIDADE_INSUFICIENTE, categoria, dict(produto)
+            produto['quantidade'] -= quantidade
+            if self.ao_alterar is None:
+                copia = self._registar(categoria, produto)
+        if self.ao_alterar is not None:
+            self._confirmar([(categoria, produto, quantidade)], listra)
+            with listra:
+                copia = self._registar(categoria, produto)
+        self._publicar()
+        return SUCESSO, categoria, copia
+
+    def _confirmar(self, retirados, bloqueio):
+        # Sem listras bloqueadas, antes de publicar a compra: se ao_alterar falhar, as quantidades
+        # são repostas e a compra não chega ao registo de alterações
+        try:
+            self.ao_alterar([(categoria, produto) for categoria, produto, _ in retirados])
+        except BaseException:
+            with bloqueio:
+                for categoria, produto, quantidade in retirados:
+                    produto['quantidade'] += quantidade
+                    # Um instantâneo feito entretanto pode ter a quantidade retirada
+                    self._versoes[categoria] = next(self._contador)
+            raise
+
+    def atualizar_produto(self, categoria, produto):
+        """
+        Aplica o estado de um produto recebido de outra cópia do catálogo (ex.: a de outro
+        processo): substitui os campos do produto com o mesmo nome, ou acrescenta-o à categoria.
+        """
+        chave_categoria = self.indice.categoria(categoria) or categoria
+        with self.listra(chave_categoria, produto['nome']):
+            existente = self.indice.procurar(chave_categoria, produto['nome'])
+            if existente is None:
+                existente = dict(produto)
+                self.produtos.setdefault(chave_categoria, []).append(existente)
+                self.indice.adicionar(chave_categoria, existente)
+            else:
+                existente.update(produto)
+            self._registar(chave_categoria, existente)
+        self._publicar()
+        if self.ao_alterar is not None:
+            self.ao_alterar([(chave_categoria, existente)])
+
+    def _registar(self, categoria, produto):
+        # Com a listra do produto bloqueada: as cópias de um produto entram na fila pela ordem das
+        # suas alterações, por isso a de maior versão global é sempre a mais recente
+        copia = dict(produto)
+        self._versoes[categoria] = next(self._contador)
+        self._pendentes.append((categoria, copia))
+        return copia
+
+    def _publicar(self):
+        # Depois de libertar as listras: versões globais (se o lock do registo estiver livre) e observadores
+        self._numerar_pendentes()
+        for observador in self._observadores:
+            observador()
+
+    def _numerar_pendentes(self):
+        # Quem não consegue o lock deixa as suas alterações a quem o tem, que volta a verificar
+        # a fila depois de o libertar; ninguém fica à espera do lock numa compra
+        while self._pendentes and self._lock_alteracoes.acquire(blocking=False):
+            try:
+                self._numerar()
+            finally:
+                self._lock_alteracoes.release()
+
+    def _numerar(self):
+        # Com o lock do registo: dá a versão global às alterações pendentes e acorda quem espera
+        if not self._pendentes:
+            return
+        while self._pendentes:
+            categoria, copia = self._pendentes.popleft()
+            self._versao_atual += 1
+            if len(self._alteracoes) == self._alteracoes.maxlen:
+                self._base_alteracoes = self._alteracoes[0][0]
+            self._alteracoes.append((self._versao_atual, categoria, copia))
+        if self._a_esperar:
+            self._nova_alteracao.notify_all()
+
+    def adicionar_observador(self, observador):
+        """Regista uma função chamada (sem listras bloqueadas, mas na thread da compra) a cada alteração."""
+        with self._lock_alteracoes:
+            self._observadores = self._observadores + [observador]
+
+    def remover_observador(self, observador):
+        with self._lock_alteracoes:
+            self._observadores = [o for o in self._observadores if o is not observador]
+
+    def esperar_alteracao(self, versao, timeout=None):
+        """Bloqueia até a versão do catálogo ser diferente de 'versao' (ou até ao timeout); devolve a atual."""
+        fim = None if timeout is None else time.monotonic() + timeout
+        with self._nova_alteracao:
+            self._a_esperar += 1
+            try:
+                while True:
+                    self._numerar()
+                    restante = None if fim is None else fim - time.monotonic()
+                    if self._versao_atual != versao or (restante is not None and restante <= 0):
+                        break
+                    # Uma alteração que chegue enquanto esta thread tem o lock fica pendente sem aviso
+                    self._nova_alteracao.wait(INTERVALO_VERIFICACAO if restante is None
+                                              else min(restante, INTERVALO_VERIFICACAO))
+            finally:
+                self._a_esperar -= 1
+            atual = self._versao_atual
+        self._numerar_pendentes()
+        return atual
+
+    def versao_catalogo(self):
+        """Versão global do catálogo: a da última alteração."""
+        with self._lock_alteracoes:
+            self._numerar()
+            atual = self._versao_atual
+        self._numerar_pendentes()
+        return atual
+
+    def alteracoes_desde(self, versao, categorias=None):
+        """
+        Devolve (versão atual, {categoria: [produtos]}) com o estado mais recente de cada produto
+        alterado depois de 'versao' (opcionalmente só nas categorias indicadas), ou
+        (versão atual, None) se o registo já não cobre essa versão.
+        """
+        with self._lock_alteracoes:
+            self._numerar()
+            atual = self._versao_atual
+            if not isinstance(versao, int) or not self._base_alteracoes <= versao <= atual:
+                recentes = None
+            else:
+                recentes = []
+                for registo in reversed(self._alteracoes):
+                    if registo[0] <= versao:
+                        break
+                    recentes.append(registo)
+        self._numerar_pendentes()
+        if recentes is None:
+            return atual, None
+
+        filtro = None if categorias is None else set(categorias)
+        vistos = set()
+        alteracoes = {}
+        for _, categoria, produto in recentes:  # Da mais recente para a mais antiga
+            if filtro is not None and categoria not in filtro:
+                continue
+            chave = (categoria, produto['nome'])
+            if chave in vistos:
+                continue
+            vistos.add(chave)
+            alteracoes.setdefault(categoria, []).append(produto)
+        return atual, alteracoes
+
+    def resposta_alteracoes(self, instancia, versao, categorias=None, formatar=dict):
+        """
+        Resposta ao pedido "alterações desde": {"instancia", "versao", "resincronizar", "alteracoes"}.
+        Com "resincronizar" o cliente tem de voltar a listar tudo (produtor reiniciado, primeira
+        sincronização ou registo ultrapassado) e passar a pedir alterações desde "versao".
+        'formatar' converte cada produto para o formato das listagens do produtor.
+        """
+        if instancia != self.instancia:
+            atual, alteracoes = self.versao_catalogo(), None
+        else:
+            atual, alteracoes = self.alteracoes_desde(versao, categorias)
+        return {
+            "instancia": self.instancia,
+            "versao": atual,
+            "resincronizar": alteracoes is None,
+            "alteracoes": {
+                categoria: [formatar(produto) for produto in produtos]
+                for categoria, produtos in (alteracoes or {}).items()
+            },
+        }
+
+
+class CacheListagens:
+    """
+    Respostas de listagem já serializadas. Cada categoria é codificada uma vez por versão
+    (codificar_categoria(instantâneo) -> bytes JSON da lista de produtos); a resposta completa
+    para uma lista de categorias também fica guardada enquanto nenhuma delas mudar.
+    Uma compra só invalida a categoria do produto comprado.
+    """
+
+    def __init__(self, catalogo, codificar_categoria, finalizar=None, maximo_respostas=256):
+        self.catalogo = catalogo
+        self.codificar_categoria = codificar_categoria
+        self.finalizar = finalizar  # Ex.: protocolo.enquadrar, para guardar a mensagem pronta a enviar
+        self.maximo_respostas = maximo_respostas
+        self._categorias = {}
+        self._respostas = {}
+
+    def categoria(self, categoria):
+        """Devolve os bytes da lista de produtos da categoria (None se não existir)."""
+        versao = self.catalogo.versao(categoria)
+        if versao is None:
+            return None
+        guardado = self._categorias.get(categoria)
+        if guardado is not None and guardado[0] == versao:
+            return guardado[1]
+        codificada = self.codificar_categoria(self.catalogo.instantaneo(categoria))
+        self._categorias[categoria] = (versao, codificada)
+        return codificada
+
+    def obter(self, categorias):
+        """Devolve a resposta {categoria: [produtos]} para as categorias pedidas que existam."""
+        chave = tuple(dict.fromkeys(categorias))
+        versoes = tuple(self.catalogo.versao(categoria) for categoria in chave)
+        guardado = self._respostas.get(chave)
+        if guardado is not None and guardado[0] == versoes:
+            return guardado[1]
+
+        partes = [
+            json.dumps(categoria).encode('utf-8') + b': ' + self.categoria(categoria)
+            for categoria, versao in zip(chave, versoes) if versao is not None
+        ]
+        resposta = b'{' + b', '.join(partes) + b'}'
+        if self.finalizar is not None:
+            resposta = self.finalizar(resposta)
+
+        if len(self._respostas) >= self.maximo_respostas:
+            self._respostas.clear()
+        self._respostas[chave] = (versoes, resposta)
+        return resposta
@@ -0,0 +1,45 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# Cliente HTTP partilhado pelos marketplaces e produtores REST.
+# Uma sessão requests mantém as ligações abertas (keep-alive) num pool por host, por isso
+# pedidos seguidos ao mesmo produtor ou ao Gestor reutilizam a mesma ligação TCP em vez
+# de abrirem uma nova a cada chamada.
+
+# (ligação, leitura) em segundos; um produtor parado já não bloqueia o marketplace indefinidamente
+TIMEOUT_PADRAO = (3.05, 10)
+HOSTS_EM_POOL = 32         # Número de hosts (produtores + gestor) com pool próprio
+LIGACOES_POR_HOST = 8      # Ligações mantidas abertas por host
+
+
+class SessaoHTTP(requests.Session):
+    """
+    Sessão com pool de ligações por host e timeout por omissão.
+    Acima de 'ligacoes_por_host' pedidos simultâneos ao mesmo host abrem-se ligações extra,
+    que são fechadas no fim em vez de voltarem ao pool: quem usa a sessão com N threads
+    chama dimensionar(N).
+    """
+
+    def __init__(self, timeout=TIMEOUT_PADRAO, hosts=HOSTS_EM_POOL, ligacoes_por_host=LIGACOES_POR_HOST):
+        super().__init__()
+        self.timeout = timeout
+        self.hosts = hosts
+        self.ligacoes_por_host = 0
+        self.dimensionar(ligacoes_por_host)
+
+    def dimensionar(self, ligacoes_por_host):
+        """Garante pelo menos 'ligacoes_por_host' ligações no pool de cada host (ex.: uma por thread)."""
+        if ligacoes_por_host <= self.ligacoes_por_host:
+            return
+        self.ligacoes_por_host = ligacoes_por_host
+        adaptador = HTTPAdapter(pool_connections=self.hosts, pool_maxsize=ligacoes_por_host)
+        self.mount('http://', adaptador)
+        self.mount('https://', adaptador)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+# Sessão usada por omissão em todos os módulos
+sessao = SessaoHTTP()
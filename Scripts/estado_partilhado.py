@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from catalogo import Catalogo, SUCESSO, QUANTIDADE_INSUFICIENTE
+from persistencia import abrir_catalogo
+
+# Estado partilhado pelos workers de um produtor REST em modo de produção (servidor_wsgi).
+#
+# Com vários processos, o dicionário de produtos e as credenciais deixam de poder viver em
+# cada worker: uma compra num worker tem de ser vista por todos, e o stock não pode ser
+# vendido duas vezes. Um processo gestor (multiprocessing.managers) guarda o Catalogo
+# autoritativo e as credenciais de assinatura; as compras e as consultas por versão
+# (/alteracoes, /eventos) são feitas nesse processo. Cada worker mantém uma réplica local
+# do catálogo, atualizada a partir do registo de alterações, para as listagens não pagarem
+# uma ida ao gestor por pedido (podem atrasar-se alguns milissegundos em relação às compras).
+# Quando o processo gestor é dono do diário do stock, cada compra só volta ao worker depois de
+# registada no disco.
+
+registo = logging.getLogger("estado_partilhado")
+
+INTERVALO_SINCRONIZACAO = 1.0  # Segundos máximos entre verificações do estado partilhado
+
+
+class EstadoProdutor:
+    """Objeto que vive no processo gestor: catálogo autoritativo, diário do stock (opcional)
+    e credenciais de assinatura."""
+
+    def __init__(self, catalogo, diario=None):
+        self.catalogo = catalogo
+        self.diario = diario
+        self._lock = threading.Lock()
+        self._credenciais = (0, None, None)  # (versão, chave privada PEM, certificado)
+
+    # Catálogo
+    def exportar(self):
+        """Devolve (instância, versão, produtos). A versão é lida antes da cópia: o que mudar
+        durante a cópia volta a ser aplicado na sincronização seguinte."""
+        versao = self.catalogo.versao_catalogo()
+        produtos = {categoria: list(self.catalogo.instantaneo(categoria)) for categoria in self.catalogo.categorias()}
+        return self.catalogo.instancia, versao, produtos
+
+    def comprar(self, categoria, nome, quantidade):
+        return self.catalogo.comprar(categoria, nome, quantidade)
+
+    def comprar_por_nome(self, nome, quantidade):
+        return self.catalogo.comprar_por_nome(nome, quantidade)
+
+    def reservar(self, itens):
+        return self.catalogo.reservar(itens)
+
+    def fechar(self):
+        """Grava o que falta do diário e compacta-o (no fim do produtor)."""
+        if self.diario is not None:
+            self.diario.fechar()
+
+    def categorias(self):
+        return self.catalogo.categorias()
+
+    def instantaneo(self, categoria):
+        return list(self.catalogo.instantaneo(categoria))
+
+    def versao_catalogo(self):
+        return self.catalogo.versao_catalogo()
+
+    def esperar_alteracao(self, versao, timeout=None):
+        return self.catalogo.esperar_alteracao(versao, timeout)
+
+    def alteracoes_desde(self, versao, categorias=None):
+        return self.catalogo.alteracoes_desde(versao, categorias)
+
+    def resposta_alteracoes(self, instancia, versao, categorias=None):
+        return self.catalogo.resposta_alteracoes(instancia, versao, categorias)
+
+    # Credenciais
+    def publicar_credenciais(self, chave_privada_pem, certificado):
+        with self._lock:
+            self._credenciais = (self._credenciais[0] + 1, chave_privada_pem, certificado)
+
+    def credenciais(self, versao):
+        """Devolve (versão, chave privada PEM, certificado) se forem mais recentes do que 'versao', senão None."""
+        with self._lock:
+            return self._credenciais if self._credenciais[0] != versao else None
+
+
+_estado = None  # EstadoProdutor do processo gestor
+
+
+# Funções do processo gestor, ao nível do módulo para também servirem com spawn/forkserver
+# (uma lambda não passa para o processo gestor sem fork)
+def _iniciar_gestor(produtos, caminho_produtos):
+    global _estado
+    if caminho_produtos is None:
+        _estado = EstadoProdutor(Catalogo(produtos))
+        return
+    diario, catalogo = abrir_catalogo(caminho_produtos)
+    diario.iniciar()
+    _estado = EstadoProdutor(catalogo, diario)
+
+
+def _obter_estado():
+    return _estado
+
+
+class GestorEstado(BaseManager):
+    pass
+
+
+GestorEstado.register('estado', callable=_obter_estado)
+
+
+# Função para arrancar o processo gestor; devolve (gestor, endereço, chave de autenticação).
+# Com 'caminho_produtos', o processo gestor é o dono do diário desse stock: reconstrói o catálogo
+# a partir dele e regista cada compra antes de responder. Senão cria o catálogo a partir de
+# 'produtos' e a persistência fica a cargo de quem o chamou.
+# Só aceita ligações locais autenticadas com uma chave aleatória, herdada pelos workers.
+def iniciar_estado(produtos=None, caminho_produtos=None):
+    chave = os.urandom(32)
+    gestor = GestorEstado(address=('127.0.0.1', 0), authkey=chave)
+    gestor.start(_iniciar_gestor, (produtos, caminho_produtos))
+    return gestor, gestor.address, chave
+
+
+# Função para terminar o processo gestor, depois de o diário (se for dele) gravar o que falta
+def fechar_estado(gestor):
+    try:
+        gestor.estado().fechar()
+    except (OSError, EOFError):
+        pass  # Processo gestor já terminado: as compras confirmadas já estão no diário
+    gestor.shutdown()
+
+
+# Função para ligar um worker ao processo gestor; devolve o proxy do EstadoProdutor
+def ligar_estado(endereco, chave):
+    gestor = GestorEstado(address=endereco, authkey=chave)
+    gestor.connect()
+    return gestor.estado()
+
+
+class CatalogoReplica:
+    """
+    Catálogo de um worker: as leituras (categorias, instantâneos, versões por categoria) são
+    servidas por uma cópia local; as compras e as versões globais vêm do processo gestor.
+    Tem a mesma interface do Catalogo usada pelas rotas REST e por subscricoes.CursorAlteracoes.
+    """
+
+    def __init__(self, estado):
+        self.estado = estado
+        self.instancia, self._versao, produtos = estado.exportar()
+        self.local = Catalogo(produtos)
+        threading.Thread(target=self._sincronizar, daemon=True).start()
+
+    # Leituras locais
+    def categorias(self):
+        return self.local.categorias()
+
+    def versao(self, categoria):
+        return self.local.versao(categoria)
+
+    def instantaneo(self, categoria):
+        return self.local.instantaneo(categoria)
+
+    # Compras no processo gestor; o resultado é aplicado logo à cópia local
+    def comprar(self, categoria, nome, quantidade):
+        return self._aplicar_compra(self.estado.comprar(categoria, nome, quantidade))
+
+    def comprar_por_nome(self, nome, quantidade):
+        return self._aplicar_compra(self.estado.comprar_por_nome(nome, quantidade))
+
+    def reservar(self, itens):
+        resposta = self.estado.reservar(itens)
+        for categoria, produto in resposta[2]:
+            self.local.atualizar_produto(categoria, produto)
+        return resposta
+
+    def _aplicar_compra(self, resposta):
+        resultado, categoria, produto = resposta
+        if resultado in (SUCESSO, QUANTIDADE_INSUFICIENTE):
+            self.local.atualizar_produto(categoria, produto)
+        return resposta
+
+    # Versões globais e alterações: têm de ser as mesmas em todos os workers
+    def versao_catalogo(self):
+        return self.estado.versao_catalogo()
+
+    def esperar_alteracao(self, versao, timeout=None):
+        return self.estado.esperar_alteracao(versao, timeout)
+
+    def alteracoes_desde(self, versao, categorias=None):
+        return self.estado.alteracoes_desde(versao, categorias)
+
+    def resposta_alteracoes(self, instancia, versao, categorias=None, formatar=dict):
+        resposta = self.estado.resposta_alteracoes(instancia, versao, categorias)
+        if formatar is not dict:
+            resposta["alteracoes"] = {categoria: [formatar(produto) for produto in produtos]
+                                      for categoria, produtos in resposta["alteracoes"].items()}
+        return resposta
+
+    def _sincronizar(self):
+        while True:
+            try:
+                self.estado.esperar_alteracao(self._versao, INTERVALO_SINCRONIZACAO)
+                atual, alteracoes = self.estado.alteracoes_desde(self._versao)
+                if alteracoes is None:
+                    _, atual, alteracoes = self.estado.exportar()
+                for categoria, produtos in alteracoes.items():
+                    for produto in produtos:
+                        self.local.atualizar_produto(categoria, produto)
+                self._versao = atual
+            except (OSError, EOFError) as e:
+                registo.error("Ligação ao estado partilhado perdida: %s", e)
+                time.sleep(INTERVALO_SINCRONIZACAO)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+
+# Manifesto de catálogo assinado uma única vez.
+# Cada categoria é uma folha de uma árvore de Merkle (SHA-256); o produtor assina apenas
+# a raiz e a lista de categorias, e envia com cada categoria a prova de inclusão na árvore.
+# Quem recebe verifica uma assinatura e depois só calcula hashes, seja qual for o número
+# de categorias.
+
+ALGORITMO = "sha256"
+
+
+# Função para obter os bytes canónicos de uma categoria (folha da árvore)
+def codificar_folha(categoria, produtos):
+    return json.dumps({"categoria": categoria, "produtos": produtos}, sort_keys=True).encode('utf-8')
+
+
+def hash_folha(dados):
+    return hashlib.sha256(b'\x00' + dados).digest()
+
+
+def hash_no(esquerda, direita):
+    return hashlib.sha256(b'\x01' + esquerda + direita).digest()
+
+
+def construir_arvore(folhas):
+    """Devolve os níveis da árvore, das folhas (hashes) até à raiz. Um nó sem par sobe sem alteração."""
+    niveis = [list(folhas)]
+    while len(niveis[-1]) > 1:
+        anterior = niveis[-1]
+        nivel = [hash_no(anterior[i], anterior[i + 1]) for i in range(0, len(anterior) - 1, 2)]
+        if len(anterior) % 2:
+            nivel.append(anterior[-1])
+        niveis.append(nivel)
+    return niveis
+
+
+def raiz(niveis):
+    return niveis[-1][0] if niveis[0] else hashlib.sha256(b'').digest()
+
+
+def prova_inclusao(niveis, indice):
+    """Lista de irmãos (lado, hash em hex) necessários para subir da folha 'indice' até à raiz."""
+    prova = []
+    for nivel in niveis[:-1]:
+        irmao = indice ^ 1
+        if irmao < len(nivel):
+            prova.append({"lado": "esquerda" if irmao < indice else "direita", "hash": nivel[irmao].hex()})
+        indice //= 2
+    return prova
+
+
+def verificar_prova(hash_da_folha, prova, raiz_esperada):
+    atual = hash_da_folha
+    for passo in prova:
+        irmao = bytes.fromhex(passo["hash"])
+        atual = hash_no(irmao, atual) if passo["lado"] == "esquerda" else hash_no(atual, irmao)
+    return atual == raiz_esperada
+
+
+def construir_manifesto(produtos_por_categoria):
+    """
+    Recebe {categoria: [produtos]} e devolve (mensagem, categorias): a mensagem a assinar
+    ({"algoritmo", "raiz", "categorias"}) e, por categoria, os produtos e a prova de inclusão.
+    """
+    nomes = list(produtos_por_categoria)
+    niveis = construir_arvore([hash_folha(codificar_folha(nome, produtos_por_categoria[nome])) for nome in nomes])
+    mensagem = {"algoritmo": ALGORITMO, "raiz": raiz(niveis).hex(), "categorias": nomes}
+    categorias = {
+        nome: {"produtos": produtos_por_categoria[nome], "prova": prova_inclusao(niveis, indice)}
+        for indice, nome in enumerate(nomes)
+    }
+    return mensagem, categorias
+
+
+def verificar_categorias(mensagem, categorias, pedidas=None):
+    """
+    Verifica as categorias recebidas contra a mensagem do manifesto (cuja assinatura já foi validada).
+    Têm de vir todas as categorias assinadas ou, se o pedido indicou 'pedidas', todas as assinadas
+    que foram pedidas: uma resposta a que falte alguma (ex.: cortada a meio do caminho) é rejeitada.
+    Devolve {categoria: [produtos]} ou None se alguma categoria faltar ou não pertencer ao manifesto.
+    """
+    try:
+        if mensagem.get("algoritmo") != ALGORITMO:
+            return None
+        raiz_esperada = bytes.fromhex(mensagem["raiz"])
+        assinadas = set(mensagem["categorias"])
+        esperadas = assinadas if pedidas is None else assinadas & {nome.strip() for nome in pedidas}
+        if set(categorias) != esperadas:
+            return None
+        verificadas = {}
+        for nome, conteudo in categorias.items():
+            folha = hash_folha(codificar_folha(nome, conteudo["produtos"]))
+            if not verificar_prova(folha, conteudo["prova"], raiz_esperada):
+                return None
+            verificadas[nome] = conteudo["produtos"]
+        return verificadas
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
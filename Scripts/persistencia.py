@@ -0,0 +1,461 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from catalogo import Catalogo
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, o ficheiro de stock não fica bloqueado
+    fcntl = None
+
+registo = logging.getLogger("persistencia")
+
+
+class ErroDiario(Exception):
+    """O diário não pode ser usado: o stock já é de outro processo, ou a thread de escrita terminou
+    com um erro de E/S."""
+
+
+# Função para carregar produtos de um arquivo JSON
+def load_produtos(file_path):
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+# Função para guardar produtos de forma atómica (ficheiro temporário + os.replace)
+def save_produtos(file_path, produtos):
+    caminho_temporario = file_path + '.tmp'
+    with open(caminho_temporario, 'w') as file:
+        json.dump(produtos, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(caminho_temporario, file_path)
+    _sincronizar_pasta(file_path)
+
+
+# Função para obter o ficheiro de stock próprio de um produtor ('produtos_<nome>_<porta>.json' na
+# pasta indicada). Na primeira execução é criado a partir do modelo (produtos.json), que não é alterado.
+def ficheiro_produtor(pasta, nome, porta, modelo='produtos.json'):
+    caminho = os.path.join(pasta, f"produtos_{nome}_{porta}.json")
+    if not os.path.exists(caminho):
+        save_produtos(caminho, load_produtos(os.path.join(pasta, modelo)))
+    return caminho
+
+
+# Função para o catálogo que os produtores REST criam ao importar o módulo (as rotas usam-no mesmo
+# sem __main__, ex.: nos benchmarks): o modelo produtos.json da pasta, sem diário. Em __main__ é
+# substituído pelo stock persistente do produtor (StockREST).
+def catalogo_modelo(pasta, modelo='produtos.json'):
+    return Catalogo(load_produtos(os.path.join(pasta, modelo)))
+
+
+# Função para acrescentar a um parser as opções do stock persistente de um produtor REST
+def adicionar_argumentos_stock(parser, nome):
+    parser.add_argument('--produtos', default=None,
+                        help='Path to the products JSON file, where stock is persisted '
+                             f'(default: produtos_{nome}_<port>.json, created from produtos.json).')
+    parser.add_argument('--gravacao-diferida', action='store_true',
+                        help='Journal the stock from the catalogue change log about once a second instead of '
+                             'before answering each purchase (faster; a crash loses the last second of purchases).')
+
+
+def _sincronizar_pasta(file_path):
+    # Garante que a renomeação fica no disco (não suportado em Windows)
+    try:
+        descritor = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descritor)
+    except OSError:
+        pass
+    finally:
+        os.close(descritor)
+
+
+class DiarioProdutos:
+    """
+    Diário de compras (write-ahead log) com instantâneos periódicos do catálogo.
+
+    Cada compra regista o produto alterado (todos os campos) numa fila em memória (O(1));
+    uma thread de escrita junta os registos pendentes, acrescenta-os ao diário
+    '<produtos>.wal' e faz um único fsync por lote. De tempos a tempos o estado gravado
+    é compactado para o próprio produtos.json e o diário recomeça vazio.
+    No arranque, recuperar() lê o último instantâneo e repete o diário por cima.
+
+    Os registos guardam o produto inteiro, com a quantidade absoluta: repetir um registo já
+    incluído no instantâneo não altera o resultado, e um produto que não está no instantâneo
+    (acrescentado depois dele) é criado ao repetir o diário.
+
+    Uma compra só está garantida depois de aguardar() pelo seu registo; gravar_produtos()
+    faz as duas coisas e serve de ao_alterar do Catalogo. Se a escrita falhar, a thread de
+    escrita termina e registar()/aguardar() passam a lançar ErroDiario.
+
+    Só um processo pode usar cada ficheiro de stock: o construtor bloqueia '<produtos>.wal.lock'
+    (flock) e lança ErroDiario se outro processo o tiver.
+    """
+
+    def __init__(self, caminho_produtos, intervalo_fsync=0.05, intervalo_compactacao=60.0,
+                 tamanho_maximo_diario=4 * 1024 * 1024):
+        self.caminho_produtos = caminho_produtos
+        self.caminho_diario = caminho_produtos + '.wal'
+        self.caminho_diario_antigo = caminho_produtos + '.wal.old'
+        self.intervalo_fsync = intervalo_fsync
+        self.intervalo_compactacao = intervalo_compactacao
+        self.tamanho_maximo_diario = tamanho_maximo_diario
+        self._ficheiro_lock = self._bloquear()
+
+        self._condicao = threading.Condition()
+        self._pendentes = deque()
+        self._ultimo_registado = 0
+        self._ultimo_gravado = 0
+        self._a_terminar = False
+        self._thread = None
+        self._ficheiro = None
+        self._erro = None  # Erro que terminou a thread de escrita
+        self._a_aguardar = 0  # Threads à espera de um registo em aguardar()
+
+        # Cópia do estado tal como está no disco (instantâneo + diário); só a thread de escrita lhe mexe
+        self._estado = None
+        self._indice_estado = {}
+        self._tamanho_diario = 0
+        self._alteracoes_por_compactar = 0
+
+        # Estatísticas do group commit
+        self.lotes_gravados = 0
+        self.registos_gravados = 0
+
+    def _bloquear(self):
+        # Dois processos sobre o mesmo stock perdiam as compras um do outro a cada compactação.
+        # O lock fica num ficheiro à parte porque o diário é renomeado ao compactar; o sistema
+        # liberta-o quando o processo termina, mesmo sem fechar().
+        ficheiro = open(self.caminho_diario + '.lock', 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(ficheiro.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                ficheiro.close()
+                raise ErroDiario(f"Stock {self.caminho_produtos} já está a ser usado por outro processo") from None
+        return ficheiro
+
+    def recuperar(self):
+        """Carrega o instantâneo, repete o diário e devolve uma cópia do catálogo para uso em memória."""
+        self._estado = load_produtos(self.caminho_produtos)
+        self._indice_estado = {
+            (categoria, produto['nome']): produto
+            for categoria, lista in self._estado.items()
+            for produto in lista
+        }
+
+        repetidos = 0
+        for caminho in (self.caminho_diario_antigo, self.caminho_diario):
+            repetidos += self._repetir_diario(caminho)
+
+        if repetidos or os.path.exists(self.caminho_diario_antigo):
+            self._compactar()
+
+        return json.loads(json.dumps(self._estado))
+
+    def _repetir_diario(self, caminho):
+        if not os.path.exists(caminho):
+            return 0
+        repetidos = 0
+        with open(caminho, 'r', encoding='utf-8') as file:
+            for linha in file:
+                try:
+                    registo = json.loads(linha)
+                except json.JSONDecodeError:
+                    break  # Última linha incompleta (falha a meio de uma escrita)
+                self._aplicar(registo)
+                repetidos += 1
+        return repetidos
+
+    def _aplicar(self, registo):
+        categoria, produto = registo['categoria'], registo['produto']
+        existente = self._indice_estado.get((categoria, produto['nome']))
+        if existente is not None:
+            existente.update(produto)
+        else:
+            existente = dict(produto)
+            self._estado.setdefault(categoria, []).append(existente)
+            self._indice_estado[(categoria, produto['nome'])] = existente
+
+    def iniciar(self):
+        """Abre o diário e arranca a thread de escrita."""
+        if self._estado is None:
+            self.recuperar()
+        self._ficheiro = open(self.caminho_diario, 'a', encoding='utf-8')
+        self._tamanho_diario = self._ficheiro.tell()
+        self._thread = threading.Thread(target=self._escrever_continuamente, daemon=True)
+        self._thread.start()
+
+    def registar(self, categoria, produto):
+        """Regista o novo estado de um produto e devolve o número de sequência do registo."""
+        with self._condicao:
+            return self._acrescentar(categoria, produto)
+
+    def gravar_produtos(self, alterados):
+        """
+        Regista o estado atual de [(categoria, produto)] do catálogo e espera que esteja no disco
+        (para Catalogo(ao_alterar=...), que desfaz a compra se isto lançar ErroDiario).
+        Os produtos são copiados já com o diário bloqueado: duas compras do mesmo produto podem
+        chegar aqui pela ordem inversa, mas o último registo tem sempre a quantidade mais recente.
+        """
+        with self._condicao:
+            for categoria, produto in alterados:
+                sequencia = self._acrescentar(categoria, produto)
+        self.aguardar(sequencia)
+
+    def _acrescentar(self, categoria, produto):
+        self._verificar_escrita()
+        self._pendentes.append({"categoria": categoria, "produto": dict(produto)})
+        self._ultimo_registado += 1
+        self._condicao.notify_all()
+        return self._ultimo_registado
+
+    def aguardar(self, sequencia, timeout=None):
+        """Espera até que o registo com o número de sequência indicado esteja no disco (False no timeout)."""
+        with self._condicao:
+            self._a_aguardar += 1
+            try:
+                if self._condicao.wait_for(lambda: self._ultimo_gravado >= sequencia or self._erro is not None,
+                                           timeout):
+                    if self._ultimo_gravado >= sequencia:
+                        return True
+                    self._verificar_escrita()
+                return False
+            finally:
+                self._a_aguardar -= 1
+
+    def _verificar_escrita(self):
+        if self._erro is not None:
+            raise ErroDiario(f"Diário {self.caminho_diario} sem escrita: {self._erro}") from self._erro
+
+    def fechar(self):
+        """Grava o que falta, compacta o diário e termina a thread de escrita."""
+        with self._condicao:
+            self._a_terminar = True
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._ficheiro_lock.close()
+
+    def _escrever_continuamente(self):
+        try:
+            self._escrever()
+        except OSError as e:
+            registo.error("Diário %s deixou de gravar: %s", self.caminho_diario, e)
+            with self._condicao:
+                self._erro = e
+                self._pendentes.clear()
+                self._condicao.notify_all()
+
+    def _escrever(self):
+        ultima_compactacao = time.monotonic()
+        while True:
+            with self._condicao:
+                self._condicao.wait_for(lambda: self._pendentes or self._a_terminar,
+                                        timeout=self.intervalo_compactacao)
+                lote = list(self._pendentes)
+                self._pendentes.clear()
+                a_terminar = self._a_terminar
+
+            if lote:
+                self._gravar_lote(lote)
+
+            agora = time.monotonic()
+            if self._alteracoes_por_compactar and (a_terminar
+                                                   or agora - ultima_compactacao >= self.intervalo_compactacao
+                                                   or self._tamanho_diario >= self.tamanho_maximo_diario):
+                self._compactar()
+                ultima_compactacao = agora
+
+            if a_terminar:
+                self._ficheiro.close()
+                return
+
+            # Deixar acumular o próximo lote (group commit), exceto se houver compras à espera do disco:
+            # essas já acumularam durante o fsync anterior e cada espera atrasaria a sua resposta
+            if lote and self.intervalo_fsync and not self._a_aguardar:
+                time.sleep(self.intervalo_fsync)
+
+    def _gravar_lote(self, lote):
+        dados = ''.join(json.dumps(registo) + '\n' for registo in lote)
+        self._ficheiro.write(dados)
+        self._ficheiro.flush()
+        os.fsync(self._ficheiro.fileno())
+        self._tamanho_diario += len(dados)
+
+        for registo in lote:
+            self._aplicar(registo)
+        self._alteracoes_por_compactar += len(lote)
+        self.lotes_gravados += 1
+        self.registos_gravados += len(lote)
+
+        with self._condicao:
+            self._ultimo_gravado += len(lote)
+            self._condicao.notify_all()
+
+    def _compactar(self):
+        # 1. O diário atual passa a '.old'; 2. grava-se o instantâneo; 3. apaga-se o '.old'.
+        # Uma falha em qualquer ponto deixa instantâneo + diários suficientes para recuperar.
+        if self._ficheiro is not None:
+            self._ficheiro.close()
+        if os.path.exists(self.caminho_diario):
+            os.replace(self.caminho_diario, self.caminho_diario_antigo)
+        save_produtos(self.caminho_produtos, self._estado)
+        if os.path.exists(self.caminho_diario_antigo):
+            os.remove(self.caminho_diario_antigo)
+        if self._ficheiro is not None:
+            self._ficheiro = open(self.caminho_diario, 'a', encoding='utf-8')
+        self._tamanho_diario = 0
+        self._alteracoes_por_compactar = 0
+
+
+# Função para abrir o stock de um produtor: o último instantâneo mais o diário de compras (recuperar)
+# num Catalogo em que as compras só bloqueiam a listra do produto e só são confirmadas depois de o
+# seu registo estar no disco (group commit). O diário é arrancado à parte, com diario.iniciar().
+def abrir_catalogo(caminho_produtos):
+    diario = DiarioProdutos(caminho_produtos)
+    return diario, Catalogo(diario.recuperar(), ao_alterar=diario.gravar_produtos)
+
+
+class PersistenciaCatalogo:
+    """
+    Mantém um DiarioProdutos a par de um catálogo lendo o registo de alterações do próprio
+    catálogo (modo pull), em vez de as compras chamarem o diário. Serve qualquer objeto com
+    a interface de leitura do Catalogo (versao_catalogo, esperar_alteracao, alteracoes_desde,
+    categorias, instantaneo): o Catalogo local dos produtores socket ou o proxy do estado
+    partilhado dos produtores REST em modo de produção.
+
+    Cada volta junta tudo o que mudou desde a anterior, com um só registo por produto
+    (a quantidade mais recente), por isso muitas compras seguidas do mesmo produto custam
+    um registo e um fsync por lote. Se o registo de alterações já não cobrir a última versão
+    gravada, grava-se o estado de todos os produtos.
+
+    As compras são confirmadas antes de chegarem ao diário: uma falha do processo pode perder
+    as do último intervalo (por omissão 1 s) mais o lote à espera de fsync. Por isso só é usada
+    com --gravacao-diferida; por omissão os produtores gravam cada compra com
+    Catalogo(ao_alterar=diario.gravar_produtos) antes de responder.
+    """
+
+    def __init__(self, diario, catalogo, versao=None, intervalo=1.0):
+        self.diario = diario
+        self.catalogo = catalogo
+        self.versao = versao  # Versão do catálogo que corresponde ao estado recuperado
+        self.intervalo = intervalo
+        self._a_terminar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if self.versao is None:
+            self.versao = self.catalogo.versao_catalogo()
+        self.diario.iniciar()
+        self._thread = threading.Thread(target=self._acompanhar, daemon=True)
+        self._thread.start()
+
+    def _acompanhar(self):
+        while not self._a_terminar.is_set():
+            try:
+                self.catalogo.esperar_alteracao(self.versao, self.intervalo)
+                self.registar_alteracoes()
+            except (OSError, EOFError) as e:
+                registo.error("Persistência sem ligação ao catálogo: %s", e)
+                return
+
+    def registar_alteracoes(self):
+        """Passa ao diário tudo o que mudou desde a última versão registada; devolve a sequência do último registo."""
+        atual, alteracoes = self.catalogo.alteracoes_desde(self.versao)
+        if alteracoes is None:
+            alteracoes = {categoria: self.catalogo.instantaneo(categoria) for categoria in self.catalogo.categorias()}
+        sequencia = None
+        for categoria, produtos in alteracoes.items():
+            for produto in produtos:
+                sequencia = self.diario.registar(categoria, produto)
+        self.versao = atual
+        return sequencia
+
+    def fechar(self):
+        """Regista as últimas alterações e fecha o diário (que compacta o que falta)."""
+        self._a_terminar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            try:
+                self.registar_alteracoes()
+            except (OSError, EOFError):
+                pass  # Estado partilhado já terminado: fica o que o diário já recebeu
+        self.diario.fechar()
+
+
+class StockREST:
+    """
+    Stock persistente de um produtor REST (ProdREST2Fase, ProdREST3Fase): o estado do último
+    arranque mais as compras no diário (.wal) que ainda não chegaram ao ficheiro. Cada compra é
+    gravada no diário ao alterar o catálogo e só é confirmada depois do fsync. Com
+    --gravacao-diferida o diário segue o registo de alterações do catálogo (PersistenciaCatalogo):
+    uma falha pode perder as compras já confirmadas no último segundo.
+
+    O diário só pode ter um processo dono: com o reloader do modo debug, só o processo que serve o
+    abre; com vários workers (partilhar()), o catálogo autoritativo passa para o processo gestor de
+    estado_partilhado, que é o dono do diário com gravação por compra. estado_partilhado é
+    importado só dentro dos métodos porque também importa este módulo.
+    """
+
+    def __init__(self, args, pasta, nome, catalogo):
+        args.produtos = args.produtos or ficheiro_produtor(pasta, nome, args.port)
+        self.args = args
+        self.catalogo = catalogo  # Catálogo a servir neste processo (o do módulo se não abrir o diário)
+        self.partilhado = args.producao and args.workers > 1 and hasattr(os, 'fork')
+        self.persistencia = None
+        self.diario = None  # Diário do stock quando as compras são feitas neste processo
+        self.gestor = None
+        self.endereco_estado = None
+        self.chave_estado = None
+        if args.producao or not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            if args.gravacao_diferida:
+                diario = DiarioProdutos(args.produtos)
+                self.catalogo = Catalogo(diario.recuperar())
+                self.persistencia = PersistenciaCatalogo(diario, self.catalogo)
+            elif not self.partilhado:
+                self.diario, self.catalogo = abrir_catalogo(args.produtos)
+
+    def partilhar(self):
+        """Com vários workers, arranca o processo gestor com o catálogo autoritativo (endereco_estado/chave_estado)."""
+        if not self.partilhado:
+            return
+        from estado_partilhado import iniciar_estado
+        if self.persistencia is not None:
+            versao_recuperada = self.catalogo.versao_catalogo()
+            self.gestor, self.endereco_estado, self.chave_estado = iniciar_estado(self.catalogo.produtos)
+            # As compras passam a acontecer no processo gestor: este processo grava a partir dele
+            self.persistencia = PersistenciaCatalogo(self.persistencia.diario, None, versao_recuperada)
+        else:
+            self.gestor, self.endereco_estado, self.chave_estado = iniciar_estado(caminho_produtos=self.args.produtos)
+
+    def iniciar(self, estado=None):
+        """Arranca a persistência que pertence a este processo ('estado': ligação já feita ao processo gestor)."""
+        if self.persistencia is not None:
+            if self.persistencia.catalogo is None:
+                if estado is None:
+                    from estado_partilhado import ligar_estado
+                    estado = ligar_estado(self.endereco_estado, self.chave_estado)
+                self.persistencia.catalogo = estado
+            self.persistencia.iniciar()
+        elif self.diario is not None:
+            self.diario.iniciar()
+
+    def fechar(self):
+        """Grava o que falta do stock e termina o processo gestor, se houver."""
+        if self.persistencia is not None:
+            self.persistencia.fechar()
+        elif self.diario is not None:
+            self.diario.fechar()
+        if self.gestor is not None:
+            from estado_partilhado import fechar_estado
+            fechar_estado(self.gestor)
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Protocolo de mensagens entre marketplaces e produtores socket.
+# Cada mensagem é um objeto JSON em UTF-8 precedido de um cabeçalho de 4 bytes
+# (inteiro sem sinal, big-endian) com o tamanho do corpo. Assim uma resposta pode
+# ocupar vários recv() e vários pedidos podem seguir na mesma ligação sem se misturarem.
+
+CABECALHO = struct.Struct('!I')
+TAMANHO_MAXIMO = 256 * 1024 * 1024  # Limite de segurança para uma única mensagem
+TAMANHO_LEITURA = 65536
+
+
+class ErroProtocolo(Exception):
+    """Mensagem com cabeçalho inválido ou ligação fechada a meio de uma mensagem."""
+
+
+# Função para codificar uma mensagem já serializada (bytes) com o respetivo cabeçalho
+def enquadrar(corpo):
+    if len(corpo) > TAMANHO_MAXIMO:
+        raise ErroProtocolo(f"Mensagem demasiado grande ({len(corpo)} bytes).")
+    return CABECALHO.pack(len(corpo)) + corpo
+
+
+# Função para serializar e enquadrar um objeto JSON
+def codificar_mensagem(dados):
+    return enquadrar(json.dumps(dados).encode('utf-8'))
+
+
+# Função para enviar um objeto JSON numa só chamada a sendall
+def enviar_mensagem(conexao, dados):
+    conexao.sendall(codificar_mensagem(dados))
+
+
+class DescodificadorMensagens:
+    """
+    Descodificador incremental: recebe bytes à medida que chegam e devolve
+    os corpos completos, pela ordem em que foram enviados.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def alimentar(self, dados):
+        self._buffer += dados
+        corpos = []
+        while len(self._buffer) >= CABECALHO.size:
+            (tamanho,) = CABECALHO.unpack_from(self._buffer)
+            if tamanho > TAMANHO_MAXIMO:
+                raise ErroProtocolo(f"Mensagem demasiado grande ({tamanho} bytes).")
+            fim = CABECALHO.size + tamanho
+            if len(self._buffer) < fim:
+                break
+            corpos.append(bytes(self._buffer[CABECALHO.size:fim]))
+            del self._buffer[:fim]
+        return corpos
+
+    def pendente(self):
+        return len(self._buffer) > 0
+
+
+class LeitorMensagens:
+    """
+    Lê mensagens enquadradas de um socket bloqueante, guardando o que sobrar
+    de cada recv() para a mensagem seguinte (pedidos em pipeline).
+    """
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self._descodificador = DescodificadorMensagens()
+        self._prontas = deque()
+
+    def receber_bytes(self):
+        """Devolve o próximo corpo recebido ou None se a ligação foi fechada."""
+        while not self._prontas:
+            dados = self.conexao.recv(TAMANHO_LEITURA)
+            if not dados:
+                if self._descodificador.pendente():
+                    raise ErroProtocolo("Ligação fechada a meio de uma mensagem.")
+                return None
+            self._prontas.extend(self._descodificador.alimentar(dados))
+        return self._prontas.popleft()
+
+    def receber(self):
+        """Devolve o próximo objeto JSON recebido ou None se a ligação foi fechada."""
+        corpo = self.receber_bytes()
+        if corpo is None:
+            return None
+        return json.loads(corpo)
+
+
+# Função para ler exatamente n bytes de um socket (None se fechar antes de começar)
+def _receber_exato(conexao, n):
+    partes = bytearray()
+    while len(partes) < n:
+        dados = conexao.recv(min(n - len(partes), TAMANHO_LEITURA))
+        if not dados:
+            if partes:
+                raise ErroProtocolo("Ligação fechada a meio de uma mensagem.")
+            return None
+        partes += dados
+    return bytes(partes)
+
+
+# Função para receber uma única mensagem sem ler bytes da mensagem seguinte
+def receber_mensagem(conexao):
+    cabecalho = _receber_exato(conexao, CABECALHO.size)
+    if cabecalho is None:
+        return None
+    (tamanho,) = CABECALHO.unpack(cabecalho)
+    if tamanho > TAMANHO_MAXIMO:
+        raise ErroProtocolo(f"Mensagem demasiado grande ({tamanho} bytes).")
+    corpo = _receber_exato(conexao, tamanho) if tamanho else b''
+    if corpo is None:
+        raise ErroProtocolo("Ligação fechada a meio de uma mensagem.")
+    return json.loads(corpo)
+
+
+# Função para enviar um pedido e esperar pela respetiva resposta
+def pedido_resposta(conexao, dados):
+    enviar_mensagem(conexao, dados)
+    resposta = receber_mensagem(conexao)
+    if resposta is None:
+        raise ErroProtocolo("Ligação fechada antes da resposta.")
+    return resposta
+
+
+# Função para ler o próximo corpo de um asyncio.StreamReader (None se a ligação fechou)
+async def receber_bytes_async(leitor):
+    try:
+        cabecalho = await leitor.readexactly(CABECALHO.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ErroProtocolo("Ligação fechada a meio de uma mensagem.")
+        return None
+    (tamanho,) = CABECALHO.unpack(cabecalho)
+    if tamanho > TAMANHO_MAXIMO:
+        raise ErroProtocolo(f"Mensagem demasiado grande ({tamanho} bytes).")
+    try:
+        return await leitor.readexactly(tamanho)
+    except asyncio.IncompleteReadError:
+        raise ErroProtocolo("Ligação fechada a meio de uma mensagem.")
+
+
+class PoolLigacoes:
+    """
+    Ligações persistentes a produtores socket, reutilizadas entre pedidos e indexadas por (host, porta).
+    Antes de ser reutilizada, cada ligação é verificada (o produtor pode tê-la fechado entretanto).
+    Ligações paradas há mais de 'tempo_inativo' segundos são fechadas e uma ligação que falhe
+    a meio de um pedido nunca volta ao pool. Thread-safe: cada ligação só é usada por uma
+    thread de cada vez.
+    """
+
+    def __init__(self, timeout=5.0, tempo_inativo=60.0, maximo_por_destino=4):
+        self.timeout = timeout
+        self.tempo_inativo = tempo_inativo
+        self.maximo_por_destino = maximo_por_destino
+        self._livres = {}  # (host, porta) -> deque de (socket, instante em que foi devolvido)
+        self._lock = threading.Lock()
+
+    def _ligar(self, destino):
+        return socket.create_connection(destino, timeout=self.timeout)
+
+    @staticmethod
+    def _saudavel(ligacao):
+        # Uma ligação parada não deve ter nada para ler: EOF ou dados inesperados invalidam-na
+        try:
+            ligacao.setblocking(False)
+            try:
+                return not ligacao.recv(1, socket.MSG_PEEK)
+            except (BlockingIOError, InterruptedError):
+                return True
+        except OSError:
+            return False
+
+    def _obter_livre(self, destino):
+        self.fechar_inativas()
+        agora = time.monotonic()
+        with self._lock:
+            livres = self._livres.get(destino)
+            while livres:
+                ligacao, devolvida = livres.pop()  # A mais recente tem menos probabilidade de ter expirado
+                if agora - devolvida <= self.tempo_inativo and self._saudavel(ligacao):
+                    ligacao.settimeout(self.timeout)
+                    return ligacao
+                ligacao.close()
+        return None
+
+    def _devolver(self, destino, ligacao):
+        with self._lock:
+            livres = self._livres.setdefault(destino, deque())
+            if len(livres) < self.maximo_por_destino:
+                livres.append((ligacao, time.monotonic()))
+                return
+        ligacao.close()
+
+    @contextmanager
+    def ligacao(self, host, porta):
+        """Empresta uma ligação a (host, porta), reutilizada ou nova; é devolvida ao pool no fim."""
+        destino = (host, porta)
+        ligacao = self._obter_livre(destino) or self._ligar(destino)
+        try:
+            yield ligacao
+        except BaseException:
+            ligacao.close()
+            raise
+        self._devolver(destino, ligacao)
+
+    def pedido_resposta(self, host, porta, dados, repetir=True):
+        """
+        Envia um pedido e devolve a resposta. Se uma ligação reutilizada falhar e 'repetir' for
+        verdadeiro, o pedido é repetido uma vez numa ligação nova (só para pedidos idempotentes:
+        uma compra pode ter sido processada antes de a ligação cair).
+        """
+        destino = (host, porta)
+        reutilizada = self._obter_livre(destino)
+        if reutilizada is not None:
+            try:
+                resposta = pedido_resposta(reutilizada, dados)
+            except (OSError, ErroProtocolo):
+                reutilizada.close()
+                if not repetir:
+                    raise
+            else:
+                self._devolver(destino, reutilizada)
+                return resposta
+
+        with self.ligacao(host, porta) as ligacao:
+            return pedido_resposta(ligacao, dados)
+
+    def verificar(self, host, porta):
+        """Garante uma ligação saudável a (host, porta), criando-a só se necessário."""
+        with self.ligacao(host, porta):
+            pass
+
+    def fechar_inativas(self):
+        limite = time.monotonic() - self.tempo_inativo
+        with self._lock:
+            for destino, livres in list(self._livres.items()):
+                while livres and livres[0][1] < limite:
+                    livres.popleft()[0].close()
+                if not livres:
+                    del self._livres[destino]
+
+    def fechar(self):
+        with self._lock:
+            for livres in self._livres.values():
+                for ligacao, _ in livres:
+                    ligacao.close()
+            self._livres.clear()
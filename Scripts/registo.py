@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Registo de atualizações dos marketplaces (o dos produtores está em registo_produtores.py).
+# Guarda apenas as últimas 'capacidade' entradas (a memória não cresce com o tempo de execução)
+# e cada entrada fica como (instante, nível, mensagem, argumentos): o texto só é formatado
+# quando alguém o consulta, por isso registar durante um ciclo de atualização é barato.
+# Entradas abaixo do nível mínimo nem chegam a ser guardadas. Os argumentos ficam guardados
+# por referência: passe valores (números, texto), não estruturas que vão continuar a mudar.
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+AVISO = logging.WARNING
+ERRO = logging.ERROR
+
+NOMES_NIVEIS = {DEBUG: "DEBUG", INFO: "INFO", AVISO: "AVISO", ERRO: "ERRO"}
+NIVEIS_POR_NOME = {nome: nivel for nivel, nome in NOMES_NIVEIS.items()}
+
+
+class RegistoCircular:
+    """Registo limitado e thread-safe, com níveis e formatação adiada."""
+
+    def __init__(self, capacidade=2000, nivel_minimo=INFO):
+        self.nivel_minimo = nivel_minimo
+        self._entradas = deque(maxlen=capacidade)
+        self._lock = threading.Lock()
+
+    def registar(self, nivel, mensagem, *args):
+        if nivel < self.nivel_minimo:
+            return
+        entrada = (time.time(), nivel, mensagem, args)
+        with self._lock:
+            self._entradas.append(entrada)
+
+    def debug(self, mensagem, *args):
+        self.registar(DEBUG, mensagem, *args)
+
+    def info(self, mensagem, *args):
+        self.registar(INFO, mensagem, *args)
+
+    def aviso(self, mensagem, *args):
+        self.registar(AVISO, mensagem, *args)
+
+    def erro(self, mensagem, *args):
+        self.registar(ERRO, mensagem, *args)
+
+    @staticmethod
+    def formatar(entrada):
+        instante, nivel, mensagem, args = entrada
+        texto = mensagem % args if args else mensagem
+        return f"[{datetime.fromtimestamp(instante)}] {NOMES_NIVEIS.get(nivel, nivel)}: {texto}"
+
+    def consultar(self, nivel_minimo=DEBUG, texto=None, pagina=1, por_pagina=20):
+        """
+        Devolve (linhas, total de páginas) com as entradas mais recentes primeiro, filtradas por
+        nível e por texto (sem distinguir maiúsculas). Só as entradas da página pedida são formatadas,
+        exceto quando há filtro de texto (que precisa do texto de todas as entradas do nível).
+        """
+        with self._lock:
+            entradas = list(self._entradas)
+        entradas.reverse()
+
+        selecionadas = [entrada for entrada in entradas if entrada[1] >= nivel_minimo]
+        if texto:
+            texto = texto.lower()
+            linhas = [self.formatar(entrada) for entrada in selecionadas]
+            linhas = [linha for linha in linhas if texto in linha.lower()]
+        else:
+            linhas = selecionadas
+
+        total_paginas = max(1, -(-len(linhas) // por_pagina))
+        inicio = (min(max(pagina, 1), total_paginas) - 1) * por_pagina
+        pagina_atual = linhas[inicio:inicio + por_pagina]
+        if not texto:
+            pagina_atual = [self.formatar(entrada) for entrada in pagina_atual]
+        return pagina_atual, total_paginas
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+# Função para a opção "Ver atualizações" dos marketplaces: pede um filtro e mostra o registo
+# página a página (Enter avança, 'q' sai). Só oferece os níveis que o registo guarda.
+def exibir_registo(registo, por_pagina=20):
+    niveis = {nome: nivel for nome, nivel in NIVEIS_POR_NOME.items() if nivel >= registo.nivel_minimo}
+    omissao = NOMES_NIVEIS[max(registo.nivel_minimo, INFO)]
+    nome_nivel = input(f"Nível mínimo ({'/'.join(niveis)}, Enter para {omissao}): ").strip().upper()
+    nivel_minimo = niveis.get(nome_nivel, NIVEIS_POR_NOME[omissao])
+    texto = input("Filtrar por texto (Enter para todas): ").strip() or None
+
+    pagina = 1
+    while True:
+        linhas, total_paginas = registo.consultar(nivel_minimo, texto, pagina, por_pagina)
+        print(f"\n=== Atualizações Recentes (página {pagina}/{total_paginas}) ===")
+        for linha in linhas:
+            print(linha)
+        print("=============================")
+        if pagina >= total_paginas or input("Enter para a página seguinte, 'q' para sair: ").strip().lower() == 'q':
+            break
+        pagina += 1
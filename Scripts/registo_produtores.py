@@ -0,0 +1,145 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime
+
+from registo import AVISO, NIVEIS_POR_NOME, NOMES_NIVEIS
+
+# Registo estruturado dos produtores (o registo dos marketplaces, RegistoCircular, fica em registo.py).
+# As threads que servem pedidos só criam o LogRecord e o colocam numa fila (sem formatar nem
+# escrever); uma única thread (QueueListener) formata cada registo como uma linha JSON e escreve-o.
+# Se a fila encher (a saída não acompanha), os registos novos são descartados e contados, em vez
+# de atrasarem os pedidos; a thread de escrita avisa quantos se perderam (no máximo a cada
+# INTERVALO_DESCARTADOS segundos e ao terminar). Registos abaixo de AVISO podem ainda ser
+# amostrados (1 em cada N).
+
+TAMANHO_FILA_REGISTO = 10000
+INTERVALO_DESCARTADOS = 10.0  # Segundos entre avisos de registos descartados
+
+# Atributos de um LogRecord que não são campos passados em 'extra'
+_ATRIBUTOS_REGISTO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registo, com os campos passados em 'extra' ao lado da mensagem."""
+
+    def format(self, record):
+        dados = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": NOMES_NIVEIS.get(record.levelno, record.levelname),
+            "origem": record.name,
+            "msg": record.getMessage(),
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_REGISTO:
+                dados[chave] = valor
+        if record.exc_info:
+            dados["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar todos os registos de AVISO para cima e 1 em cada 'amostragem' dos restantes."""
+
+    def __init__(self, amostragem=1):
+        super().__init__()
+        self.amostragem = max(1, amostragem)
+        self._contador = itertools.count()
+
+    def filter(self, record):
+        return (self.amostragem == 1 or record.levelno >= AVISO
+                or next(self._contador) % self.amostragem == 0)
+
+
+class QueueHandlerNaoBloqueante(logging.handlers.QueueHandler):
+    """QueueHandler que nunca espera pela fila nem formata a mensagem na thread que regista."""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # A formatação fica para a thread do QueueListener (a fila não sai do processo)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class OuvinteRegisto(logging.handlers.QueueListener):
+    """QueueListener que escreve também um aviso com os registos que a fila descartou."""
+
+    def __init__(self, fila, manipulador_fila, *handlers):
+        super().__init__(fila, *handlers)
+        self.manipulador_fila = manipulador_fila
+        self._avisados = 0
+        self._ultimo_aviso = time.monotonic()
+
+    def handle(self, record):
+        super().handle(record)
+        if time.monotonic() - self._ultimo_aviso >= INTERVALO_DESCARTADOS:
+            self.avisar_descartados()
+
+    def avisar_descartados(self):
+        # Escrito diretamente pela thread de escrita: a fila pode ainda estar cheia
+        self._ultimo_aviso = time.monotonic()
+        novos = self.manipulador_fila.descartados - self._avisados
+        if novos > 0:
+            self._avisados += novos
+            aviso = logging.LogRecord("registo", AVISO, __file__, 0,
+                                      "%s registos descartados (fila de registo cheia)", (novos,), None)
+            aviso.descartados = novos
+            super().handle(aviso)
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Com a fila cheia, espera que a thread de escrita abra lugar
+
+    def stop(self):
+        super().stop()
+        self.avisar_descartados()
+
+
+# Função para acrescentar as opções de registo à linha de comandos de um produtor
+def adicionar_argumentos_registo(parser):
+    parser.add_argument('--log-level', default='INFO', choices=list(NIVEIS_POR_NOME),
+                        help='Minimum level written to the log.')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='Keep 1 in N records below AVISO (1 keeps everything).')
+    parser.add_argument('--log-format', choices=['json', 'texto'], default='json',
+                        help='Log line format.')
+
+
+# Função para configurar o registo de um produtor a partir dos argumentos da linha de comandos.
+# A fila fica no logger raiz, por isso todos os módulos (werkzeug, servidor_wsgi, ...) passam por ela;
+# devolve o logger da aplicação.
+def configurar_registo(nome, args=None, saida=None):
+    nivel = NIVEIS_POR_NOME[getattr(args, 'log_level', 'INFO')]
+    amostragem = getattr(args, 'log_sample', 1)
+    formato = getattr(args, 'log_format', 'json')
+
+    fila = queue.Queue(TAMANHO_FILA_REGISTO)
+    manipulador = QueueHandlerNaoBloqueante(fila)
+    manipulador.addFilter(FiltroAmostragem(amostragem))
+
+    escrita = logging.StreamHandler(saida or sys.stdout)
+    if formato == 'json':
+        escrita.setFormatter(FormatadorJSON())
+    else:
+        escrita.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s %(name)s: %(message)s"))
+    ouvinte = OuvinteRegisto(fila, manipulador, escrita)
+    ouvinte.start()
+    atexit.register(ouvinte.stop)  # Escreve o que ainda estiver na fila (e os descartados) antes de sair
+
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [manipulador]
+    raiz.setLevel(nivel)
+    logging.getLogger('werkzeug').setLevel(nivel)  # O werkzeug fixa INFO se não tiver nível próprio
+    return logging.getLogger(nome)
@@ -0,0 +1,168 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# Modo de produção dos produtores REST (Flask), em vez do servidor de desenvolvimento do app.run.
+#
+# O processo principal abre o socket e cria 'workers' processos (fork) que aceitam ligações
+# desse mesmo socket; cada worker serve os pedidos com um conjunto limitado de 'threads'.
+# Um worker que morra é substituído. Em sistemas sem fork (Windows) serve-se num só processo.
+#
+# Cada ligação HTTP/1.1 ocupa uma thread enquanto estiver aberta, por isso as ligações
+# keep-alive paradas são fechadas ao fim de TIMEOUT_LIGACAO segundos. Uma subscrição
+# /eventos ocupa uma thread durante toda a subscrição; os produtores aceitam no máximo
+# metade de --threads subscrições por worker e respondem 503 às restantes.
+#
+# Ligações aceites à espera de uma thread livre ficam numa fila limitada (LIGACOES_EM_ESPERA);
+# com a fila cheia o worker responde logo 503 e fecha a ligação, em vez de a fila crescer
+# sem limite e todos os pedidos esperarem cada vez mais.
+
+registo = logging.getLogger("servidor_wsgi")
+
+TIMEOUT_LIGACAO = 5  # Segundos que uma ligação keep-alive pode ficar parada
+LIGACOES_EM_ESPERA = 64  # Ligações aceites à espera de uma thread, por worker, antes de responder 503
+_CORPO_SOBRECARGA = b"Servidor sobrecarregado"
+RESPOSTA_SOBRECARGA = (b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n"
+                       b"Retry-After: 1\r\nConnection: close\r\n\r\n%s" % (len(_CORPO_SOBRECARGA), _CORPO_SOBRECARGA))
+
+
+class PedidoWSGI(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = TIMEOUT_LIGACAO
+
+
+class ServidorWSGI(BaseWSGIServer):
+    """Servidor werkzeug que serve cada ligação numa thread de um conjunto limitado, com fila limitada."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None, multiprocess=False, em_espera=LIGACOES_EM_ESPERA):
+        self.multiprocess = multiprocess
+        super().__init__(host, port, app, handler=PedidoWSGI, fd=fd)
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._maximo_ligacoes = threads + em_espera  # A servir + à espera de uma thread
+        self._ligacoes = 0
+        self._lock_ligacoes = threading.Lock()
+        self.recusadas = 0
+
+    def process_request(self, request, client_address):
+        with self._lock_ligacoes:
+            aceite = self._ligacoes < self._maximo_ligacoes
+            if aceite:
+                self._ligacoes += 1
+            else:
+                self.recusadas += 1
+        if not aceite:
+            self._recusar(request, client_address)
+            return
+        self._executor.submit(self._processar, request, client_address)
+
+    def _recusar(self, request, client_address):
+        if self.recusadas % 1000 == 1:
+            registo.warning("Sobrecarga: %s ligações recusadas com 503", self.recusadas)
+        try:
+            request.settimeout(1)
+            request.sendall(RESPOSTA_SOBRECARGA)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def _processar(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock_ligacoes:
+                self._ligacoes -= 1
+
+
+# Função para acrescentar as opções do modo de produção à linha de comandos de um produtor
+def adicionar_argumentos_servidor(parser):
+    parser.add_argument('--producao', action='store_true',
+                        help='Serve with the multi-process production server instead of the Flask development server.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes in production mode.')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Threads per worker process in production mode.')
+
+
+def _abrir_socket(host, port):
+    servidor = socket.create_server((host, port), backlog=1024)
+    servidor.set_inheritable(True)
+    return servidor
+
+
+def _executar_worker(app, host, port, threads, fd, ao_iniciar_worker):
+    # Os sinais do processo principal não se aplicam aos workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        if ao_iniciar_worker is not None:
+            ao_iniciar_worker()
+        ServidorWSGI(host, port, app, threads, fd=fd, multiprocess=True).serve_forever()
+    finally:
+        os._exit(1)
+
+
+# Função para servir 'app' em modo de produção. 'ao_iniciar_worker' corre em cada worker logo a
+# seguir ao fork (ligar ao estado partilhado, reconfigurar o registo); 'ao_iniciar' corre no
+# processo principal depois de os workers arrancarem (ex.: threads de registo no gestor).
+def servir(app, host, port, workers=1, threads=16, ao_iniciar_worker=None, ao_iniciar=None):
+    if workers <= 1 or not hasattr(os, 'fork'):
+        if workers > 1:
+            registo.warning("Sem fork neste sistema: a servir num só processo com %s threads", threads)
+        if ao_iniciar_worker is not None:
+            ao_iniciar_worker()
+        if ao_iniciar is not None:
+            ao_iniciar()
+        registo.info("A servir em %s:%s (1 processo, %s threads)", host, port, threads)
+        ServidorWSGI(host, port, app, threads).serve_forever()
+        return
+
+    servidor = _abrir_socket(host, port)
+    ativos = {}
+
+    def criar_worker():
+        pid = os.fork()
+        if pid == 0:
+            _executar_worker(app, host, port, threads, servidor.fileno(), ao_iniciar_worker)
+        ativos[pid] = time.monotonic()
+
+    for _ in range(workers):
+        criar_worker()
+    registo.info("A servir em %s:%s (%s workers x %s threads)", host, port, workers, threads)
+    if ao_iniciar is not None:
+        ao_iniciar()
+
+    def terminar(sinal, _):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminar)
+    try:
+        while True:
+            time.sleep(1)
+            # Só os workers: outros processos filhos (ex.: o gestor do estado partilhado) não são recolhidos aqui
+            for pid in list(ativos):
+                terminado, estado = os.waitpid(pid, os.WNOHANG)
+                if terminado:
+                    del ativos[pid]
+                    registo.warning("Worker %s terminou (estado %s); a criar outro", pid, estado)
+                    criar_worker()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in ativos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        servidor.close()
@@ -0,0 +1,203 @@
+import json
+import socket
+import threading
+import time
+from concurrent.futures import wait
+
+from protocolo import ErroProtocolo, LeitorMensagens, enviar_mensagem
+
+# Sincronização dos produtos disponíveis de um marketplace com os produtores socket
+# (MarketPlace2Fase, MarketPlaceSeguro): ciclo de atualização periódico e subscrições de alterações.
+
+PRAZO_CICLO = 15             # Segundos para um ciclo de atualização completo
+TIMEOUT_SUBSCRICAO = 45      # Segundos sem eventos (o produtor envia um a cada 15 s) até religar
+INTERVALO_RESUBSCRICAO = 5   # Segundos entre tentativas de voltar a subscrever
+
+
+# Função para aplicar a taxa de revenda ao preço de um produto recebido
+def aplicar_taxa_revenda(produto):
+    taxa_revenda = produto.get('taxa_revenda', 0)  # Valor padrão caso não exista = 0
+    produto['preco'] *= (1 + taxa_revenda)
+
+
+class SincronizacaoProdutores:
+    """
+    Mantém 'produtos_disponiveis' (protegido por 'lock', partilhados com o menu do marketplace)
+    a par dos produtores socket de 'produtores'. Cada produtor é um dicionário com o host, a porta
+    (nas chaves indicadas em 'chaves') e as categorias; os pedidos seguem pelas ligações de 'pool'
+    e as mensagens vão para 'registo' (RegistoCircular).
+
+    Só são pedidas as alterações desde a última versão conhecida de cada produtor; a lista
+    completa só na primeira vez, quando o produtor reiniciou ou quando já não tem as alterações
+    em falta. Os produtores com uma subscrição ativa não entram no ciclo periódico.
+    """
+
+    def __init__(self, produtores, produtos_disponiveis, lock, registo, pool, chaves=('host', 'port')):
+        self.produtores = produtores
+        self.produtos_disponiveis = produtos_disponiveis
+        self.lock = lock
+        self.registo = registo
+        self.pool = pool
+        self.chaves = chaves
+        self.origem_categorias = {}  # Categoria -> (host, porta) do produtor socket que a listou por último
+        self.versoes = {}  # (host, porta) -> {"instancia", "versao"} do catálogo do produtor já aplicado
+        self.lock_versoes = threading.Lock()
+        self.subscritos = set()  # (host, porta) dos produtores com subscrição ativa
+
+    def destino(self, produtor):
+        return produtor[self.chaves[0]], produtor[self.chaves[1]]
+
+    # Consulta um produtor socket; devolve {"incremental", "produtos", "estado"} ou None em caso de erro
+    def consultar_produtor(self, produtor):
+        destino = self.destino(produtor)
+        estado = self.versoes.get(destino, {})
+        try:
+            alteracoes = self.pool.pedido_resposta(*destino, {
+                "type": "alteracoesDesde",
+                "instancia": estado.get("instancia"),
+                "versao": estado.get("versao"),
+                "categorias": produtor['categorias']
+            })
+            suporta_alteracoes = isinstance(alteracoes, dict) and "resincronizar" in alteracoes
+            if suporta_alteracoes and not alteracoes["resincronizar"]:
+                return {"incremental": True, "produtos": alteracoes["alteracoes"], "estado": alteracoes}
+
+            request = {
+                "type": "listarProdutos",
+                "categorias": produtor['categorias']
+            }
+            produtos = self.pool.pedido_resposta(*destino, request)
+            if isinstance(produtos, dict):  # Verifica se é um dicionário
+                return {"incremental": False, "produtos": produtos, "estado": alteracoes if suporta_alteracoes else None}
+            print(f"Erro: Resposta inesperada do servidor: {produtos}")
+        except (ConnectionRefusedError, ConnectionResetError, socket.error, ErroProtocolo) as e:
+            self.registo.erro("Erro ao conectar ao produtor %s:%s: %s", destino[0], destino[1], e)
+        except json.JSONDecodeError as e:
+            print(f"Erro ao decodificar a resposta JSON: {e}")
+        return None
+
+    # Aplica a resposta de um produtor aos produtos disponíveis (substitui as categorias)
+    def aplicar_produtos(self, produtor, produtos):
+        destino = self.destino(produtor)
+        with self.lock:
+            for categoria, lista_produtos in produtos.items():
+                if isinstance(lista_produtos, list):  # Verifica se é uma lista
+                    for produto in lista_produtos:
+                        if isinstance(produto, dict):  # Verifica se o produto é um dicionário
+                            aplicar_taxa_revenda(produto)
+                    self.produtos_disponiveis[categoria] = lista_produtos
+                    self.origem_categorias[categoria] = destino
+                    self.registo.info("Produtos atualizados de %s:%s - Categoria: %s", destino[0], destino[1], categoria)
+                    for produto in lista_produtos:
+                        self.registo.debug(
+                            "  - Produto: %s, Quantidade: %s, Preço: €%.2f",
+                            produto['nome'], produto['quantidade'], produto['preco'])
+
+    # Aplica só os produtos alterados. Uma categoria listada por outro produtor (o último a
+    # enviá-la por completo) não é alterada.
+    def aplicar_alteracoes(self, produtor, alteracoes):
+        destino = self.destino(produtor)
+        with self.lock:
+            for categoria, alterados in alteracoes.items():
+                lista_produtos = self.produtos_disponiveis.get(categoria)
+                if lista_produtos is None or self.origem_categorias.get(categoria) != destino:
+                    continue
+                por_nome = {produto['nome']: produto for produto in lista_produtos}
+                for produto in alterados:
+                    aplicar_taxa_revenda(produto)
+                    existente = por_nome.get(produto['nome'])
+                    if existente is None:
+                        lista_produtos.append(produto)
+                    else:
+                        existente.update(produto)
+                    self.registo.info(
+                        "Produto alterado em %s:%s - Categoria: %s, Produto: %s, Quantidade: %s, Preço: €%.2f",
+                        destino[0], destino[1], categoria, produto['nome'], produto['quantidade'], produto['preco'])
+
+    # Aplica o resultado de uma consulta ou de um evento de subscrição. A versão conhecida do
+    # produtor só avança depois de a resposta ser aplicada, e uma resposta que não seja mais
+    # recente do que a já aplicada (ciclo e subscrição em simultâneo) é ignorada.
+    def aplicar_consulta(self, produtor, consulta):
+        destino = self.destino(produtor)
+        estado = consulta["estado"]
+        with self.lock_versoes:
+            conhecido = self.versoes.get(destino)
+            if (estado is not None and conhecido is not None and conhecido["instancia"] == estado["instancia"]
+                    and estado["versao"] <= conhecido["versao"]):
+                return
+
+            if consulta["incremental"]:
+                self.aplicar_alteracoes(produtor, consulta["produtos"])
+            else:
+                self.aplicar_produtos(produtor, consulta["produtos"])
+
+            if estado is not None:
+                self.versoes[destino] = {"instancia": estado["instancia"], "versao": estado["versao"]}
+            else:
+                self.versoes.pop(destino, None)
+
+    # Um ciclo de atualização: todos os produtores sem subscrição ativa são consultados em paralelo
+    # (em 'executor'), por isso o ciclo demora o tempo do produtor mais lento (limitado por 'prazo')
+    # e não a soma de todos. As respostas são aplicadas pela ordem de 'produtores'.
+    def atualizar_ciclo(self, executor, prazo=PRAZO_CICLO):
+        consultados = [produtor for produtor in self.produtores if self.destino(produtor) not in self.subscritos]
+        futuros = [executor.submit(self.consultar_produtor, produtor) for produtor in consultados]
+        _, pendentes = wait(futuros, timeout=prazo)
+
+        for produtor, futuro in zip(consultados, futuros):
+            if futuro in pendentes:
+                futuro.cancel()
+                self.registo.aviso("Produtor %s:%s não respondeu dentro do prazo do ciclo.", *self.destino(produtor))
+                continue
+            consulta = futuro.result()
+            if consulta is not None:
+                self.aplicar_consulta(produtor, consulta)
+
+    # Mantém uma subscrição de alterações a um produtor socket: cada compra no produtor chega
+    # como evento e é aplicada logo, em vez de esperar pelo ciclo periódico. Se a ligação cair,
+    # o produtor volta ao ciclo periódico até a subscrição ser restabelecida.
+    def subscrever_produtor(self, produtor):
+        destino = self.destino(produtor)
+        while True:
+            try:
+                with socket.create_connection(destino, timeout=self.pool.timeout) as ligacao:
+                    estado = self.versoes.get(destino, {})
+                    enviar_mensagem(ligacao, {
+                        "type": "subscrever",
+                        "categorias": produtor['categorias'],
+                        "instancia": estado.get("instancia"),
+                        "versao": estado.get("versao")
+                    })
+                    ligacao.settimeout(TIMEOUT_SUBSCRICAO)
+                    leitor = LeitorMensagens(ligacao)
+                    while True:
+                        evento = leitor.receber()
+                        if evento is None:
+                            break
+                        if not (isinstance(evento, dict) and evento.get("type") == "alteracoes"):
+                            self.registo.aviso(
+                                "Produtor %s:%s não suporta subscrições; continua a ser consultado periodicamente.",
+                                destino[0], destino[1])
+                            return
+                        self.subscritos.add(destino)
+
+                        if evento["resincronizar"]:
+                            request = {
+                                "type": "listarProdutos",
+                                "categorias": produtor['categorias']
+                            }
+                            produtos = self.pool.pedido_resposta(*destino, request)
+                            self.aplicar_consulta(produtor, {"incremental": False, "produtos": produtos, "estado": evento})
+                        else:
+                            self.aplicar_consulta(produtor,
+                                                  {"incremental": True, "produtos": evento["alteracoes"], "estado": evento})
+            except (OSError, ErroProtocolo, json.JSONDecodeError) as e:
+                self.registo.aviso("Subscrição ao produtor %s:%s interrompida: %s", destino[0], destino[1], e)
+            finally:
+                self.subscritos.discard(destino)
+            time.sleep(INTERVALO_RESUBSCRICAO)
+
+    # Inicia uma thread de subscrição por produtor socket
+    def iniciar_subscricoes(self):
+        for produtor in self.produtores:
+            threading.Thread(target=self.subscrever_produtor, args=(produtor,), daemon=True).start()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+from protocolo import codificar_mensagem, enviar_mensagem, receber_bytes_async
+
+# Subscrições de alterações de stock: em vez de esperar pelo próximo ciclo de atualização,
+# o marketplace recebe um evento sempre que uma compra altera o catálogo.
+#
+# Cada subscritor guarda apenas a sua posição (instância, versão) no registo de alterações do
+# Catalogo. Ao acordar, pede tudo o que mudou desde essa posição, já agregado por produto,
+# por isso um subscritor lento nunca acumula uma fila: recebe menos eventos, cada um com o
+# estado mais recente. O envio é bloqueante (ou espera pelo drain), o que trava o produtor
+# apenas para esse subscritor; quem não lê durante TIMEOUT_ENVIO é desligado. Se o registo
+# deixar de cobrir a posição do subscritor, o evento pede a ressincronização completa.
+#
+# Nos produtores REST cada subscrição (SSE) ocupa uma thread do servidor durante toda a sua
+# duração; LimiteSubscricoes recusa as que passem do limite, para sobrarem threads para as
+# compras e listagens.
+
+INTERVALO_AGRUPAMENTO = 0.05  # Alterações que chegam neste intervalo seguem no mesmo evento
+INTERVALO_ATIVIDADE = 15.0    # Sem alterações, é enviado um evento vazio (deteta ligações mortas)
+TIMEOUT_ENVIO = 30.0          # Segundos que um subscritor pode ficar sem ler antes de ser desligado
+MAXIMO_SUBSCRICOES_HTTP = 8   # Subscrições SSE abertas ao mesmo tempo em cada processo
+
+
+class CursorAlteracoes:
+    """Posição de um subscritor no registo de alterações do catálogo."""
+
+    def __init__(self, catalogo, instancia=None, versao=None, categorias=None, formatar=dict):
+        self.catalogo = catalogo
+        self.instancia = instancia
+        self.versao = versao
+        self.categorias = categorias
+        self.formatar = formatar
+        self._ultimo_envio = None
+
+    def proximo(self):
+        """
+        Devolve o próximo evento ({"instancia", "versao", "resincronizar", "alteracoes"}) e avança
+        a posição, ou None se não houver nada novo para estas categorias nem for altura de um
+        evento de atividade.
+        """
+        resposta = self.catalogo.resposta_alteracoes(self.instancia, self.versao, self.categorias, self.formatar)
+        self.instancia, self.versao = resposta["instancia"], resposta["versao"]
+
+        agora = time.monotonic()
+        if (resposta["resincronizar"] or resposta["alteracoes"] or self._ultimo_envio is None
+                or agora - self._ultimo_envio >= INTERVALO_ATIVIDADE):
+            self._ultimo_envio = agora
+            return resposta
+        return None
+
+
+class LimiteSubscricoes:
+    """Conta as subscrições abertas num processo e recusa as que passem de 'maximo'."""
+
+    def __init__(self, maximo=MAXIMO_SUBSCRICOES_HTTP):
+        self.maximo = maximo
+        self._abertas = 0
+        self._lock = threading.Lock()
+
+    def entrar(self):
+        """Reserva um lugar para uma subscrição; devolve False se o limite já foi atingido."""
+        with self._lock:
+            if self._abertas >= self.maximo:
+                return False
+            self._abertas += 1
+            return True
+
+    def sair(self):
+        with self._lock:
+            self._abertas -= 1
+
+
+# Gerador de eventos para um subscritor (bloqueia a thread entre eventos)
+def eventos(cursor):
+    while True:
+        evento = cursor.proximo()
+        if evento is not None:
+            yield evento
+        if cursor.catalogo.esperar_alteracao(cursor.versao, INTERVALO_ATIVIDADE) != cursor.versao:
+            time.sleep(INTERVALO_AGRUPAMENTO)
+
+
+# Função para servir uma subscrição numa ligação socket (modo threads). A partir do pedido
+# "subscrever" a ligação só transporta eventos, até o marketplace a fechar.
+def servir_subscricao(conexao, catalogo, pedido, formatar=dict):
+    conexao.settimeout(TIMEOUT_ENVIO)
+    cursor = CursorAlteracoes(catalogo, pedido.get('instancia'), pedido.get('versao'),
+                              pedido.get('categorias'), formatar)
+    for evento in eventos(cursor):
+        enviar_mensagem(conexao, {"type": "alteracoes", **evento})
+
+
+# Função para servir uma subscrição no modo asyncio. O catálogo acorda o event loop através de
+# call_soon_threadsafe; qualquer mensagem do marketplace ou o fecho da ligação terminam a subscrição.
+async def servir_subscricao_async(leitor, escritor, catalogo, pedido, formatar=dict):
+    loop = asyncio.get_running_loop()
+    alterado = asyncio.Event()
+
+    def observador():
+        loop.call_soon_threadsafe(alterado.set)
+
+    cursor = CursorAlteracoes(catalogo, pedido.get('instancia'), pedido.get('versao'),
+                              pedido.get('categorias'), formatar)
+    fim = asyncio.ensure_future(receber_bytes_async(leitor))
+    catalogo.adicionar_observador(observador)
+    try:
+        while not fim.done():
+            alterado.clear()
+            evento = cursor.proximo()
+            if evento is not None:
+                escritor.write(codificar_mensagem({"type": "alteracoes", **evento}))
+                await asyncio.wait_for(escritor.drain(), TIMEOUT_ENVIO)
+
+            if catalogo.versao_catalogo() == cursor.versao:
+                espera = asyncio.ensure_future(alterado.wait())
+                await asyncio.wait({espera, fim}, timeout=INTERVALO_ATIVIDADE, return_when=asyncio.FIRST_COMPLETED)
+                espera.cancel()
+            if alterado.is_set():
+                await asyncio.sleep(INTERVALO_AGRUPAMENTO)
+    finally:
+        catalogo.remover_observador(observador)
+        if fim.done() and not fim.cancelled():
+            fim.exception()  # Já tratado: a ligação terminou
+        fim.cancel()
@@ -0,0 +1,313 @@
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.x509 import load_pem_x509_certificate
+
+# Verificação das respostas assinadas dos produtores seguros, do lado dos marketplaces.
+#
+# Cada resposta traz a mensagem, a assinatura (PSS/SHA256) e o certificado do produtor, emitido
+# pelo gestor (PKCS1v15/SHA256). O certificado é o mesmo em todas as respostas de um produtor
+# até este mudar de chave: a chave pública do gestor é lida do disco uma só vez e o resultado da
+# verificação de cada certificado fica guardado pela impressão digital (SHA256 do PEM), com
+# validade limitada e despejo do menos usado. Assim só a verificação da assinatura de cada
+# mensagem custa uma operação de chave pública. Certificados inválidos não são guardados.
+#
+# As mensagens já verificadas também ficam guardadas, por (impressão digital do certificado,
+# SHA256 da mensagem): uma listagem que não mudou (o produtor reenvia a mesma resposta assinada)
+# não volta a ser verificada. Estas entradas expiram com o certificado que as validou.
+#
+# PoolVerificacao tira as verificações da thread que faz os pedidos: cada resposta é entregue
+# ao pool logo que chega e a thread segue para o pedido seguinte, recolhendo os resultados no
+# fim. Com vários CPUs as verificações correm em processos à parte (cada um com a sua cache de
+# certificados); com um só CPU, ou sem processos, numa thread.
+#
+# Codificação da assinatura: o marketplace pede base64 com o cabeçalho CABECALHO_CODIFICACAO e
+# um produtor que o conheça responde com "codificacao_assinatura": "base64". Sem o cabeçalho (ou
+# com um produtor antigo) a assinatura vem em bytes descodificados como cp437, que o JSON escapa
+# em "\uXXXX" e ocupa cerca de três vezes mais.
+#
+# Envelope assinado: com o cabeçalho CABECALHO_ENVELOPE o produtor devolve no corpo os bytes
+# canónicos da mensagem, exatamente os que assinou, seguidos de um objeto JSON não assinado com o
+# certificado e os anexos (ex.: provas do manifesto); a assinatura (base64) e o número de bytes da
+# mensagem seguem em cabeçalhos. O marketplace verifica os bytes recebidos tal como chegaram, sem
+# voltar a serializar a mensagem. ler_resposta_assinada() lê os dois formatos.
+
+CAMINHO_CHAVE_GESTOR = "./manager_public_key.pem"
+MAXIMO_CERTIFICADOS = 256   # Certificados verificados guardados (LRU)
+VALIDADE_CERTIFICADO = 300  # Segundos até um certificado guardado voltar a ser verificado
+MAXIMO_MENSAGENS = 4096     # Mensagens verificadas guardadas (LRU)
+
+CABECALHO_CODIFICACAO = "X-Codificacao-Assinatura"
+CODIFICACAO_BASE64 = "base64"
+CODIFICACAO_CP437 = "cp437"
+CABECALHO_ENVELOPE = "X-Envelope-Assinado"
+CABECALHO_ASSINATURA = "X-Assinatura"
+CABECALHO_TAMANHO_MENSAGEM = "X-Tamanho-Mensagem"
+TIPO_ENVELOPE = "application/octet-stream"
+
+# Cabeçalhos dos pedidos às rotas /secure: envelope assinado ou, nos produtores que não o conhecem, base64
+CABECALHOS_ASSINATURA = {CABECALHO_ENVELOPE: "1", CABECALHO_CODIFICACAO: CODIFICACAO_BASE64}
+
+# Resultado de uma verificação no pool: None se for válida, senão (etapa, erro)
+ETAPA_CERTIFICADO = "certificado"
+ETAPA_ASSINATURA = "assinatura"
+
+
+class VerificadorCertificados:
+    """Chave pública do gestor carregada uma vez e cache dos certificados e das mensagens já verificados."""
+
+    def __init__(self, caminho_chave_gestor=CAMINHO_CHAVE_GESTOR, capacidade=MAXIMO_CERTIFICADOS,
+                 validade=VALIDADE_CERTIFICADO, capacidade_mensagens=MAXIMO_MENSAGENS):
+        self.caminho_chave_gestor = caminho_chave_gestor
+        self.capacidade = capacidade
+        self.validade = validade
+        self.capacidade_mensagens = capacidade_mensagens
+        self._chave_gestor = None
+        self._certificados = OrderedDict()  # impressão digital -> (expira, chave pública do produtor)
+        self._mensagens = OrderedDict()  # (impressão digital, SHA256 da mensagem) -> expira
+        self._lock = threading.Lock()
+
+    def chave_gestor(self):
+        """Chave pública do gestor; é lida do disco no primeiro uso (e de novo só se essa leitura falhar)."""
+        chave = self._chave_gestor
+        if chave is None:
+            with open(self.caminho_chave_gestor, "rb") as key_file:
+                chave = load_pem_public_key(key_file.read())
+            self._chave_gestor = chave
+        return chave
+
+    def chave_produtor(self, certificado_pem):
+        """
+        Devolve a chave pública de um certificado emitido pelo gestor. Lança InvalidSignature
+        se o certificado não tiver sido assinado pelo gestor (ou ValueError se não for um PEM válido).
+        """
+        if isinstance(certificado_pem, str):
+            certificado_pem = certificado_pem.encode("utf-8")
+        return self._certificado(certificado_pem, hashlib.sha256(certificado_pem).digest())[1]
+
+    def verificar_mensagem(self, mensagem_bytes, assinatura, certificado_pem):
+        """
+        Verifica o certificado e a assinatura PSS/SHA256 de 'mensagem_bytes'; lança InvalidSignature
+        (ou ValueError) se algum não for válido. Uma mensagem já verificada com o mesmo certificado
+        não volta a ser verificada.
+        """
+        if isinstance(certificado_pem, str):
+            certificado_pem = certificado_pem.encode("utf-8")
+        if self.mensagem_verificada(mensagem_bytes, certificado_pem):
+            return
+        expira, chave = self._certificado(certificado_pem, hashlib.sha256(certificado_pem).digest())
+        verificar_assinatura(chave, mensagem_bytes, assinatura)
+        self.registar_mensagem(mensagem_bytes, certificado_pem, expira)
+
+    def mensagem_verificada(self, mensagem_bytes, certificado_pem):
+        """True se 'mensagem_bytes' já foi verificada com este certificado (e a entrada não expirou)."""
+        chave_mensagem = self._chave_mensagem(mensagem_bytes, certificado_pem)
+        with self._lock:
+            expira = self._mensagens.get(chave_mensagem)
+            if expira is None or expira <= time.monotonic():
+                return False
+            self._mensagens.move_to_end(chave_mensagem)
+            return True
+
+    def registar_mensagem(self, mensagem_bytes, certificado_pem, expira=None):
+        """Guarda uma mensagem verificada (ex.: noutro processo) até 'expira' (por omissão, a validade)."""
+        chave_mensagem = self._chave_mensagem(mensagem_bytes, certificado_pem)
+        if expira is None:
+            expira = time.monotonic() + self.validade
+        with self._lock:
+            self._mensagens[chave_mensagem] = expira
+            self._mensagens.move_to_end(chave_mensagem)
+            while len(self._mensagens) > self.capacidade_mensagens:
+                self._mensagens.popitem(last=False)
+
+    @staticmethod
+    def _chave_mensagem(mensagem_bytes, certificado_pem):
+        if isinstance(certificado_pem, str):
+            certificado_pem = certificado_pem.encode("utf-8")
+        return hashlib.sha256(certificado_pem).digest(), hashlib.sha256(mensagem_bytes).digest()
+
+    def _certificado(self, certificado_pem, impressao):
+        # Devolve (expira, chave pública) do certificado, verificando-o só se não estiver na cache
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._certificados.get(impressao)
+            if entrada is not None and entrada[0] > agora:
+                self._certificados.move_to_end(impressao)
+                return entrada
+
+        certificado = load_pem_x509_certificate(certificado_pem)
+        self.chave_gestor().verify(
+            certificado.signature,
+            certificado.tbs_certificate_bytes,
+            padding.PKCS1v15(),
+            hashes.SHA256()
+        )
+        entrada = (agora + self.validade, certificado.public_key())
+        with self._lock:
+            self._certificados[impressao] = entrada
+            self._certificados.move_to_end(impressao)
+            while len(self._certificados) > self.capacidade:
+                self._certificados.popitem(last=False)
+        return entrada
+
+    def esquecer(self):
+        """Esvazia as caches (ex.: depois de mudar a chave do gestor)."""
+        with self._lock:
+            self._certificados.clear()
+            self._mensagens.clear()
+        self._chave_gestor = None
+
+
+# Função para codificar os bytes de uma assinatura para o JSON da resposta
+def codificar_assinatura(assinatura, codificacao=CODIFICACAO_CP437):
+    if codificacao == CODIFICACAO_BASE64:
+        return base64.b64encode(assinatura).decode('ascii')
+    return assinatura.decode('cp437')
+
+
+# Função para obter os bytes da assinatura de uma resposta ('codificacao' é o campo codificacao_assinatura,
+# ausente nos produtores antigos); lança ValueError se o texto não estiver na codificação indicada
+def descodificar_assinatura(assinatura, codificacao=None):
+    if codificacao == CODIFICACAO_BASE64:
+        return base64.b64decode(assinatura, validate=True)  # binascii.Error é um ValueError
+    return assinatura.encode('cp437')
+
+
+# Função para ler uma resposta assinada (requests.Response), em envelope ou em JSON. Devolve um dicionário
+# com 'mensagem', 'mensagem_bytes' (os bytes a verificar), 'assinatura' (bytes), 'certificado' (PEM) e os
+# anexos; lança ValueError, KeyError ou TypeError se a resposta estiver malformada.
+def ler_resposta_assinada(resposta):
+    assinatura = resposta.headers.get(CABECALHO_ASSINATURA)
+    if assinatura is None:
+        # Produtor sem envelope: a mensagem tem de voltar a ser serializada para verificar a assinatura
+        conteudo = resposta.json()
+        mensagem = conteudo['mensagem']
+        if isinstance(mensagem, str):
+            conteudo['mensagem_bytes'] = mensagem.encode('utf-8')
+        else:
+            conteudo['mensagem_bytes'] = json.dumps(mensagem).encode('utf-8')
+        conteudo['assinatura'] = descodificar_assinatura(conteudo['assinatura'], conteudo.get('codificacao_assinatura'))
+        return conteudo
+
+    corpo = resposta.content
+    tamanho = int(resposta.headers[CABECALHO_TAMANHO_MENSAGEM])
+    if not 0 < tamanho < len(corpo):
+        raise ValueError(f"Tamanho da mensagem inválido: {tamanho}")
+    mensagem_bytes = corpo[:tamanho]
+    conteudo = json.loads(corpo[tamanho:])
+    if not isinstance(conteudo, dict):
+        raise TypeError("Anexos do envelope inválidos")
+    conteudo['mensagem'] = json.loads(mensagem_bytes)
+    conteudo['mensagem_bytes'] = mensagem_bytes
+    conteudo['assinatura'] = base64.b64decode(assinatura, validate=True)
+    return conteudo
+
+
+# Função para verificar a assinatura PSS/SHA256 de uma mensagem; lança InvalidSignature se não for válida
+def verificar_assinatura(chave_publica, mensagem_bytes, assinatura):
+    chave_publica.verify(
+        assinatura,
+        mensagem_bytes,
+        padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=padding.PSS.MAX_LENGTH
+        ),
+        hashes.SHA256()
+    )
+
+
+# Função que verifica certificado e assinatura de uma resposta; devolve None se for válida, senão (etapa, erro)
+def verificar_resposta(verificador, mensagem_bytes, assinatura, certificado_pem):
+    try:
+        verificador.chave_produtor(certificado_pem)
+    except Exception as e:
+        return ETAPA_CERTIFICADO, str(e)
+    try:
+        verificador.verificar_mensagem(mensagem_bytes, assinatura, certificado_pem)
+    except Exception as e:
+        return ETAPA_ASSINATURA, str(e)
+    return None
+
+
+MAXIMO_PROCESSOS_VERIFICACAO = 4  # Cada processo do pool tem a sua chave do gestor e as suas caches
+
+_verificador_processo = None  # Verificador de cada processo do pool
+
+
+def _iniciar_processo(caminho_chave_gestor):
+    global _verificador_processo
+    _verificador_processo = VerificadorCertificados(caminho_chave_gestor)
+
+
+def _verificar_no_processo(mensagem_bytes, assinatura, certificado_pem):
+    return verificar_resposta(_verificador_processo, mensagem_bytes, assinatura, certificado_pem)
+
+
+class PoolVerificacao:
+    """
+    Verificações de respostas assinadas em paralelo com os pedidos. verificar() devolve logo um
+    Future cujo resultado é None (válida) ou (etapa, erro); as mensagens já verificadas pelo
+    'verificador' são respondidas sem passar pelo pool.
+
+    Os processos são criados com spawn: o pool arranca no primeiro pedido, quando o marketplace
+    já tem threads (pedidos, subscrições, registo) cujos locks um fork copiaria presos.
+    """
+
+    def __init__(self, verificador, processos=None):
+        self.verificador = verificador
+        if processos is None:
+            processos = min(MAXIMO_PROCESSOS_VERIFICACAO, os.cpu_count() or 1)
+        self.processos = processos
+        self._executor = None
+        self._em_processos = False
+        self._lock = threading.Lock()
+
+    def _obter_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.processos > 1:
+                    self._executor = ProcessPoolExecutor(self.processos, multiprocessing.get_context('spawn'),
+                                                         initializer=_iniciar_processo,
+                                                         initargs=(self.verificador.caminho_chave_gestor,))
+                    self._em_processos = True
+                else:
+                    self._executor = ThreadPoolExecutor(1)
+            return self._executor
+
+    def verificar(self, mensagem_bytes, assinatura, certificado_pem):
+        if self.verificador.mensagem_verificada(mensagem_bytes, certificado_pem):
+            futuro = Future()
+            futuro.set_result(None)
+            return futuro
+
+        executor = self._obter_executor()
+        if not self._em_processos:
+            return executor.submit(verificar_resposta, self.verificador, mensagem_bytes, assinatura, certificado_pem)
+
+        if isinstance(certificado_pem, str):
+            certificado_pem = certificado_pem.encode("utf-8")
+        futuro = executor.submit(_verificar_no_processo, mensagem_bytes, assinatura, certificado_pem)
+
+        # O processo que verificou guarda a mensagem na sua cache; guardá-la também aqui
+        def guardar(concluido):
+            if not concluido.cancelled() and concluido.exception() is None and concluido.result() is None:
+                self.verificador.registar_mensagem(mensagem_bytes, certificado_pem)
+
+        futuro.add_done_callback(guardar)
+        return futuro
+
+    def fechar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None